@@ -0,0 +1,79 @@
+"""
+Transaction ingestion throughput: adding signed transactions one at a time
+with BlockChain.add_transaction vs. in batches with
+BlockChain.add_transactions (one signature fan-out and one save per batch).
+
+Usage: python benchmarks/bench_batch.py [transactions] [batch_size]
+"""
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from storage import BlockStore  # noqa: E402
+from transaction import Transaction  # noqa: E402
+from wallet import Wallet  # noqa: E402
+
+
+def signed_transactions(wallet, count, offset):
+    # Distinct amounts give every transaction its own signature
+    transactions = []
+    for index in range(offset, offset + count):
+        amount = (index + 1) * 1e-6
+        transactions.append(
+            Transaction(wallet.public_key, 'recipient',
+                        wallet.sign_transaction(wallet.public_key,
+                                                'recipient', amount),
+                        amount))
+    return transactions
+
+
+def main(transactions=2000, batch_size=500):
+    wallet = Wallet()
+    wallet.create_keys()
+    one_by_one = signed_transactions(wallet, transactions, 0)
+    batched = signed_transactions(wallet, transactions, transactions)
+
+    print(f'{transactions} transactions, batches of {batch_size}')
+    print(f'{"mode":>12} {"time (s)":>10} {"tx/s":>10} {"accepted":>9}')
+    for name, pending in (('one by one', one_by_one), ('batched',
+                                                       batched)):
+        with tempfile.TemporaryDirectory() as directory:
+            block_chain = BlockChain(wallet.public_key, BlockStore(directory))
+            block_chain.mine_block()
+            start = time.perf_counter()
+            if name == 'batched':
+                accepted = 0
+                for first in range(0, len(pending), batch_size):
+                    results = block_chain.add_transactions(
+                        pending[first:first + batch_size])
+                    accepted += results.count(None)
+            else:
+                accepted = sum(
+                    block_chain.add_transaction(tx.recipient, tx.sender,
+                                                tx.signature, tx.amount)
+                    for tx in pending)
+            elapsed = time.perf_counter() - start
+            block_chain.miner.close()
+        print(f'{name:>12} {elapsed:>10.2f} {transactions / elapsed:>10.0f} '
+              f'{accepted:>9}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('transactions',
+                        type=int,
+                        nargs='?',
+                        default=2000,
+                        help='Transactions added')
+    parser.add_argument('batch_size',
+                        type=int,
+                        nargs='?',
+                        default=500,
+                        help='Transactions per batch')
+    args = parser.parse_args()
+    main(args.transactions, args.batch_size)
@@ -0,0 +1,147 @@
+"""
+Broadcast cost against local stand-in peers: sending every transaction to
+every peer one at a time over a new HTTP connection vs. queueing it on the
+Broadcaster (keep-alive connections, batching, background delivery).
+The stand-in peers answer every request after a fixed delay.
+
+Usage: python benchmarks/bench_broadcast.py [transactions] [peers]
+                                            [peer delay (ms)]
+"""
+import os
+import sys
+import json
+import time
+import threading
+import urllib.request
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcaster import TRANSACTION, Broadcaster  # noqa: E402
+
+
+class StandInPeer(ThreadingHTTPServer):
+    """ HTTP server counting the requests, connections and transactions """
+    daemon_threads = True
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        super().__init__(('localhost', 0), StandInHandler)
+
+    @property
+    def address(self):
+        return f'localhost:{self.server_port}'
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.delay)
+        self.server.count('requests')
+        self.server.count('transactions',
+                          len(body['transactions'])
+                          if 'transactions' in body else 1)
+        answer = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+
+def synthetic_transaction(index):
+    return {
+        'sender': '%0324x' % index,
+        'recipient': '%0324x' % (index + 1),
+        'amount': 1.0,
+        'signature': '%0256x' % index
+    }
+
+
+def sequential(peers, transactions):
+    """ One request per transaction and peer, each on a new connection """
+    submit = 0.0
+    for index in range(transactions):
+        start = time.perf_counter()
+        for peer in peers:
+            request = urllib.request.Request(
+                f'http://{peer}/broadcast-transaction',
+                json.dumps(synthetic_transaction(index)).encode(),
+                {'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        submit += time.perf_counter() - start
+    return submit
+
+
+def broadcaster(peers, transactions):
+    broadcaster = Broadcaster()
+    submit = 0.0
+    for index in range(transactions):
+        start = time.perf_counter()
+        broadcaster.send(peers, TRANSACTION, synthetic_transaction(index))
+        submit += time.perf_counter() - start
+    broadcaster.flush()
+    broadcaster.close()
+    return submit
+
+
+def main(transactions=1000, peers=4, delay_ms=2):
+    print(f'{transactions} transactions to {peers} peers answering after '
+          f'{delay_ms} ms')
+    print(f'{"mode":>12} {"submit (ms/tx)":>15} {"delivered (s)":>14} '
+          f'{"requests":>9} {"connections":>12}')
+    for name, run in (('sequential', sequential), ('broadcaster',
+                                                   broadcaster)):
+        servers = [StandInPeer(delay_ms / 1000) for _ in range(peers)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        start = time.perf_counter()
+        submit = run([server.address for server in servers], transactions)
+        elapsed = time.perf_counter() - start
+        counts = sum((server.counts for server in servers), Counter())
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        assert counts['transactions'] == transactions * peers
+        print(f'{name:>12} {submit / transactions * 1000:>15.3f} '
+              f'{elapsed:>14.2f} {counts["requests"]:>9} '
+              f'{counts["connections"]:>12}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('transactions',
+                        type=int,
+                        nargs='?',
+                        default=1000,
+                        help='Transactions broadcast')
+    parser.add_argument('peers',
+                        type=int,
+                        nargs='?',
+                        default=4,
+                        help='Stand-in peers')
+    parser.add_argument('delay_ms',
+                        type=int,
+                        nargs='?',
+                        default=2,
+                        help='Milliseconds every peer takes to answer')
+    args = parser.parse_args()
+    main(args.transactions, args.peers, args.delay_ms)
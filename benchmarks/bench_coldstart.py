@@ -0,0 +1,107 @@
+"""
+Cold start against chain length: opening the chain and answering the first
+balance lookup, with the balance index rebuilt from every block vs.
+restored from a snapshot taken some blocks before the tip. Every
+measurement runs in a fresh process.
+
+Usage: python benchmarks/bench_coldstart.py [max_blocks] [tx_per_block]
+                                            [blocks after the snapshot]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from snapshot import SnapshotStore  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from bench_storage import synthetic_block  # noqa: E402
+
+
+def measure(directory, snapshots):
+    """ Opens the chain in directory and reports timings as JSON """
+    # Synthetic transactions reuse their addresses in every block
+    address = '%0324x' % 1
+    start = time.perf_counter()
+    block_chain = BlockChain(None,
+                             BlockStore(directory),
+                             snapshots=SnapshotStore(
+                                 os.path.join(directory, snapshots)))
+    opened = time.perf_counter() - start
+
+    start = time.perf_counter()
+    balance = block_chain.get_balances(address)
+    lookup = time.perf_counter() - start
+    print(json.dumps({'open': opened, 'lookup': lookup, 'balance': balance}))
+
+
+def run(directory, snapshots):
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--measure', directory, snapshots])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(max_blocks=16000, tx_per_block=10, tail=100):
+    print(f'{"blocks":>8} {"rebuild (ms)":>13} {"snapshot (ms)":>14} '
+          f'{"snapshot size (KiB)":>20}')
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(directory, fsync=FSYNC_NEVER)
+        snapshots = SnapshotStore(os.path.join(directory, 'snapshots'))
+        blocks = max_blocks // 8
+        while blocks <= max_blocks:
+            height = blocks - tail - 1
+            store.append_blocks([
+                synthetic_block(index, tx_per_block)
+                for index in range(store.block_count(), height + 1)
+            ])
+            snapshots.save(height,
+                           store.get_block(height).hash, height + 1,
+                           Ledger.from_chain(store.iter_blocks()))
+            store.append_blocks([
+                synthetic_block(index, tx_per_block)
+                for index in range(height + 1, blocks)
+            ])
+
+            rebuilt = run(directory, 'no-snapshots')
+            restored = run(directory, 'snapshots')
+            assert rebuilt['balance'] == restored['balance']
+            size = os.path.getsize(snapshots.path(height))
+            print(f'{blocks:>8} '
+                  f'{(rebuilt["open"] + rebuilt["lookup"]) * 1000:>13.2f} '
+                  f'{(restored["open"] + restored["lookup"]) * 1000:>14.2f} '
+                  f'{size / 1024:>20.1f}')
+            blocks *= 2
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('max_blocks',
+                        type=int,
+                        nargs='?',
+                        default=16000,
+                        help='Longest chain measured, in blocks')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Transactions per block')
+    parser.add_argument('tail',
+                        type=int,
+                        nargs='?',
+                        default=100,
+                        help='Blocks after the snapshot')
+    parser.add_argument('--measure',
+                        nargs=2,
+                        metavar=('DIRECTORY', 'SNAPSHOTS'),
+                        help='Measure one start, run by the benchmark')
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+    else:
+        main(args.max_blocks, args.tx_per_block, args.tail)
@@ -0,0 +1,89 @@
+"""
+Address history lookup against chain length: scanning every block for the
+address vs. reading a page from the per-address history index. The index
+is built by the first lookup, which is reported separately.
+
+Usage: python benchmarks/bench_history.py [max_blocks] [tx_per_block]
+                                          [page size]
+"""
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from bench_storage import synthetic_block  # noqa: E402
+
+# Number of pages read from the index to average the lookup latency over
+PAGES = 20
+
+
+def scan(block_chain, address, limit):
+    """ History the way balances used to be computed, walking every block """
+    history = []
+    for block in block_chain.iter_blocks():
+        for tx in block.transactions:
+            if address in (tx.sender, tx.recipient):
+                history.append(tx)
+    return history[::-1][:limit]
+
+
+def main(max_blocks=8000, tx_per_block=10, page_size=50):
+    # Synthetic transactions reuse their addresses in every block
+    address = '%0324x' % 1
+    print(f'{"blocks":>8} {"scan (ms)":>10} {"index build (ms)":>17} '
+          f'{"page (ms)":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(directory, fsync=FSYNC_NEVER)
+        blocks = max_blocks // 8
+        while blocks <= max_blocks:
+            store.append_blocks([
+                synthetic_block(index, tx_per_block)
+                for index in range(store.block_count(), blocks)
+            ])
+            block_chain = BlockChain(None, store)
+
+            start = time.perf_counter()
+            scanned = scan(block_chain, address, page_size)
+            scanned_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            total, page = block_chain.get_history(address, 0, page_size)
+            build = time.perf_counter() - start
+            assert [entry['transaction'] for entry in page] == [
+                tx.to_dict() for tx in scanned
+            ]
+
+            start = time.perf_counter()
+            for offset in range(0, total, max(total // PAGES, 1))[:PAGES]:
+                block_chain.get_history(address, offset, page_size)
+            page_time = (time.perf_counter() - start) / PAGES
+            block_chain.miner.close()
+            print(f'{blocks:>8} {scanned_time * 1000:>10.2f} '
+                  f'{build * 1000:>17.2f} {page_time * 1000:>10.3f}')
+            blocks *= 2
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('max_blocks',
+                        type=int,
+                        nargs='?',
+                        default=8000,
+                        help='Longest chain measured, in blocks')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Transactions per block')
+    parser.add_argument('page_size',
+                        type=int,
+                        nargs='?',
+                        default=50,
+                        help='Transactions per page of history')
+    args = parser.parse_args()
+    main(args.max_blocks, args.tx_per_block, args.page_size)
@@ -0,0 +1,77 @@
+"""
+Time and memory needed to load every block of a chain from the block store:
+opening the chain and building the balance index, which leaves the blocks
+on disk behind a lazy view, and then materializing the list of blocks.
+
+Usage: python benchmarks/bench_load.py [transactions] [tx_per_block]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from bench_storage import synthetic_block  # noqa: E402
+
+
+def open_chain(directory):
+    block_chain = BlockChain(None, BlockStore(directory))
+    block_chain.get_balances('')
+    return block_chain
+
+
+def load(directory):
+    # get_chain() is a lazy view, so every block is read explicitly
+    return list(open_chain(directory).iter_blocks())
+
+
+def main(transactions=100000, tx_per_block=100):
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(directory, fsync=FSYNC_NEVER)
+        store.append_blocks([
+            synthetic_block(index, tx_per_block)
+            for index in range(transactions // tx_per_block)
+        ])
+
+        start = time.perf_counter()
+        open_chain(directory)
+        open_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chain = load(directory)
+        elapsed = time.perf_counter() - start
+        del chain
+
+        # Memory is measured on a second load as tracing slows loading down
+        tracemalloc.start()
+        chain = load(directory)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f'blocks loaded:       {len(chain)}')
+        print(f'transactions loaded: {transactions}')
+        print(f'open time:           {open_elapsed:.3f} s')
+        print(f'load time:           {elapsed:.3f} s')
+        print(f'retained memory:     {current / 2**20:.1f} MiB')
+        print(f'peak memory:         {peak / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('transactions',
+                        type=int,
+                        nargs='?',
+                        default=100000,
+                        help='Transactions in the chain')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=100,
+                        help='Transactions per block')
+    args = parser.parse_args()
+    main(args.transactions, args.tx_per_block)
@@ -0,0 +1,74 @@
+"""
+Disk usage against chain length: a full block store vs. one pruned to the
+transactions of the last blocks, and the time it takes to prune and to
+read the headers of the whole pruned chain back.
+
+Usage: python benchmarks/bench_prune.py [max_blocks] [tx_per_block]
+                                        [blocks kept]
+"""
+import os
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from bench_storage import synthetic_block  # noqa: E402
+
+
+def disk_usage(directory):
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in os.listdir(directory))
+
+
+def main(max_blocks=16000, tx_per_block=10, keep=1000):
+    print(f'{"blocks":>8} {"full (KiB)":>11} {"pruned (KiB)":>13} '
+          f'{"prune (ms)":>11} {"headers (ms)":>13}')
+    with tempfile.TemporaryDirectory() as directory:
+        full = BlockStore(os.path.join(directory, 'full'), fsync=FSYNC_NEVER)
+        pruned = BlockStore(os.path.join(directory, 'pruned'),
+                            fsync=FSYNC_NEVER)
+        blocks = max_blocks // 8
+        while blocks <= max_blocks:
+            new_blocks = [
+                synthetic_block(index, tx_per_block)
+                for index in range(full.block_count(), blocks)
+            ]
+            full.append_blocks(new_blocks)
+            pruned.append_blocks(new_blocks)
+
+            start = time.perf_counter()
+            pruned.prune(blocks - keep)
+            prune_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in pruned.iter_headers():
+                pass
+            headers_time = time.perf_counter() - start
+            print(f'{blocks:>8} {disk_usage(full.directory) / 1024:>11.1f} '
+                  f'{disk_usage(pruned.directory) / 1024:>13.1f} '
+                  f'{prune_time * 1000:>11.2f} {headers_time * 1000:>13.2f}')
+            blocks *= 2
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('max_blocks',
+                        type=int,
+                        nargs='?',
+                        default=16000,
+                        help='Longest chain measured, in blocks')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Transactions per block')
+    parser.add_argument('keep',
+                        type=int,
+                        nargs='?',
+                        default=1000,
+                        help='Blocks kept with their transactions')
+    args = parser.parse_args()
+    main(args.max_blocks, args.tx_per_block, args.keep)
@@ -0,0 +1,71 @@
+"""
+Signing and verification cost per signature scheme. RSA signing is also
+measured the way wallets used to sign, parsing the private key for every
+signature. Ed25519 and ECDSA use the cryptography package when installed.
+
+Usage: python benchmarks/bench_signing.py [signatures]
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wallet as wallet_module  # noqa: E402
+from transaction import Transaction  # noqa: E402
+from wallet import SCHEMES, Wallet, new_signer, transaction_message  # noqa: E402
+from utils.encoding import SCHEME_RSA  # noqa: E402
+
+
+def per_signature(run, count):
+    start = time.perf_counter()
+    for index in range(count):
+        run(index)
+    return (time.perf_counter() - start) / count * 1000
+
+
+def main(signatures=500):
+    backend = ('cryptography' if wallet_module.ed25519 is not None else
+               'pycryptodome')
+    print(f'{signatures} signatures, elliptic curves on {backend}')
+    print(f'{"scheme":>12} {"key (B)":>8} {"sig (B)":>8} {"sign (ms)":>10} '
+          f'{"verify (ms)":>12}')
+    for scheme in SCHEMES:
+        wallet = Wallet(scheme=scheme)
+        wallet.create_keys()
+        if scheme == SCHEME_RSA:
+            uncached = per_signature(
+                lambda index: new_signer(wallet.private_key, scheme)
+                (transaction_message(wallet.public_key, 'recipient', index)),
+                signatures)
+            print(f'{"rsa uncached":>12} {"":>8} {"":>8} {uncached:>10.3f}')
+
+        transactions = []
+
+        def sign(index):
+            transactions.append(
+                Transaction(wallet.public_key, 'recipient',
+                            wallet.sign_transaction(wallet.public_key,
+                                                    'recipient', index),
+                            index, scheme))
+
+        sign_time = per_signature(sign, signatures)
+        verify_time = per_signature(
+            lambda index: Wallet.verify_transaction_signature(
+                transactions[index]), signatures)
+        assert all(map(Wallet.verify_transaction_signature, transactions))
+        print(f'{scheme:>12} {len(wallet.public_key) // 2:>8} '
+              f'{len(transactions[0].signature) // 2:>8} {sign_time:>10.3f} '
+              f'{verify_time:>12.3f}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('signatures',
+                        type=int,
+                        nargs='?',
+                        default=500,
+                        help='Signatures per scheme')
+    args = parser.parse_args()
+    main(args.signatures)
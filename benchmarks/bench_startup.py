@@ -0,0 +1,100 @@
+"""
+Node startup time and memory against chain length. Every measurement runs
+in a fresh process so the peak RSS belongs to that startup alone.
+
+Usage: python benchmarks/bench_startup.py [max_blocks] [tx_per_block]
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from bench_storage import synthetic_block  # noqa: E402
+
+
+def peak_rss_kib():
+    # ru_maxrss survives exec, so it would include the parent's peak;
+    # VmHWM belongs to this process image alone
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(directory):
+    """ Opens the chain in directory and reports timings as JSON """
+    start = time.perf_counter()
+    block_chain = BlockChain(None, BlockStore(directory))
+    opened = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tip = block_chain.get_block(block_chain.chain_length() - 1)
+    height_lookup = time.perf_counter() - start
+
+    # The first lookup by hash loads the hash index
+    start = time.perf_counter()
+    block_chain.get_block_by_hash(tip.hash)
+    hash_lookup = time.perf_counter() - start
+
+    print(
+        json.dumps({
+            'open': opened,
+            'height_lookup': height_lookup,
+            'hash_lookup': hash_lookup,
+            'rss_kib': peak_rss_kib()
+        }))
+
+
+def main(max_blocks=16000, tx_per_block=10):
+    print(f'{"blocks":>8} {"startup (ms)":>14} {"tip lookup (ms)":>16} '
+          f'{"1st hash lookup (ms)":>22} {"peak RSS (MiB)":>16}')
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(directory, fsync=FSYNC_NEVER)
+        blocks = max_blocks // 8
+        while blocks <= max_blocks:
+            store.append_blocks([
+                synthetic_block(index, tx_per_block)
+                for index in range(store.block_count(), blocks)
+            ])
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--measure', directory])
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print(f'{blocks:>8} {result["open"] * 1000:>14.2f} '
+                  f'{result["height_lookup"] * 1000:>16.2f} '
+                  f'{result["hash_lookup"] * 1000:>22.2f} '
+                  f'{result["rss_kib"] / 1024:>16.1f}')
+            blocks *= 2
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('max_blocks',
+                        type=int,
+                        nargs='?',
+                        default=16000,
+                        help='Longest chain measured, in blocks')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Transactions per block')
+    parser.add_argument('--measure',
+                        metavar='DIRECTORY',
+                        help='Measure one start, run by the benchmark')
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure)
+    else:
+        main(args.max_blocks, args.tx_per_block)
@@ -0,0 +1,73 @@
+"""
+Save latency against chain length: the legacy rewrite-everything
+blockchain_data.txt format vs. appending to the block log.
+
+Usage: python benchmarks/bench_storage.py [max_blocks] [tx_per_block]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block import Block  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from transaction import Transaction  # noqa: E402
+
+
+def synthetic_block(index, tx_per_block):
+    return Block(index, '%064x' % index, [
+        Transaction('%0324x' % tx, '%0324x' % (tx + 1), '%0256x' % tx, 1.0,
+                    nonce=index)
+        for tx in range(tx_per_block)
+    ], index, 1600000000.0 + index)
+
+
+def legacy_save(path, chain):
+    with open(path, mode='w') as f:
+        f.write(json.dumps([block.to_dict() for block in chain]))
+        f.write('\n')
+        f.write(json.dumps([]))
+
+
+def main(max_blocks=2000, tx_per_block=10):
+    checkpoints = {max_blocks // 8, max_blocks // 4, max_blocks // 2,
+                   max_blocks}
+    with tempfile.TemporaryDirectory() as directory:
+        store = BlockStore(os.path.join(directory, 'log'), fsync=FSYNC_NEVER)
+        legacy_path = os.path.join(directory, 'blockchain_data.txt')
+        chain = []
+        print(f'{"blocks":>8} {"legacy save (ms)":>18} {"append save (ms)":>18}')
+        for index in range(max_blocks):
+            block = synthetic_block(index, tx_per_block)
+            chain.append(block)
+            if index + 1 not in checkpoints:
+                store.append_blocks([block])
+                continue
+            start = time.perf_counter()
+            store.append_blocks([block])
+            store.save_mempool([])
+            append = time.perf_counter() - start
+            start = time.perf_counter()
+            legacy_save(legacy_path, chain)
+            legacy = time.perf_counter() - start
+            print(f'{index + 1:>8} {legacy * 1000:>18.3f} {append * 1000:>18.3f}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('max_blocks',
+                        type=int,
+                        nargs='?',
+                        default=2000,
+                        help='Longest chain measured, in blocks')
+    parser.add_argument('tx_per_block',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Transactions per block')
+    args = parser.parse_args()
+    main(args.max_blocks, args.tx_per_block)
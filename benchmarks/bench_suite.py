@@ -0,0 +1,332 @@
+"""
+Benchmark suite of the hot paths of a node: hashing, proof of work, chain
+verification, balance lookups, loading and saving, wallet signatures and
+the Flask routes (through the test client). Every run builds the same
+synthetic chain from the seed, a valid chain of signed transactions
+between a fixed set of wallets, so results of two commits compare.
+
+Results are written as JSON, seconds per operation:
+
+    python benchmarks/bench_suite.py --output base.json
+    python benchmarks/bench_suite.py --output head.json
+    python benchmarks/bench_suite.py --compare base.json head.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from block import Block  # noqa: E402
+from blockchain import MINING_REWARD, BlockChain  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from miner import ProofOfWorkMiner  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from transaction import NONCE_BITS, Transaction  # noqa: E402
+from utils.encoding import BLOCK_VERSION_JSON, SCHEME_ED25519  # noqa: E402
+from utils.hash_utils import hash_block  # noqa: E402
+from utils.verification import TARGET_BLOCK_TIME, Verification  # noqa: E402
+from wallet import SCHEMES, Wallet  # noqa: E402
+
+GENESIS_TIME = 1600000000.0
+# Blocks after the stored chain, added one by one by chain.add_block
+EXTRA_BLOCKS = 5
+# Open transactions signed on top of the chain for chain.save_data
+PENDING_TRANSACTIONS = 100
+# Leading zero bits of the proof_of_work benchmark, about 2**16 hashes
+POW_DIFFICULTY = 16
+# Relative change reported as a regression or an improvement by --compare
+COMPARE_THRESHOLD = 0.10
+
+
+def synthetic_chain(blocks, tx_per_block, wallets, seed, scheme):
+    """
+    Builds a valid chain of the given length, mined at the difficulty of
+    the genesis block with blocks TARGET_BLOCK_TIME seconds apart. The
+    wallets take turns mining and send each other random funded amounts.
+    Everything is derived from the seed.
+
+    Returns
+    -------
+        (wallets, chain, pending): The wallets, the blocks (genesis first)
+                                   and signed open transactions funded on
+                                   top of the chain
+    """
+    rng = random.Random(seed)
+    keys = []
+    for _ in range(wallets):
+        wallet = Wallet(scheme=scheme)
+        wallet.create_keys(rng.randbytes)
+        keys.append(wallet)
+    positions = {wallet.public_key: index for index, wallet in enumerate(keys)}
+    balances = [0.0] * wallets
+    miner = ProofOfWorkMiner(processes=1)
+
+    def transfers(count):
+        transactions = []
+        for _ in range(count):
+            sender = rng.randrange(wallets)
+            recipient = rng.randrange(wallets)
+            amount = rng.randint(1, 500) / 100
+            if balances[sender] < amount:
+                continue
+            balances[sender] -= amount
+            key = keys[sender]
+            nonce = rng.getrandbits(NONCE_BITS)
+            transactions.append(
+                Transaction(
+                    key.public_key, keys[recipient].public_key,
+                    key.sign_transaction(key.public_key,
+                                         keys[recipient].public_key, amount,
+                                         nonce=nonce),
+                    amount, scheme, nonce=nonce))
+        return transactions
+
+    chain = [Block(0, '', [], 100, 0, version=BLOCK_VERSION_JSON)]
+    for index in range(1, blocks):
+        transactions = transfers(tx_per_block)
+        miner_wallet = index % wallets
+        # Rewards commit to the height, or their ids would repeat
+        transactions.append(
+            Transaction('MINING', keys[miner_wallet].public_key, '',
+                        MINING_REWARD, nonce=index))
+        candidate = Block(index,
+                          chain[-1].hash,
+                          transactions,
+                          None,
+                          GENESIS_TIME + index * TARGET_BLOCK_TIME,
+                          difficulty=Verification.next_difficulty(chain))
+        chain.append(
+            Block(index,
+                  candidate.previous_hash,
+                  transactions,
+                  miner.mine_header(candidate),
+                  candidate.timestamp,
+                  candidate.difficulty,
+                  merkle_root=candidate.merkle_root))
+        # Received funds can be spent from the next block on
+        balances[miner_wallet] += MINING_REWARD
+        for tx in transactions[:-1]:
+            balances[positions[tx.recipient]] += tx.amount
+    miner.close()
+    # Raises InvalidSpend if a block of the chain can't be applied
+    Ledger.from_chain(chain)
+    return keys, chain, transfers(PENDING_TRANSACTIONS)
+
+
+def timed(run, repeat=5, operations=1):
+    """
+    Runs run() repeat times, each run doing the given number of operations
+
+    Returns
+    -------
+        result (dict): Median and minimum seconds per operation
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) / operations)
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'runs': repeat,
+        'operations': operations
+    }
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=REPO,
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def run_suite(directory, blocks, tx_per_block, wallets, seed, scheme,
+              repeat, requests):
+    """
+    Returns
+    -------
+        (chain, results): Summary of the synthetic chain, identical for
+                          the same parameters, and the timings by name
+    """
+    results = {}
+    start = time.perf_counter()
+    keys, chain, pending = synthetic_chain(blocks + EXTRA_BLOCKS,
+                                           tx_per_block, wallets, seed,
+                                           scheme)
+    print(f'Built {blocks} blocks in {time.perf_counter() - start:.1f} s',
+          file=sys.stderr)
+    stored, extra = chain[:blocks], chain[blocks:]
+    BlockStore(directory, fsync=FSYNC_NEVER).append_blocks(stored)
+    block_chain = BlockChain(keys[0].public_key, BlockStore(directory))
+    addresses = [wallet.public_key for wallet in keys]
+    transactions = [tx for block in stored for tx in block.transactions[:-1]]
+
+    results['hash_block'] = timed(lambda: [hash_block(b) for b in stored],
+                                  repeat, len(stored))
+    # Mines the header of a candidate next block, as mine_block does
+    candidate = Block(blocks, stored[-1].hash, pending[:10], None,
+                      stored[-1].timestamp + TARGET_BLOCK_TIME,
+                      difficulty=POW_DIFFICULTY)
+    results['proof_of_work'] = timed(
+        lambda: block_chain.miner.mine_header(candidate), repeat)
+    assert block_chain.verify_chain(True)
+    results['verify_chain'] = timed(lambda: block_chain.verify_chain(True),
+                                    repeat)
+    results['load_data'] = timed(block_chain.load_data, repeat)
+    results['ledger_build'] = timed(block_chain.rebuild_ledger, repeat)
+    results['get_balances'] = timed(
+        lambda: [block_chain.get_balances(a) for a in addresses], repeat,
+        len(addresses))
+    results['get_history'] = timed(
+        lambda: [block_chain.get_history(a, 0, 50) for a in addresses],
+        repeat, len(addresses))
+
+    signer = keys[0]
+    results['wallet_sign'] = timed(
+        lambda: [
+            signer.sign_transaction(signer.public_key, 'recipient', amount)
+            for amount in range(requests)
+        ], repeat, requests)
+    sample = transactions[:requests]
+    results['wallet_verify'] = timed(
+        lambda: [Wallet.verify_transaction_signature(tx) for tx in sample],
+        repeat, max(len(sample), 1))
+
+    results.update(
+        route_results(os.path.dirname(directory), block_chain, signer,
+                      addresses, requests, repeat))
+
+    # Benchmarks which change the chain run last
+    results['add_block'] = timed(
+        lambda: [block_chain.add_block(block) for block in extra], 1,
+        len(extra))
+    assert block_chain.chain_length() == blocks + EXTRA_BLOCKS
+    assert block_chain.add_transactions(pending) == [None] * len(pending)
+    results['save_data'] = timed(block_chain.save_data, repeat)
+    block_chain.miner.close()
+    return {'tip': stored[-1].hash, 'transactions': len(transactions)}, results
+
+
+def route_results(directory, block_chain, signer, addresses, requests,
+                  repeat):
+    """ Times the routes of a node serving the chain, per request """
+    # The node module sets up a node in the working directory on import
+    os.chdir(directory)
+    import node
+    node.block_chain = block_chain
+    node.wallet = signer
+    client = node.app.test_client()
+    tip = block_chain.chain_length() - 1
+    routes = {
+        'GET /chain': '/chain',
+        'GET /tip': '/tip',
+        'GET /headers': '/headers',
+        'GET /block/<height>': f'/block/{tip}',
+        'GET /balance': '/balance',
+        'GET /history/<address>': f'/history/{addresses[1]}',
+        'GET /transactions': '/transactions'
+    }
+    results = {}
+    for name, url in routes.items():
+        assert client.get(url).status_code == 200, name
+        results[name] = timed(
+            lambda: [client.get(url) for _ in range(requests)], repeat,
+            requests)
+    amounts = iter(range(1, requests * repeat + 1))
+    results['POST /transaction'] = timed(
+        lambda: [
+            client.post('/transaction',
+                        json={
+                            'recipient': addresses[1],
+                            'amount': next(amounts) / 1000
+                        }) for _ in range(requests)
+        ], repeat, requests)
+    return results
+
+
+def compare(base_path, head_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    print(f'base {base["meta"]["commit"]}\nhead {head["meta"]["commit"]}')
+    if base['meta']['chain'] != head['meta']['chain']:
+        print('Warning: the results were measured on different chains')
+    print(f'{"benchmark":>24} {"base (ms)":>12} {"head (ms)":>12} '
+          f'{"change":>8}')
+    for name, result in head['results'].items():
+        if name not in base['results']:
+            print(f'{name:>24} {"":>12} {result["median"] * 1000:>12.4f}')
+            continue
+        before = base['results'][name]['median']
+        change = result['median'] / before - 1 if before else 0.0
+        flag = ('  slower' if change > COMPARE_THRESHOLD else
+                '  faster' if change < -COMPARE_THRESHOLD else '')
+        print(f'{name:>24} {before * 1000:>12.4f} '
+              f'{result["median"] * 1000:>12.4f} {change:>+8.1%}{flag}')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=500)
+    parser.add_argument('--tx-per-block', type=int, default=20)
+    parser.add_argument('--wallets', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scheme', choices=SCHEMES, default=SCHEME_ED25519)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='Calls per run of the per-call benchmarks')
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            chain, results = run_suite(os.path.join(directory, 'chain'), args.blocks,
+                                args.tx_per_block, args.wallets, args.seed,
+                                args.scheme, args.repeat, args.requests)
+        finally:
+            os.chdir(cwd)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'blocks': args.blocks,
+            'tx_per_block': args.tx_per_block,
+            'wallets': args.wallets,
+            'seed': args.seed,
+            'scheme': args.scheme,
+            'repeat': args.repeat,
+            'requests': args.requests,
+            'chain': chain
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Concurrency stress test of a shared BlockChain: submitter threads send
+signed transactions, miner threads mine blocks and reader threads query
+the chain, all at once. Afterwards the chain must verify, the balance
+index must match one rebuilt from the chain and every accepted
+transaction must be either mined exactly once or still open.
+
+Usage: python benchmarks/stress_concurrency.py [seconds] [submitters]
+                                               [miners] [readers]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+from argparse import ArgumentParser
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import BlockChain  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from storage import BlockStore, FSYNC_NEVER  # noqa: E402
+from wallet import Wallet  # noqa: E402
+
+
+def transaction_key(sender, recipient, amount, signature):
+    return (sender, recipient, amount, signature)
+
+
+def submitter(block_chain, wallet, recipients, deadline, accepted, counts):
+    sent = 0
+    while time.time() < deadline:
+        recipient = random.choice(recipients)
+        # Vary the amount so that every signature is unique
+        amount = round(random.uniform(0.01, 1.0), 2) + sent * 1e-6
+        signature = wallet.sign_transaction(wallet.public_key, recipient,
+                                            amount)
+        if block_chain.add_transaction(recipient, wallet.public_key,
+                                       signature, amount):
+            accepted.append(
+                transaction_key(wallet.public_key, recipient, amount,
+                                signature))
+            counts['accepted'] += 1
+        else:
+            counts['rejected'] += 1
+        sent += 1
+
+
+def miner(block_chain, deadline, counts):
+    while time.time() < deadline:
+        if block_chain.mine_block() is None:
+            counts['stale'] += 1
+        else:
+            counts['mined'] += 1
+
+
+def reader(block_chain, addresses, deadline, counts):
+    while time.time() < deadline:
+        chain = block_chain.get_chain()
+        tip = chain[-1]
+        assert chain[len(chain) - 1].hash == tip.hash
+        block_chain.get_block_by_hash(tip.hash)
+        block_chain.get_open_transactions()
+        block_chain.get_balances(random.choice(addresses))
+        counts['reads'] += 1
+
+
+def check(block_chain, wallets, accepted):
+    assert block_chain.verify_chain(full=True), 'chain does not verify'
+
+    chain = block_chain.get_chain()
+    open_transactions = block_chain.get_open_transactions()
+    rebuilt = Ledger.from_chain(chain)
+    addresses = [wallet.public_key for wallet in wallets] + ['MINING']
+    for address in addresses:
+        pending = sum(tx.amount for tx in open_transactions
+                      if tx.sender == address)
+        assert abs(block_chain.get_balances(address) -
+                   (rebuilt.balance(address) - pending)) < 1e-9, \
+            'balance index drifted'
+        # Rewards are sent by MINING, which has no funds of its own
+        assert address == 'MINING' or block_chain.get_balances(
+            address) >= -1e-9, 'overspent'
+
+    mined = Counter(
+        transaction_key(tx.sender, tx.recipient, tx.amount, tx.signature)
+        for block in chain for tx in block.transactions
+        if tx.sender != 'MINING')
+    still_open = Counter(
+        transaction_key(tx.sender, tx.recipient, tx.amount, tx.signature)
+        for tx in open_transactions)
+    seen = mined + still_open
+    assert all(count == 1 for count in seen.values()), 'duplicate transaction'
+    assert set(seen) == set(accepted), 'lost or unexpected transaction'
+    return len(chain), sum(mined.values()), sum(still_open.values())
+
+
+def main(seconds=10, submitters=4, miners=2, readers=4):
+    wallets = []
+    for _ in range(submitters + 1):
+        wallet = Wallet()
+        wallet.create_keys()
+        wallets.append(wallet)
+    addresses = [wallet.public_key for wallet in wallets]
+
+    with tempfile.TemporaryDirectory() as directory:
+        block_chain = BlockChain(wallets[0].public_key,
+                                 BlockStore(directory, fsync=FSYNC_NEVER))
+        # Fund the submitters before the run
+        for wallet in wallets[1:]:
+            block_chain.set_hosting_node(wallet.public_key)
+            for _ in range(3):
+                block_chain.mine_block()
+        block_chain.set_hosting_node(wallets[0].public_key)
+
+        accepted = []
+        counts = Counter()
+        deadline = time.time() + seconds
+        threads = [
+            threading.Thread(target=submitter,
+                             args=(block_chain, wallet, addresses, deadline,
+                                   accepted, counts))
+            for wallet in wallets[1:]
+        ] + [
+            threading.Thread(target=miner,
+                             args=(block_chain, deadline, counts))
+            for _ in range(miners)
+        ] + [
+            threading.Thread(target=reader,
+                             args=(block_chain, addresses, deadline, counts))
+            for _ in range(readers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        blocks, mined, still_open = check(block_chain, wallets, accepted)
+        # The chain reloaded from disk must hold the same state
+        reloaded = BlockChain(None, BlockStore(directory))
+        assert reloaded.chain_length() == blocks, 'blocks lost on save'
+        assert len(reloaded.get_open_transactions()) == still_open
+        block_chain.miner.close()
+        reloaded.miner.close()
+
+    print(f'transactions accepted: {counts["accepted"]} '
+          f'(rejected {counts["rejected"]})')
+    print(f'blocks mined:          {counts["mined"]} '
+          f'(stale {counts["stale"]})')
+    print(f'reads:                 {counts["reads"]}')
+    print(f'chain:                 {blocks} blocks, {mined} transactions '
+          f'mined, {still_open} open')
+    print('consistent')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('seconds',
+                        type=int,
+                        nargs='?',
+                        default=10,
+                        help='Seconds to run for')
+    parser.add_argument('submitters',
+                        type=int,
+                        nargs='?',
+                        default=4,
+                        help='Threads submitting transactions')
+    parser.add_argument('miners',
+                        type=int,
+                        nargs='?',
+                        default=2,
+                        help='Threads mining blocks')
+    parser.add_argument('readers',
+                        type=int,
+                        nargs='?',
+                        default=4,
+                        help='Threads querying the chain')
+    args = parser.parse_args()
+    main(args.seconds, args.submitters, args.miners, args.readers)
@@ -1,20 +1,204 @@
 import logging
 from time import time
+from transaction import Transaction
+from utils.encoding import (BLOCK_VERSION, BLOCK_VERSION_JSON,
+                            BLOCK_VERSION_MERKLE, Decoder, encode_block)
+from utils.hash_utils import hash_block, hash_header, hash_string_sha256
+from utils.merkle import merkle_proof, merkle_root
 from utils.printable import Printable
 
 logger = logging.getLogger(__name__)
 
 
 class Block(Printable):
+    __slots__ = ('index', 'previous_hash', 'transactions', 'proof',
+                 'timestamp', 'difficulty', 'version', '_merkle_root', '_hash')
+
     def __init__(self,
                  index,
                  previous_hash,
                  transactions,
                  proof,
-                 timestamp=time()):
+                 timestamp=None,
+                 difficulty=None,
+                 version=BLOCK_VERSION,
+                 merkle_root=None):
         self.index = index
         self.previous_hash = previous_hash
         self.transactions = transactions
         self.proof = proof
+        self.timestamp = time() if timestamp is None else timestamp
+        # Leading zero bits the proof of work had to satisfy. Blocks mined
+        # before difficulty was recorded leave it as None.
+        self.difficulty = difficulty
+        # Selects the hashing scheme, see utils.encoding
+        self.version = version
+        # Merkle root the header claims, computed from the transactions
+        # when not given. Verification checks that the two agree.
+        self._merkle_root = merkle_root
+        self._hash = None
+
+    @property
+    def hash(self):
+        """ Hash of the block, computed once as blocks are never modified """
+        if self._hash is None:
+            self._hash = hash_block(self)
+        return self._hash
+
+    @property
+    def merkle_root(self):
+        """ Merkle root of the ids of the block's transactions """
+        if self._merkle_root is None:
+            self._merkle_root = self.compute_merkle_root()
+        return self._merkle_root
+
+    def compute_merkle_root(self):
+        """ Computes the Merkle root from the transactions themselves """
+        return merkle_root([tx.id for tx in self.transactions])
+
+    def merkle_proof(self, tx_id):
+        """
+        Returns the position of the transaction with the given id and its
+        inclusion proof (see utils.merkle), or None if the block doesn't
+        hold the transaction
+        """
+        tx_ids = [tx.id for tx in self.transactions]
+        try:
+            position = tx_ids.index(tx_id)
+        except ValueError:
+            return None
+        return position, merkle_proof(tx_ids, position)
+
+    def header(self):
+        """ Returns the header of the block """
+        return BlockHeader(
+            self.index, self.previous_hash,
+            self.merkle_root if self.version >= BLOCK_VERSION_MERKLE else None,
+            self.proof, self.timestamp, self.difficulty, self.version,
+            len(self.transactions), self.hash)
+
+    def to_dict(self):
+        """ Returns the block (and its transactions) as plain dicts """
+        block = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof,
+            'timestamp': self.timestamp,
+            'difficulty': self.difficulty,
+            'version': self.version
+        }
+        if self.version >= BLOCK_VERSION_MERKLE:
+            block['merkle_root'] = self.merkle_root
+        return block
+
+    @classmethod
+    def from_dict(cls, block):
+        """
+        Builds a block from the dict produced by to_dict. Dicts without a
+        version come from JSON chains saved before the binary encoding.
+        """
+        return cls(block['index'], block['previous_hash'],
+                   [Transaction.from_dict(tx) for tx in block['transactions']],
+                   block['proof'], block['timestamp'], block.get('difficulty'),
+                   block.get('version', BLOCK_VERSION_JSON),
+                   block.get('merkle_root'))
+
+    def to_bytes(self):
+        """ Returns the binary canonical encoding of the block """
+        return encode_block(self)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Builds a block from its binary canonical encoding """
+        (index, previous_hash, transactions, proof, timestamp, difficulty,
+         version, root) = Decoder(data).block()
+        return cls(index, previous_hash,
+                   [Transaction(*tx) for tx in transactions], proof,
+                   timestamp, difficulty, version, root)
+
+
+class BlockHeader(Printable):
+    """
+    Header of a block: everything but the transactions, which blocks from
+    BLOCK_VERSION_MERKLE on commit to through their Merkle root. The hash
+    of such a header is the block hash and its proof of work, so chains of
+    headers can be verified without the transactions. Older blocks hash
+    their transactions; their headers carry the hash as given.
+    """
+    __slots__ = ('index', 'previous_hash', 'merkle_root', 'proof',
+                 'timestamp', 'difficulty', 'version', 'transaction_count',
+                 '_hash')
+
+    def __init__(self,
+                 index,
+                 previous_hash,
+                 merkle_root,
+                 proof,
+                 timestamp,
+                 difficulty=None,
+                 version=BLOCK_VERSION,
+                 transaction_count=None,
+                 block_hash=None):
+        self.index = index
+        self.previous_hash = previous_hash
+        self.merkle_root = merkle_root
+        self.proof = proof
         self.timestamp = timestamp
-        logger.info('Initializing Block: {}'.format(self.__dict__))
+        self.difficulty = difficulty
+        self.version = version
+        self.transaction_count = transaction_count
+        if version >= BLOCK_VERSION_MERKLE:
+            # Always computed, a claimed hash isn't trusted
+            block_hash = None
+        elif block_hash is None:
+            raise ValueError(
+                f'Headers of version {version} blocks need the block hash')
+        self._hash = block_hash
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hash_header(self)
+        return self._hash
+
+    def to_dict(self):
+        header = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'proof': self.proof,
+            'timestamp': self.timestamp,
+            'difficulty': self.difficulty,
+            'version': self.version,
+            'hash': self.hash,
+            'transaction_count': self.transaction_count
+        }
+        if self.merkle_root is not None:
+            header['merkle_root'] = self.merkle_root
+        return header
+
+    @classmethod
+    def from_dict(cls, header):
+        """ Builds a header from the dict produced by to_dict """
+        return cls(header['index'], header['previous_hash'],
+                   header.get('merkle_root'), header['proof'],
+                   header['timestamp'], header.get('difficulty'),
+                   header.get('version', BLOCK_VERSION_JSON),
+                   header.get('transaction_count'), header.get('hash'))
+
+    @classmethod
+    def from_bytes(cls, data, block_hash=None):
+        """
+        Builds the header of a block from the block's binary canonical
+        encoding without decoding its transactions. block_hash is only
+        needed for version 1 blocks, whose hash covers their JSON form.
+        """
+        (index, previous_hash, proof, timestamp, difficulty, version,
+         root, count) = Decoder(data).header()
+        if block_hash is None and version < BLOCK_VERSION_MERKLE:
+            if version == BLOCK_VERSION_JSON:
+                block_hash = Block.from_bytes(data).hash
+            else:
+                block_hash = hash_string_sha256(bytes(data))
+        return cls(index, previous_hash, root, proof, timestamp, difficulty,
+                   version, count, block_hash)
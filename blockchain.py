@@ -1,170 +1,573 @@
-import json
+import os
+import math
+import time
 import logging
-import functools
+import threading
+from collections import defaultdict
 
 from block import Block
-from transaction import Transaction
-from utils.hash_utils import hash_block
+from ledger import Ledger
+from mempool import MAX_MEMPOOL_SIZE, Mempool
+from miner import ProofOfWorkMiner
+from snapshot import SnapshotStore
+from storage import BlockPrunedError, BlockStore, ExtendedChain, StoredChain
+from transaction import Transaction, valid_amount
+from utils import metrics
+from utils.encoding import (BLOCK_VERSION_JSON, BLOCK_VERSION_MERKLE,
+                            BLOCK_VERSION_UNIQUE_IDS, SCHEME_RSA)
+from utils.hash_utils import hash_string_sha256
+from utils.rwlock import ReadWriteLock
+from utils.signature_verifier import signature_verifier
 from utils.verification import Verification
-from wallet import Wallet
+from utxo import UNDO_BLOCKS, InvalidSpend
 # Reward given to the miners for creating new blocks
 MINING_REWARD = 10
+# Largest number of open transactions mined into one block
+MAX_BLOCK_TRANSACTIONS = 1000
+# Largest encoded size in bytes of the open transactions mined into one
+# block (see utils.encoding)
+MAX_BLOCK_BYTES = 1000000
+# Fewest blocks below the tip a pruned node keeps the transactions of, so
+# reorganizations it can revert (see utxo) find the blocks they drop
+MIN_PRUNE_BLOCKS = UNDO_BLOCKS
+# Rounding allowed when summing the float amounts of blocks from peers
+FUNDS_TOLERANCE = 1e-9
+# Records the mempool journal may hold beyond the number of open
+# transactions before they are all saved again, so each change costs O(1)
+# writes on average
+MEMPOOL_JOURNAL_SLACK = 1000
 logger = logging.getLogger(__name__)
 
+BLOCKS_MINED = metrics.Counter('blocks_mined', 'Blocks mined by this node')
+BLOCK_MINING_SECONDS = metrics.Histogram(
+    'block_mining_seconds',
+    'Time from selecting the transactions to appending a mined block')
+BALANCE_SECONDS = metrics.Histogram('balance_lookup_seconds',
+                                    'Duration of balance lookups')
+LEDGER_BUILD_SECONDS = metrics.Histogram(
+    'ledger_build_seconds',
+    'Duration of building the balance index from the block chain')
+SAVE_SECONDS = metrics.Histogram(
+    'save_seconds',
+    'Duration of persisting new blocks, open transactions and snapshots')
+
 
 class BlockChain:
-    def __init__(self, hosting_node_id):
-        # Starting block of the block chain
-        genesis_block = Block(0, '', [], 100, 0)
-        # Initializing the blockchain
-        self.__chain = [genesis_block]
+    """
+    The block chain of a node. Safe to share between threads: any number of
+    readers run concurrently, while everything that changes the chain or
+    the open transactions is serialized behind a write lock. Readers get
+    immutable snapshots (a fixed length view of the append-only chain and a
+    tuple of open transactions) instead of copies.
+    """
+    def __init__(self,
+                 hosting_node_id,
+                 store=None,
+                 network=None,
+                 mempool_size=MAX_MEMPOOL_SIZE,
+                 snapshots=None,
+                 max_block_transactions=MAX_BLOCK_TRANSACTIONS,
+                 max_block_bytes=MAX_BLOCK_BYTES,
+                 prune=None):
+        if prune is not None and prune < MIN_PRUNE_BLOCKS:
+            raise ValueError(
+                f'A pruned node keeps at least {MIN_PRUNE_BLOCKS} blocks')
+        self.__lock = ReadWriteLock()
+        # Serializes lazy builds of the balance index by readers
+        self.__ledger_lock = threading.Lock()
+        # Starting block of the block chain. It keeps the original JSON
+        # hashing so that its hash is the same on every node.
+        self.__genesis_block = Block(0,
+                                     '', [],
+                                     100,
+                                     0,
+                                     version=BLOCK_VERSION_JSON)
+        # Append-only block log the chain is persisted to
+        self.__store = store if store is not None else BlockStore()
+        # Initializing the blockchain. Stored blocks are read on demand.
+        self.__chain = StoredChain(self.__store)
+        # Number of blocks at the start of the chain known to be valid
+        self.__verified_height = 1
+        # Proof of work engine
+        self.miner = ProofOfWorkMiner()
+        # Peers new transactions and mined blocks are broadcast to
+        self.network = network
         # Handling open transactions
-        self.__open_transactions = []
+        self.__mempool = Mempool(mempool_size)
+        # Limits of the open transactions mined into one block, the rest
+        # stay open for the next blocks
+        self.max_block_transactions = max_block_transactions
+        self.max_block_bytes = max_block_bytes
+        # Incremented whenever the open transactions change
+        self.__mempool_version = 0
+        # Tuple of the open transactions handed out to readers, built on
+        # demand after every change
+        self.__open_snapshot = None
+        # Hash of the ids of the open transactions, built on demand as well
+        self.__open_digest = None
+        # Per-address balance index, kept in step with the chain once it
+        # has been built by the first balance lookup
+        self.__ledger = None
+        # Snapshots of the balance index the node restarts from instead of
+        # walking the whole chain
+        self.__snapshots = (snapshots if snapshots is not None else
+                            SnapshotStore(
+                                os.path.join(self.__store.directory,
+                                             'snapshots')))
+        # Height of the newest snapshot matching the chain
+        self.__snapshot_height = 0
+        # Number of recent blocks whose transactions are kept, or None to
+        # keep every block. Older blocks keep only their headers, and the
+        # balance index is restored from snapshots instead of the blocks.
+        self.__prune = prune
         self.load_data()
         self.hosting_node = hosting_node_id
 
     def get_chain(self):
-        # Passing a reference as the original block chain
+        # Passing an immutable snapshot as the original block chain
         # shouldn't be altered when used in other functions
-        return self.__chain[:]
+        with self.__lock.read():
+            return self.__chain.snapshot()
+
+    def chain_length(self):
+        """ Returns the number of blocks in the chain """
+        with self.__lock.read():
+            return len(self.__chain)
+
+    def get_block(self, height):
+        """ Returns the block at the given height or None """
+        with self.__lock.read():
+            if not 0 <= height < len(self.__chain):
+                return None
+            return self.__chain[height]
+
+    def get_block_by_hash(self, block_hash):
+        """ Returns the block with the given hash or None """
+        with self.__lock.read():
+            height = self.__chain.height_of(block_hash)
+            return None if height is None else self.__chain[height]
+
+    def get_blocks(self, start, stop):
+        """ Returns the blocks with heights in [start, stop) """
+        with self.__lock.read():
+            return self.__chain[max(start, 0):stop]
+
+    def iter_blocks(self, start=0, stop=None):
+        """ Yields the blocks with heights in [start, stop) one at a time """
+        return self.get_chain().iter_range(start, stop)
+
+    def iter_headers(self, start=0, stop=None):
+        """
+        Yields the headers of the blocks with heights in [start, stop) one
+        at a time, without decoding their transactions
+        """
+        return self.get_chain().iter_headers(start, stop)
+
+    def verify_headers(self):
+        """
+        Verifies the whole chain from its block headers only, as a light
+        client holding just the headers would
+
+        Returns
+        -------
+            True (Boolean): If the headers form a valid chain
+        """
+        return Verification.verify_headers(list(self.iter_headers()))
+
+    def get_transaction_proof(self, block, tx_id):
+        """
+        Returns the Merkle inclusion proof of a transaction in a block
+
+        Parameters
+        ----------
+            block (Block): Block holding the transaction
+            tx_id (string): Id of the transaction
+
+        Returns
+        -------
+            proof (dict): The transaction, its position, the sibling hashes
+                          leading to the Merkle root and the block header,
+                          or None if the block doesn't hold the transaction
+                          or is older than Merkle roots
+        """
+        if (block.version < BLOCK_VERSION_MERKLE
+                or not isinstance(block, Block)):
+            return None
+        found = block.merkle_proof(tx_id)
+        if found is None:
+            return None
+        position, proof = found
+        return {
+            'transaction': block.transactions[position].to_dict(),
+            'tx_id': tx_id,
+            'position': position,
+            'proof': proof,
+            'merkle_root': block.merkle_root,
+            'header': block.header().to_dict()
+        }
+
+    def get_mempool_version(self):
+        """ Returns a counter that changes whenever the open transactions do """
+        return self.__mempool_version
 
     def get_open_transactions(self):
-        # Passing a reference as the original list of open transactions
-        # shouldn't be altered when used in other functions
-        return self.__open_transactions[:]
+        # Passing a tuple as the open transactions shouldn't be altered
+        # when used in other functions. It is shared until they change.
+        with self.__lock.read():
+            snapshot = self.__open_snapshot
+            if snapshot is None:
+                snapshot = self.__open_snapshot = tuple(self.__mempool)
+            return snapshot
+
+    def get_mempool_digest(self):
+        """
+        Returns the hash of the ids of the open transactions in order, which
+        identifies them across restarts unlike get_mempool_version
+        """
+        with self.__lock.read():
+            digest = self.__open_digest
+            if digest is None:
+                digest = self.__open_digest = hash_string_sha256(''.join(
+                    tx.id for tx in self.__mempool).encode())
+            return digest
+
+    def __mempool_changed(self):
+        # Called with the write lock held
+        self.__mempool_version += 1
+        self.__open_snapshot = None
+        self.__open_digest = None
+
+    def set_hosting_node(self, hosting_node_id):
+        """ Switches the wallet that mines and sends transactions """
+        with self.__lock.write():
+            self.hosting_node = hosting_node_id
 
     def load_data(self):
+        """
+        Streams the block chain and the open transactions back from the
+        block store, migrating a legacy blockchain_data.txt file first
+
+        Raises
+        ------
+            BlockPrunedError: If the chain is pruned and no snapshot to
+                              restore the balance index from is left, so
+                              the node has to resync
+        """
+        with self.__lock.write():
+            self.__load()
+
+    def __load(self):
         try:
-            with open('blockchain_data.txt', mode='r') as f:
-                file_content = f.readlines()
-
-                # Load block chain as OrderedDicts as hashing is performed on OrderedDict
-                block_chain = json.loads(file_content[0][:-1])
-                updated_block_chain = []
-                for block in block_chain:
-                    ordered_tx = [
-                        Transaction(tx['sender'], tx['recipient'],
-                                    tx['signature'], tx['amount'])
-                        for tx in block['transactions']
-                    ]
-                    updated_block = Block(block['index'],
-                                          block['previous_hash'], ordered_tx,
-                                          block['proof'], block['timestamp'])
-                    updated_block_chain.append(updated_block)
-                self.__chain = updated_block_chain
-
-                # Load Open transactions as OrderedDicts as hashing is performed on OrderedDict
-                open_transactions = json.loads(file_content[1])
-                updated_transactions = []
-                for tx in open_transactions:
-                    updated_transaction = Transaction(tx['sender'],
-                                                      tx['recipient'],
-                                                      tx['signature'],
-                                                      tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-        except (IOError, IndexError) as e:
-            print("File not found. " + str(e))
+            self.__store.migrate_legacy()
+            self.__chain = StoredChain(self.__store)
+            self.__verified_height = 1
+            self.__mempool.clear()
+            for tx in self.__store.load_mempool():
+                self.__mempool.add(tx)
+        except (IOError, IndexError, ValueError) as e:
+            print("Loading block chain failed. " + str(e))
             print(
                 "Handled exception - Initialized blockchain to Genesis block.")
+        if len(self.__chain) == 0:
+            self.__chain.append(self.__genesis_block)
+        self.__ledger = None
+        self.__snapshot_height = 0
+        self.__restore_snapshot()
+        if self.__ledger is None and self.__chain.pruned_height():
+            logger.error('No snapshot to restore the balance index of the '
+                         'pruned chain from')
+            raise BlockPrunedError(
+                f'The chain in {self.__store.directory} is pruned and none '
+                f'of its snapshots can be restored. The node must resync: '
+                f'remove the directory and download the chain from peers '
+                f'again.')
+        # Open transactions saved before the node stopped may have been
+        # mined since
+        if len(self.__mempool):
+            utxos = self.__balance_index().utxos
+            for tx in self.__mempool:
+                if utxos.has_transaction(tx.id):
+                    self.__mempool.remove(tx.id)
+        self.__mempool_changed()
+
+    def __restore_snapshot(self):
+        # Restores the balance index from the newest snapshot of a block
+        # still on the chain and replays the blocks mined after it
+        chain = self.__chain
+        # The blocks after the snapshot must not be pruned to replay them
+        snapshot = self.__snapshots.latest(
+            lambda height, block_hash: (chain.pruned_height() <= height + 1
+                                        and height < len(chain)
+                                        and chain[height].hash == block_hash))
+        if snapshot is None:
+            return
+        ledger = snapshot.ledger
+        for block in chain.iter_range(snapshot.height + 1):
+            ledger.apply_block(block)
+            self.__mempool.remove_mined(block.transactions[:-1])
+        if chain.pruned_height():
+            ledger.prune_history(chain.pruned_height())
+        self.__ledger = ledger
+        self.__snapshot_height = snapshot.height
+        self.__verified_height = min(snapshot.verified_height,
+                                     snapshot.height + 1)
+        logger.info('Restored the snapshot at height %d, replayed %d blocks',
+                    snapshot.height,
+                    len(chain) - 1 - snapshot.height)
+
+    def verify_chain(self, full=False):
+        """
+        Verifies the blocks appended since the last successful verification,
+        or the whole chain from genesis when full is set. Pruned blocks are
+        verified from their headers.
 
-    def save_data(self):
-        logger.info('Saving block chain state.')
-        try:
-            with open('blockchain_data.txt', mode='w') as f:
-                # Convert both block objs and transaction objs within each block to dicts
-                saveable_chain = [
-                    block.__dict__ for block in [
-                        Block(block_el.index, block_el.previous_hash,
-                              [tx.__dict__ for tx in block_el.transactions],
-                              block_el.proof, block_el.timestamp)
-                        for block_el in self.__chain
-                    ]
-                ]
-                f.write(json.dumps(saveable_chain))
-                f.write('\n')
-                saveable_tx = [tx.__dict__ for tx in self.__open_transactions]
-                logger.info(f'Saving open transactions: {saveable_tx}')
-                f.write(json.dumps(saveable_tx))
-        except IOError:
-            logger.error("Saving failed.")
-
-    def proof_of_work(self):
+        Returns
+        -------
+            True (Boolean): If the block chain is valid
+            False (Boolean): If the block chain is invalid
         """
-        Function to find the valid proof of work that the proof validation condition
+        with self.__lock.read():
+            chain = self.__chain.snapshot()
+            tip_hash = chain[-1].hash
+            from_height = 1 if full else self.__verified_height
+        if not Verification.verify_chain(chain, from_height):
+            return False
+        with self.__lock.write():
+            # Blocks may have been replaced by a fork while verifying; the
+            # verified blocks are still in the chain if the block at their
+            # tip is
+            height = len(chain)
+            if (len(self.__chain) >= height
+                    and self.__chain[height - 1].hash == tip_hash):
+                self.__verified_height = max(self.__verified_height, height)
+        return True
+
+    def __balance_index(self):
+        # Called with the read or the write lock held
+        if self.__ledger is None:
+            with self.__ledger_lock:
+                if self.__ledger is None:
+                    self.__ledger = self.__build_ledger()
+        return self.__ledger
+
+    def rebuild_ledger(self):
+        """
+        Rebuilds the balance index from scratch by walking the whole chain
 
         Returns
         -------
-            proof (integer): Proof of work which satisfies condition
+            ledger (Ledger): The rebuilt balance index
+        """
+        with self.__lock.write():
+            self.__ledger = self.__build_ledger()
+            return self.__ledger
+
+    def __build_ledger(self):
+        if self.__chain.pruned_height():
+            logger.error('No snapshot to restore the balance index of the '
+                         'pruned chain from')
+            raise BlockPrunedError('The balance index of a pruned chain '
+                                   'can only be restored from a snapshot')
+        logger.info('Rebuilding balance index from the block chain')
+        with LEDGER_BUILD_SECONDS.time():
+            return Ledger.from_chain(self.__chain)
 
+    def save_data(self):
         """
-        logger.info('Finding proof of work')
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        proof = 0
-        while not Verification.valid_proof(self.__open_transactions, last_hash,
-                                           proof):
-            proof += 1
-        return proof
+        Appends the blocks mined since the last save to the block log and
+        saves the changes of the open transactions
+        """
+        with self.__lock.write():
+            self.__save()
+
+    def __save(self):
+        logger.info('Saving block chain state.')
+        try:
+            with SAVE_SECONDS.time():
+                self.__chain.flush()
 
-    def get_balances(self):
+                self.__save_mempool()
+                if (len(self.__chain) - 1 >=
+                        self.__snapshot_height + self.__snapshots.interval):
+                    self.__take_snapshot()
+        except IOError:
+            logger.error("Saving failed.")
+
+    def __save_mempool(self):
+        # Appends the changes of the open transactions to the journal, and
+        # rewrites them all once the journal outgrows them
+        reset, added, removed = self.__mempool.changes()
+        journal = (self.__store.mempool_journal_records() + len(added) +
+                   len(removed))
+        if reset or journal > len(self.__mempool) + MEMPOOL_JOURNAL_SLACK:
+            logger.info('Saving %d open transactions', len(self.__mempool))
+            self.__store.save_mempool(list(self.__mempool))
+        elif added or removed:
+            self.__store.append_mempool(added, removed)
+        self.__mempool.saved()
+
+    def __take_snapshot(self):
+        # Called with the write lock held, after the chain was flushed
+        height = len(self.__chain) - 1
+        self.__snapshots.save(height, self.__chain[height].hash,
+                              min(self.__verified_height, height + 1),
+                              self.__balance_index())
+        self.__snapshot_height = height
+        if self.__prune is not None:
+            self.__prune_blocks()
+
+    def __prune_blocks(self):
+        # Called with the write lock held, after a snapshot was taken. The
+        # blocks after the oldest snapshot kept are never pruned, so the
+        # balance index can be restored from any of them.
+        pruned_height = self.__chain.pruned_height()
+        height = min(len(self.__chain) - self.__prune,
+                     min(self.__snapshots.heights()) + 1)
+        if height <= pruned_height:
+            return
+        if self.__chain.prune(height) > pruned_height:
+            self.__ledger.prune_history(self.__chain.pruned_height())
+
+    def pruned_height(self):
+        """ Returns the number of blocks whose transactions were pruned """
+        with self.__lock.read():
+            return self.__chain.pruned_height()
+
+    def __block_transactions(self):
+        # Called with the read or the write lock held
+        return self.__mempool.select(self.max_block_transactions,
+                                     self.max_block_bytes)
+
+    def get_balances(self, participant=None):
         """
         Returns the fund balance of the participant based on the amounts received
         (from processed transactions) and the amounts sent (from both processed
         and open transactions)
         Parameters
         ----------
-            participant (string): The sender's name
+            participant (string): The participant's public key
+                                  (default = the hosting node)
 
         Returns
         -------
             balance funds (float): The balance fund of the participant
         """
-        if self.hosting_node is None:
-            return None
+        with BALANCE_SECONDS.time(), self.__lock.read():
+            return self.__balance(participant)
 
-        participant = self.hosting_node
-
-        logger.info(f'Computing Fund balance of user {participant }')
-
-        tx_sender = [[
-            tx.amount for tx in block.transactions if tx.sender == participant
-        ] for block in self.__chain]
-
-        open_tx_sender = [
-            tx.amount for tx in self.__open_transactions
-            if tx.sender == participant
-        ]
+    def get_history(self, address, offset=0, limit=None):
+        """
+        Returns a page of the mined transactions an address sent or
+        received, newest first, from the per-address history index. Pruned
+        nodes only know the transactions of the blocks they kept.
 
-        tx_sender.append(open_tx_sender)
-        amount_sent = functools.reduce(
-            lambda tx_sum, tx_amt: tx_sum + sum(tx_amt), tx_sender, 0)
+        Parameters
+        ----------
+            address (string): The participant's public key
+            offset (integer): Number of newer transactions to skip
+            limit (integer): Largest number of transactions returned
+                             (default = all of them)
 
-        logger.debug(
-            f'Total amounts sent (processed + open transactions) : {amount_sent}'
-        )
+        Returns
+        -------
+            (total, history): Number of mined transactions involving the
+                              address and the page, as dicts holding the
+                              transaction and where it was mined
+        """
+        with self.__lock.read():
+            ledger = self.__balance_index()
+            history = []
+            for height, position in ledger.history(address, offset, limit):
+                # Only the transaction is decoded, not its whole block
+                header, transaction = self.__chain.transaction_at(
+                    height, position)
+                history.append({
+                    'height': height,
+                    'position': position,
+                    'block_hash': header.hash,
+                    'timestamp': header.timestamp,
+                    'transaction': transaction.to_dict()
+                })
+            return ledger.history_count(address), history
+
+    def __balance(self, participant=None):
+        if participant is None:
+            participant = self.hosting_node
+        if participant is None:
+            return None
 
-        tx_recipient = [[
-            tx.amount for tx in block.transactions
-            if tx.recipient == participant
-        ] for block in self.__chain]
+        logger.debug('Looking up fund balance of user %s', participant)
+        return (self.__balance_index().balance(participant) -
+                self.__mempool.pending_sent(participant))
 
-        amount_received = functools.reduce(
-            lambda tx_sum, tx_amt: tx_sum + sum(tx_amt), tx_recipient, 0)
+    def __valid_inputs(self, transaction):
+        # Called with the write lock held. The inputs must be unspent
+        # outputs of the sender which no open transaction spends, so the
+        # funds need no other check.
+        try:
+            self.__balance_index().utxos.check_inputs(
+                transaction, self.__mempool.claimed_outputs())
+        except InvalidSpend as e:
+            logger.warning('Invalid inputs of transaction %s: %s',
+                           transaction.id, e)
+            return False
+        return True
 
-        logger.debug(
-            f'Total amounts received (processed transactions) : {amount_received}'
-        )
+    def get_unspent_outputs(self, address):
+        """
+        Returns the unspent outputs of an address, oldest first, as dicts
+        holding the transaction id, output index, amount and whether an
+        open transaction already spends the output
+        """
+        with self.__lock.read():
+            claimed = self.__mempool.claimed_outputs()
+            return [{
+                'tx_id': tx_id,
+                'index': index,
+                'amount': amount,
+                'claimed': (tx_id, index) in claimed
+            } for (tx_id, index), amount in
+                    self.__balance_index().utxos.outputs(address)]
+
+    def select_inputs(self, address, amount):
+        """
+        Picks the oldest unspent outputs of the address no open transaction
+        spends yet which cover the amount
 
-        return amount_received - amount_sent
+        Returns
+        -------
+            inputs (list): (transaction id, output index) of the outputs,
+                           or None if they don't cover the amount
+        """
+        with self.__lock.read():
+            claimed = self.__mempool.claimed_outputs()
+            inputs = []
+            total = 0
+            for outpoint, value in self.__balance_index().utxos.outputs(
+                    address):
+                if total >= amount:
+                    break
+                if outpoint not in claimed:
+                    inputs.append(outpoint)
+                    total += value
+            return inputs if inputs and total >= amount else None
 
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain """
-        if len(self.__chain) < 1:
-            return None
-        return self.__chain[-1]
-
-    def add_transaction(self, recipient, sender, signature, amount=1.0):
+        with self.__lock.read():
+            if len(self.__chain) < 1:
+                return None
+            return self.__chain[-1]
+
+    def add_transaction(self,
+                        recipient,
+                        sender,
+                        signature,
+                        amount=1.0,
+                        is_receiving=False,
+                        scheme=SCHEME_RSA,
+                        inputs=(),
+                        nonce=None):
         """
         Adds a new transaction (if valid) to the list of open transactions.
 
@@ -174,59 +577,387 @@ class BlockChain:
             recipient (String): The recipient of the coins
             amount (float): The amount of coins sent in the transaction
                             (default = 1.0)
+            is_receiving (Boolean): True for transactions broadcast by a
+                                    peer, which are not broadcast again
+            scheme (String): Signature scheme of the sender's key
+                             (default = RSA)
+            inputs (list): (transaction id, output index) of the outputs
+                           of the sender spent, see utxo (default = spend
+                           from the balance)
+            nonce (integer): Signed nonce of the transaction (default =
+                             none, as signed before there were nonces)
         """
-        if self.hosting_node is None:
+        if self.hosting_node is None and not is_receiving:
             return False
+        transaction = Transaction(sender, recipient, signature, amount,
+                                  scheme, inputs, nonce)
+        return self.add_transactions([transaction], is_receiving)[0] is None
 
-        transaction = Transaction(sender, recipient, signature, amount)
+    def add_transactions(self, transactions, is_receiving=False):
+        """
+        Adds a batch of transactions to the open transactions in one pass:
+        all signatures are verified in one fan-out, funds are checked in
+        order against running per-sender totals (so a sender can't overspend
+        within the batch) and the open transactions are saved once.
+        Transactions naming their inputs are checked against the unspent
+        outputs and the outputs claimed by open transactions instead.
 
-        if Verification.verify_transaction(transaction, self.get_balances):
-            logger.info(
-                'Valid transaction. Adding to list of open transactions.')
-            self.__open_transactions.append(transaction)
-            self.save_data()
-            return True
-        return False
+        Parameters
+        ----------
+            transactions (list): Transactions to add
+            is_receiving (Boolean): True for transactions broadcast by a
+                                    peer, which are not broadcast again
 
-    def mine_block(self):
+        Returns
+        -------
+            results (list): For every transaction, None if it was added or
+                            the reason it was rejected
+        """
+        if self.hosting_node is None and not is_receiving:
+            return ['No wallet available'] * len(transactions)
+
+        # Check the signatures before taking the write lock; the results
+        # are cached so the checks under the lock are cheap
+        signatures = signature_verifier.verify_all(transactions)
+        results = []
+        added = []
+        with self.__lock.write():
+            for transaction, valid_signature in zip(transactions, signatures):
+                if not valid_amount(transaction.amount):
+                    logger.warning('Invalid transaction amount %r',
+                                   transaction.amount)
+                    results.append('Invalid amount')
+                elif not valid_signature:
+                    logger.warning('Invalid transaction signature.')
+                    results.append('Invalid signature')
+                elif (transaction.id in self.__mempool
+                      or self.__balance_index().utxos.has_transaction(
+                          transaction.id)):
+                    logger.warning('Duplicate transaction %s', transaction.id)
+                    results.append('Duplicate transaction')
+                elif self.__mempool.spends_inputs(transaction.sender) not in (
+                        None, bool(transaction.inputs)):
+                    results.append('Sender has open transactions of the '
+                                   'other kind')
+                elif (transaction.inputs
+                      and not self.__valid_inputs(transaction)):
+                    results.append('Invalid inputs')
+                # The mempool keeps the pending total of every sender up
+                # to date as transactions are added
+                elif (not transaction.inputs
+                      and not Verification.verify_transaction(
+                          transaction, self.__balance)):
+                    results.append('Insufficient funds')
+                elif self.__mempool.add(transaction) is None:
+                    results.append('Mempool is full')
+                else:
+                    results.append(None)
+                    added.append(transaction)
+            if added:
+                logger.info('Adding %d valid transactions to the list of '
+                            'open transactions.', len(added))
+                self.__mempool_changed()
+                self.__save()
+        if self.network is not None and not is_receiving:
+            for transaction in added:
+                self.network.broadcast_transaction(transaction)
+        return results
+
+    def mine_block(self, should_stop=None):
         """
         Function to mine blocks from the list of open transactions.
         Also adds a reward transaction to the miner.
+
+        Parameters
+        ----------
+            should_stop (callable): Polled while searching for the proof;
+                                    mining is abandoned once it returns True
+
+        Returns
+        -------
+            block (Block): The mined block, or None if mining failed or
+                           was stopped
         """
-        if self.hosting_node is None:
+        start = time.perf_counter()
+        with self.__lock.read():
+            hosting_node = self.hosting_node
+            height = len(self.__chain)
+            hashed_block = self.__chain[-1].hash
+            last_timestamp = self.__chain[-1].timestamp
+            difficulty = Verification.next_difficulty(self.__chain)
+            # The block is mined from the highest ranked transactions open
+            # right now; the rest and transactions added while mining stay
+            # open for the next block
+            copied_transactions = self.__block_transactions()
+
+        if hosting_node is None:
             logger.warning('No wallet available.')
             return None
-
-        last_block = self.__chain[-1]
-        hashed_block = hash_block(last_block)
         logger.debug(f'Computed hash of previous block: {hashed_block}')
 
-        proof = self.proof_of_work()
-        logger.debug(f'Found valid proof: {proof}')
+        # Verify Transaction signatures before awarding the mining reward
+        invalid = signature_verifier.first_invalid(copied_transactions)
+        if invalid is not None:
+            logger.warning(
+                f'Invalid transaction signature in the block at position {invalid}'
+            )
+            return None
 
-        # Rewarding users who mine blocks is a way to get coins into the blockchain
+        # Rewarding users who mine blocks is a way to get coins into the
+        # blockchain. The header commits to every transaction through the
+        # Merkle root, so the reward is part of the block before mining.
         logger.info('Creating Mining Reward Transaction')
-        reward_transaction = Transaction('MINING', self.hosting_node, '',
-                                         MINING_REWARD)
-
-        # Add the reward transaction to the list of
-        # open transactions before mining the block
-        copied_transactions = self.__open_transactions[:]
+        # Its nonce is the height, so every reward has its own id
+        reward_transaction = Transaction('MINING', hosting_node, '',
+                                         MINING_REWARD, nonce=height)
+        copied_transactions.append(reward_transaction)
+        # Timestamps must increase even if the clock is behind the last block
+        candidate = Block(height,
+                          hashed_block,
+                          copied_transactions,
+                          None,
+                          max(time.time(), math.nextafter(last_timestamp,
+                                                          math.inf)),
+                          difficulty=difficulty)
+
+        # The proof is searched without holding any lock
+        proof = self.miner.mine_header(candidate, should_stop=should_stop)
+        if proof is None:
+            logger.info('Mining stopped before a proof was found')
+            return None
+        logger.debug(f'Found valid proof: {proof}')
 
-        # Verify Transaction signatures before awarding the mining reward
-        for tx in copied_transactions:
-            if not Wallet.verify_transaction_signature(tx):
-                logger.warning('Invalid transaction signatures in the block')
+        logger.debug('Creating new block with all open + reward transactions')
+        block = Block(height,
+                      hashed_block,
+                      copied_transactions,
+                      proof,
+                      candidate.timestamp,
+                      difficulty,
+                      merkle_root=candidate.merkle_root)
+
+        with self.__lock.write():
+            if (len(self.__chain) != height
+                    or self.__chain[-1].hash != hashed_block):
+                logger.info('Chain changed while mining, discarding the block')
                 return None
+            if self.__ledger is not None:
+                try:
+                    self.__ledger.apply_block(block)
+                except InvalidSpend as e:
+                    logger.warning('Mined block spends invalid outputs: %s', e)
+                    return None
+            self.__chain.append(block)
+            self.__mempool.remove_mined(copied_transactions[:-1])
+            self.__mempool_changed()
+            self.__save()
+        BLOCKS_MINED.inc()
+        BLOCK_MINING_SECONDS.observe(time.perf_counter() - start)
+        if self.network is not None:
+            self.network.broadcast_block(block)
+        return block
 
-        copied_transactions.append(reward_transaction)
-        self.__open_transactions.append(reward_transaction)
+    def add_block(self, block):
+        """
+        Adds a block mined by a peer on top of the chain
 
-        logger.debug('Creating new block with all open + reward transactions')
-        block = Block(len(self.__chain), hashed_block, copied_transactions,
-                      proof)
+        Returns
+        -------
+            True (Boolean): If the block was valid and added
+        """
+        return self.replace_chain(block.index - 1, [block])
 
-        self.__chain.append(block)
-        self.__open_transactions = []
-        self.save_data()
-        return block
+    def replace_chain(self, fork_height, blocks):
+        """
+        Switches the chain to a fork if the fork is valid and longer. The
+        blocks after fork_height are replaced by the blocks of the fork and
+        their transactions go back to the open transactions. Only the blocks
+        of the fork are verified, the shared blocks are trusted.
+
+        Parameters
+        ----------
+            fork_height (integer): Height of the last block shared with the
+                                   fork
+            blocks (list): Blocks of the fork after fork_height
+
+        Returns
+        -------
+            True (Boolean): If the chain switched to the fork
+            False (Boolean): If the fork was invalid or not longer
+        """
+        with self.__lock.read():
+            length = len(self.__chain)
+            if (not blocks or not 0 <= fork_height < length
+                    or fork_height + 1 + len(blocks) <= length):
+                return False
+            base = self.__chain.snapshot()
+        fork_hash = base[fork_height].hash
+        # Proofs and signatures don't depend on balances, so they are
+        # checked without holding the lock
+        candidate = ExtendedChain(base, fork_height + 1, blocks)
+        if not self.__valid_fork(candidate, fork_height + 1):
+            return False
+
+        with self.__lock.write():
+            if (len(self.__chain) <= fork_height
+                    or self.__chain[fork_height].hash != fork_hash
+                    or fork_height + 1 + len(blocks) <= len(self.__chain)):
+                logger.info('Chain changed while checking the fork')
+                return False
+            if fork_height + 1 < self.__chain.pruned_height():
+                logger.info('Fork at height %d is below the pruned blocks',
+                            fork_height)
+                return False
+            orphaned = self.__chain[fork_height + 1:]
+            ledger = self.__balance_index()
+            if not self.__funded(blocks, orphaned, ledger):
+                return False
+            # Outputs the fork spends are checked by applying it
+            if all(ledger.can_revert(block) for block in orphaned):
+                if not self.__switch_ledger(ledger, orphaned, blocks):
+                    return False
+            elif self.__chain.pruned_height():
+                logger.info('Fork at height %d is too deep to switch to '
+                            'without the pruned blocks', fork_height)
+                return False
+            else:
+                logger.info('Rebuilding the balance index for a deep fork')
+                try:
+                    ledger = Ledger.from_chain(candidate)
+                except InvalidSpend as e:
+                    logger.warning('Invalid spend in the fork: %s', e)
+                    return False
+                self.__ledger = ledger
+
+            logger.info('Switching to a fork at height %d: %d blocks '
+                        'dropped, %d added', fork_height, len(orphaned),
+                        len(blocks))
+            self.__chain.truncate(fork_height + 1)
+            for block in blocks:
+                self.__chain.append(block)
+            if self.__verified_height > fork_height:
+                self.__verified_height = len(self.__chain)
+
+            # Transactions of dropped blocks are open again, unless the fork
+            # mined them too
+            for block in blocks:
+                self.__mempool.remove_mined(block.transactions[:-1])
+            for block in orphaned:
+                for tx in block.transactions[:-1]:
+                    if (tx.id not in self.__mempool
+                            and not ledger.utxos.has_transaction(tx.id)):
+                        self.__mempool.add(tx)
+            self.__drop_unfunded(ledger)
+            self.__mempool_changed()
+            self.__save()
+        return True
+
+    @staticmethod
+    def __switch_ledger(ledger, orphaned, blocks):
+        """
+        Reverts the orphaned blocks and applies the blocks of a fork to the
+        ledger, restoring it if a block of the fork spends outputs it can't
+
+        Returns
+        -------
+            True (Boolean): If the ledger switched to the fork
+        """
+        for block in reversed(orphaned):
+            ledger.revert_block(block)
+        applied = []
+        try:
+            for block in blocks:
+                ledger.apply_block(block)
+                applied.append(block)
+        except InvalidSpend as e:
+            logger.warning('Invalid spend in block %d of the fork: %s',
+                           block.index, e)
+            for block in reversed(applied):
+                ledger.revert_block(block)
+            for block in orphaned:
+                ledger.apply_block(block)
+            return False
+        return True
+
+    def __drop_unfunded(self, ledger):
+        """
+        Drops the newest open transactions of every sender whose open
+        transactions spend more than the chain now gives them, and the open
+        transactions naming inputs which are no longer unspent, are spent by
+        an older open transaction or which share their sender with
+        transactions of dropped blocks spending from the balance
+        """
+        for sender in self.__mempool.senders():
+            transactions = self.__mempool.sender_transactions(sender)
+            with_inputs = [tx for tx in transactions if tx.inputs]
+            mixed = len(with_inputs) != len(transactions)
+            spent = set()
+            for tx in with_inputs:
+                if (mixed or not spent.isdisjoint(tx.inputs)
+                        or not all(outpoint in ledger.utxos
+                                   for outpoint in tx.inputs)):
+                    logger.info('Dropping transaction %s spending '
+                                'unavailable outputs', tx.id)
+                    self.__mempool.remove(tx.id)
+                else:
+                    spent.update(tx.inputs)
+            transactions = [tx for tx in transactions if not tx.inputs]
+            while (transactions and self.__mempool.pending_sent(sender) >
+                   ledger.balance(sender) + FUNDS_TOLERANCE):
+                tx = transactions.pop()
+                logger.info('Dropping unfunded transaction %s', tx.id)
+                self.__mempool.remove(tx.id)
+
+    @staticmethod
+    def __valid_fork(candidate, from_height):
+        """ Checks the blocks of a fork from from_height on """
+        transactions = []
+        for height in range(from_height, len(candidate)):
+            block = candidate[height]
+            rewards = [tx for tx in block.transactions if tx.sender == 'MINING']
+            # Every block ends with exactly one reward transaction, which
+            # from BLOCK_VERSION_UNIQUE_IDS on has the height as its nonce
+            if (block.index != height or len(rewards) != 1
+                    or block.transactions[-1] is not rewards[0]
+                    or rewards[0].amount != MINING_REWARD
+                    or (block.version >= BLOCK_VERSION_UNIQUE_IDS
+                        and rewards[0].nonce != height)
+                    or not all(valid_amount(tx.amount)
+                               for tx in block.transactions)):
+                logger.warning('Invalid block structure at height %d', height)
+                return False
+            transactions.extend(block.transactions[:-1])
+        if not Verification.verify_chain(candidate, from_height):
+            return False
+        invalid = signature_verifier.first_invalid(transactions)
+        if invalid is not None:
+            logger.warning('Invalid transaction signature in the fork')
+            return False
+        return True
+
+    @staticmethod
+    def __funded(blocks, orphaned, ledger):
+        """
+        Checks that no sender in the blocks of a fork spends more than it
+        has, given the balances of the chain without the orphaned blocks
+        """
+        # Changes of the confirmed balances relative to the ledger
+        delta = defaultdict(float)
+        for block in orphaned:
+            for tx in block.transactions:
+                delta[tx.sender] += tx.amount
+                delta[tx.recipient] -= tx.amount
+        for block in blocks:
+            spent = defaultdict(float)
+            for tx in block.transactions[:-1]:
+                spent[tx.sender] += tx.amount
+                available = ledger.balance(tx.sender) + delta[tx.sender]
+                # Allow for rounding of the float sums
+                if spent[tx.sender] > available + FUNDS_TOLERANCE:
+                    logger.warning('Overspending transaction in block %d',
+                                   block.index)
+                    return False
+            for tx in block.transactions:
+                delta[tx.sender] -= tx.amount
+                delta[tx.recipient] += tx.amount
+        return True
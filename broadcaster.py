@@ -0,0 +1,340 @@
+import json
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Kinds of broadcast messages
+TRANSACTION = 'transaction'
+BLOCK = 'block'
+# Keep-alive connections opened to every peer
+PEER_CONNECTIONS = 2
+# Messages of each kind queued per peer; the oldest are dropped beyond this
+QUEUE_SIZE = 10000
+# Largest number of queued transactions sent to a peer in one request
+BATCH_SIZE = 100
+# Deliveries are retried this many times, waiting RETRY_BACKOFF seconds
+# before the first retry and twice as long before every further one (at
+# most MAX_BACKOFF seconds)
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.1
+MAX_BACKOFF = 5
+# Seconds to wait for a peer to answer
+PEER_TIMEOUT = 5
+
+
+class PeerConnection:
+    """ Keep-alive HTTP/1.1 connection to a peer over asyncio streams """
+    def __init__(self, peer, stats):
+        host, _, port = peer.rpartition(':')
+        self.peer = peer
+        self.host = host or peer
+        self.port = int(port) if host else 80
+        self.stats = stats
+        self.__reader = None
+        self.__writer = None
+
+    async def __connect(self):
+        self.__reader, self.__writer = await asyncio.open_connection(
+            self.host, self.port)
+        self.stats['connections'] += 1
+
+    def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+        self.__reader = self.__writer = None
+
+    async def post(self, path, data):
+        """
+        Posts data as JSON to the peer
+
+        Returns
+        -------
+            (status, body): HTTP status and body of the answer
+        """
+        body = json.dumps(data).encode('utf8')
+        request = (f'POST {path} HTTP/1.1\r\n'
+                   f'Host: {self.peer}\r\n'
+                   'Content-Type: application/json\r\n'
+                   f'Content-Length: {len(body)}\r\n'
+                   '\r\n').encode('latin-1') + body
+        reused = self.__writer is not None
+        if not reused:
+            await self.__connect()
+        try:
+            return await self.__exchange(request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        # The peer closed the idle connection, send again on a new one
+        await self.__connect()
+        return await self.__exchange(request)
+
+    async def __exchange(self, request):
+        self.__writer.write(request)
+        await self.__writer.drain()
+        status_line = await self.__reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by the peer')
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await self.__reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        keep_alive = (version != b'HTTP/1.0'
+                      and headers.get('connection') != 'close')
+        if 'content-length' in headers:
+            body = await self.__reader.readexactly(
+                int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            body = await self.__read_chunked()
+        else:
+            body = await self.__reader.read()
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return int(status), body
+
+    async def __read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.__reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await self.__reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.__reader.readexactly(size))
+            await self.__reader.readline()
+
+
+class PeerChannel:
+    """
+    Queue of the messages waiting to be sent to one peer, drained by one
+    worker task per connection. Messages reach the peer in order: a block
+    is only sent once the messages before it were delivered and nothing
+    after it is sent before it, while runs of queued transactions are
+    sent in batches over all the connections.
+    """
+    def __init__(self, broadcaster, peer):
+        self.broadcaster = broadcaster
+        self.peer = peer
+        # (kind, data) of the queued messages, oldest first
+        self.__queue = deque()
+        # Kinds of the requests being sent
+        self.__sending = Counter()
+        # Messages queued or being sent
+        self.__unfinished = 0
+        # Set whenever the queue or the requests being sent change
+        self.__changed = asyncio.Event()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.__connections = [
+            PeerConnection(peer, broadcaster.stats)
+            for _ in range(broadcaster.connections)
+        ]
+        self.__workers = [
+            asyncio.ensure_future(self.__work(connection))
+            for connection in self.__connections
+        ]
+
+    def put(self, kind, data):
+        if len(self.__queue) >= self.broadcaster.queue_size:
+            self.__queue.popleft()
+            self.broadcaster.stats['dropped'] += 1
+            self.__finished(1)
+        self.__queue.append((kind, data))
+        self.__unfinished += 1
+        self.__idle.clear()
+        self.__changed.set()
+
+    def __finished(self, count):
+        self.__unfinished -= count
+        if self.__unfinished == 0:
+            self.__idle.set()
+
+    async def join(self):
+        await self.__idle.wait()
+
+    def close(self):
+        for worker in self.__workers:
+            worker.cancel()
+        for connection in self.__connections:
+            connection.close()
+
+    def __can_send(self):
+        if not self.__queue or self.__sending[BLOCK]:
+            return False
+        return self.__queue[0][0] != BLOCK or not sum(self.__sending.values())
+
+    async def __next_request(self):
+        while not self.__can_send():
+            self.__changed.clear()
+            await self.__changed.wait()
+        kind, data = self.__queue.popleft()
+        self.__sending[kind] += 1
+        if kind == BLOCK:
+            return kind, '/broadcast-block', data, 1
+        batch = [data]
+        while (len(batch) < self.broadcaster.batch_size and self.__queue
+               and self.__queue[0][0] == TRANSACTION):
+            batch.append(self.__queue.popleft()[1])
+        return kind, '/broadcast-transactions', {'transactions': batch}, len(
+            batch)
+
+    async def __work(self, connection):
+        while True:
+            kind, path, data, count = await self.__next_request()
+            try:
+                await self.__deliver(connection, path, data)
+            finally:
+                self.__sending[kind] -= 1
+                self.__finished(count)
+                self.__changed.set()
+
+    async def __deliver(self, connection, path, data):
+        broadcaster = self.broadcaster
+        for attempt in range(broadcaster.retries + 1):
+            if attempt:
+                broadcaster.stats['retries'] += 1
+                await asyncio.sleep(
+                    min(broadcaster.backoff * 2**(attempt - 1), MAX_BACKOFF))
+            try:
+                status, _ = await asyncio.wait_for(connection.post(path, data),
+                                                   broadcaster.timeout)
+            except (OSError, ValueError, asyncio.IncompleteReadError,
+                    asyncio.TimeoutError) as error:
+                connection.close()
+                logger.debug('Sending %s to %s failed: %r', path, self.peer,
+                             error)
+                continue
+            broadcaster.stats['requests'] += 1
+            # Peers answer 4xx for transactions or blocks they don't take
+            if status < 500:
+                return True
+            logger.debug('Peer %s answered %s with %d', self.peer, path,
+                         status)
+        broadcaster.stats['failed'] += 1
+        logger.warning('Giving up sending %s to %s', path, self.peer)
+        return False
+
+
+class Broadcaster:
+    """
+    Delivers broadcast messages to peers from an asyncio event loop running
+    on a background thread. Every peer has bounded queues and a few
+    keep-alive connections; queued transactions are sent to a peer in
+    batches and failed deliveries are retried with exponential backoff.
+    Sending only queues the message, so callers never wait on peers.
+    """
+    def __init__(self,
+                 connections=PEER_CONNECTIONS,
+                 queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE,
+                 retries=MAX_RETRIES,
+                 backoff=RETRY_BACKOFF,
+                 timeout=PEER_TIMEOUT):
+        self.connections = connections
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # Counts of requests, connections opened, retries, dropped messages
+        # and messages given up on
+        self.stats = Counter()
+        self.__loop = None
+        self.__thread = None
+        self.__channels = {}
+        self.__lock = threading.Lock()
+
+    def __get_loop(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target=self.__loop.run_forever,
+                                                 name='broadcaster',
+                                                 daemon=True)
+                self.__thread.start()
+            return self.__loop
+
+    def send(self, peers, kind, data):
+        """
+        Queues a message for the given peers
+
+        Parameters
+        ----------
+            peers (list): Peer nodes as host:port
+            kind (string): TRANSACTION or BLOCK
+            data (dict): JSON body of a transaction, or of a block broadcast
+        """
+        if not peers:
+            return
+        self.stats['messages'] += 1
+        self.__get_loop().call_soon_threadsafe(self.__enqueue, list(peers),
+                                               kind, data)
+
+    def __enqueue(self, peers, kind, data):
+        for peer in peers:
+            channel = self.__channels.get(peer)
+            if channel is None:
+                channel = self.__channels[peer] = PeerChannel(self, peer)
+            channel.put(kind, data)
+
+    def remove_peer(self, peer):
+        """ Drops the queued messages and connections of a peer """
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__remove_channel, peer)
+
+    def __remove_channel(self, peer):
+        channel = self.__channels.pop(peer, None)
+        if channel is not None:
+            channel.close()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message was delivered or given up on
+
+        Returns
+        -------
+            True (Boolean): If the queues drained within the timeout
+        """
+        if self.__loop is None:
+            return True
+        future = asyncio.run_coroutine_threadsafe(self.__join(), self.__loop)
+        try:
+            future.result(timeout)
+            return True
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return False
+
+    async def __join(self):
+        for channel in list(self.__channels.values()):
+            await channel.join()
+
+    def close(self):
+        """ Stops the event loop, dropping undelivered messages """
+        with self.__lock:
+            loop, self.__loop = self.__loop, None
+        if loop is None:
+            return
+
+        def stop():
+            for channel in self.__channels.values():
+                channel.close()
+            self.__channels.clear()
+            loop.stop()
+
+        loop.call_soon_threadsafe(stop)
+        self.__thread.join()
+        # Let the cancelled workers finish before the loop goes away
+        loop.run_until_complete(
+            asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+        loop.close()
@@ -0,0 +1,191 @@
+import sys
+import bisect
+import struct
+import logging
+from array import array
+from functools import partial
+from collections import defaultdict
+
+from utils.encoding import Decoder, encode_text
+from utxo import UtxoSet
+
+logger = logging.getLogger(__name__)
+
+# History entries pack the height of a block and the position of the
+# transaction in it into one integer, the position taking the low bits
+POSITION_BITS = 32
+_U32 = struct.Struct('>I')
+# Encoded account after the address: <received><sent><history entries>
+_ACCOUNT = struct.Struct('>ddI')
+
+
+class Ledger:
+    """
+    Per-address balance and history index. Keeps running totals of the
+    confirmed amounts received and sent by every address, so balance
+    lookups don't rescan the chain, and the (block height, position) of
+    every mined transaction each address sent or received, in chain order.
+    The unspent outputs of the chain are kept alongside (see utxo). Amounts
+    committed in open transactions are tracked by the Mempool.
+    """
+    def __init__(self):
+        self.__received = defaultdict(float)
+        self.__sent = defaultdict(float)
+        # Packed history entries of every address, oldest first
+        self.__history = defaultdict(partial(array, 'Q'))
+        self.utxos = UtxoSet()
+
+    @classmethod
+    def from_chain(cls, chain):
+        """
+        Builds a fresh index by walking every block of the chain
+
+        Parameters
+        ----------
+            chain (list): Blocks of the block chain
+
+        Returns
+        -------
+            ledger (Ledger): Index consistent with the given chain
+        """
+        ledger = cls()
+        for block in chain:
+            ledger.apply_block(block)
+        return ledger
+
+    def apply_block(self, block):
+        """
+        Adds the transactions of a mined block to the confirmed totals and
+        the history of their addresses, and spends the outputs they spend.
+        A block spending outputs it can't is left unapplied.
+
+        Raises
+        ------
+            InvalidSpend: If a transaction spends outputs it can't
+        """
+        self.utxos.apply_block(block)
+        base = block.index << POSITION_BITS
+        for position, tx in enumerate(block.transactions):
+            self.__sent[tx.sender] += tx.amount
+            self.__received[tx.recipient] += tx.amount
+            self.__history[tx.sender].append(base | position)
+            if tx.recipient != tx.sender:
+                self.__history[tx.recipient].append(base | position)
+
+    def can_revert(self, block):
+        """ Returns whether the block is recent enough to be reverted """
+        return self.utxos.can_revert(block)
+
+    def revert_block(self, block):
+        """
+        Removes the transactions of a block dropped by a reorganization.
+        Blocks are reverted from the tip down, so their history entries are
+        the last ones of every address.
+        """
+        for tx in block.transactions:
+            self.__sent[tx.sender] -= tx.amount
+            self.__received[tx.recipient] -= tx.amount
+            for address in (tx.sender, tx.recipient):
+                entries = self.__history.get(address)
+                if entries is None:
+                    continue
+                while entries and entries[-1] >> POSITION_BITS == block.index:
+                    entries.pop()
+                if not entries:
+                    del self.__history[address]
+        self.utxos.revert_block(block)
+
+    def balance(self, address):
+        """
+        Returns the fund balance of the address based on the amounts
+        received and sent in mined blocks
+        """
+        return self.__received.get(address, 0) - self.__sent.get(address, 0)
+
+    def history_count(self, address):
+        """ Returns the number of mined transactions involving the address """
+        return len(self.__history.get(address, ()))
+
+    def history(self, address, offset=0, limit=None):
+        """
+        Returns a page of the mined transactions the address sent or
+        received, newest first
+
+        Parameters
+        ----------
+            address (string): The participant's public key
+            offset (integer): Number of newer transactions to skip
+            limit (integer): Largest number of transactions returned
+                             (default = all of them)
+
+        Returns
+        -------
+            history (list): (block height, position in the block) of the
+                            transactions
+        """
+        entries = self.__history.get(address)
+        if not entries:
+            return []
+        stop = len(entries) - max(offset, 0)
+        start = 0 if limit is None else max(stop - max(limit, 0), 0)
+        mask = (1 << POSITION_BITS) - 1
+        return [(entry >> POSITION_BITS, entry & mask)
+                for entry in reversed(entries[start:max(stop, 0)])]
+
+    def prune_history(self, height):
+        """
+        Drops the history entries of the blocks below the given height,
+        whose transactions were pruned from the chain
+        """
+        first_kept = height << POSITION_BITS
+        for address in list(self.__history):
+            entries = self.__history[address]
+            if entries[0] >= first_kept:
+                continue
+            del entries[:bisect.bisect_left(entries, first_kept)]
+            if not entries:
+                del self.__history[address]
+
+    def to_bytes(self):
+        """
+        Encodes the index as a count of addresses followed by every address
+        (as text, see utils.encoding), its confirmed totals and its history
+        entries as big-endian u64, then the unspent outputs
+        """
+        addresses = set(self.__received) | set(self.__sent) | set(
+            self.__history)
+        parts = [_U32.pack(len(addresses))]
+        for address in addresses:
+            entries = array('Q', self.__history.get(address, ()))
+            if sys.byteorder == 'little':
+                entries.byteswap()
+            parts.append(encode_text(address))
+            parts.append(
+                _ACCOUNT.pack(self.__received.get(address, 0.0),
+                              self.__sent.get(address, 0.0), len(entries)))
+            parts.append(entries.tobytes())
+        parts.append(self.utxos.to_bytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Builds an index from the encoding produced by to_bytes """
+        ledger = cls()
+        count, = _U32.unpack_from(data, 0)
+        decoder = Decoder(data, _U32.size)
+        for _ in range(count):
+            address = decoder.text()
+            received, sent, length = _ACCOUNT.unpack_from(data, decoder.offset)
+            start = decoder.offset + _ACCOUNT.size
+            decoder.offset = start + length * 8
+            if received:
+                ledger.__received[address] = received
+            if sent:
+                ledger.__sent[address] = sent
+            if length:
+                entries = ledger.__history[address]
+                entries.frombytes(data[start:decoder.offset])
+                if sys.byteorder == 'little':
+                    entries.byteswap()
+        ledger.utxos, _ = UtxoSet.from_bytes(data, decoder.offset)
+        return ledger
@@ -0,0 +1,201 @@
+import bisect
+import logging
+import itertools
+from collections import OrderedDict, defaultdict
+
+from utils.encoding import encode_transaction
+
+logger = logging.getLogger(__name__)
+
+# Largest number of open transactions kept
+MAX_MEMPOOL_SIZE = 50000
+
+
+class Mempool:
+    """
+    Open transactions indexed by id and by sender. Duplicates are rejected
+    in O(1) and the amount every sender has committed in open transactions
+    is kept as a running total, as are the outputs claimed by transactions
+    naming their inputs (see utxo), so double spends are found in O(1).
+    Transactions are ranked by priority, the amount sent (there is no fee)
+    and then arrival; once the pool is full a new transaction evicts the
+    lowest ranked one if it ranks higher.
+
+    The changes since the last save are kept, so only they are written
+    (see storage.BlockStore.append_mempool).
+    """
+    def __init__(self, max_size=MAX_MEMPOOL_SIZE):
+        self.max_size = max_size
+        # Transactions by id in arrival order
+        self.__transactions = OrderedDict()
+        # Open transactions of every sender by id, in arrival order
+        self.__by_sender = defaultdict(dict)
+        self.__pending_sent = defaultdict(float)
+        # Id of the open transaction spending every claimed output
+        self.__claimed = {}
+        # Sorted (-amount, arrival, id) of every transaction, best first
+        self.__ranking = []
+        self.__rank_keys = {}
+        # Encoded size of every transaction, for the block size limit
+        self.__sizes = {}
+        self.__arrivals = itertools.count()
+        # Transactions added and ids removed since the last save, and
+        # whether the pool was cleared since
+        self.__added = OrderedDict()
+        self.__removed = set()
+        self.__reset = False
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.__transactions
+
+    def __iter__(self):
+        return iter(list(self.__transactions.values()))
+
+    def get(self, tx_id):
+        return self.__transactions.get(tx_id)
+
+    def pending_sent(self, sender):
+        """ Returns the amount the sender has committed in open transactions """
+        return self.__pending_sent.get(sender, 0)
+
+    def claimed_outputs(self):
+        """ Returns a view of the outputs spent by open transactions """
+        return self.__claimed.keys()
+
+    def spends_inputs(self, sender):
+        """
+        Returns whether the open transactions of the sender name their
+        inputs, or None if the sender has no open transactions. A sender's
+        open transactions are all of one kind, as transactions spending from
+        the balance may spend any output once mined.
+        """
+        transactions = self.__by_sender.get(sender)
+        if not transactions:
+            return None
+        return bool(next(iter(transactions.values())).inputs)
+
+    def senders(self):
+        """ Returns the senders with open transactions """
+        return list(self.__by_sender)
+
+    def sender_transactions(self, sender):
+        """ Returns the open transactions of the sender in arrival order """
+        return list(self.__by_sender.get(sender, {}).values())
+
+    def add(self, transaction):
+        """
+        Adds a transaction, evicting the lowest ranked one if the pool is
+        full. Funds are not checked here.
+
+        Returns
+        -------
+            evicted (list): Transactions evicted to make room, or None if
+                            the transaction was rejected as a duplicate or
+                            as ranking below everything in a full pool
+        """
+        tx_id = transaction.id
+        if tx_id in self.__transactions:
+            logger.info('Rejecting duplicate transaction %s', tx_id)
+            return None
+        key = (-transaction.amount, next(self.__arrivals), tx_id)
+        evicted = []
+        if len(self.__transactions) >= self.max_size:
+            if not self.__ranking or key > self.__ranking[-1]:
+                logger.warning('Mempool is full, rejecting transaction %s',
+                               tx_id)
+                return None
+            evicted.append(self.remove(self.__ranking[-1][2]))
+            logger.info('Evicted transaction %s from the full mempool',
+                        evicted[-1].id)
+
+        self.__transactions[tx_id] = transaction
+        self.__by_sender[transaction.sender][tx_id] = transaction
+        self.__pending_sent[transaction.sender] += transaction.amount
+        for outpoint in transaction.inputs:
+            self.__claimed.setdefault(outpoint, tx_id)
+        bisect.insort(self.__ranking, key)
+        self.__rank_keys[tx_id] = key
+        self.__sizes[tx_id] = len(encode_transaction(transaction))
+        self.__added[tx_id] = transaction
+        return evicted
+
+    def remove(self, tx_id):
+        """ Removes an open transaction, returning it (or None) """
+        transaction = self.__transactions.pop(tx_id, None)
+        if transaction is None:
+            return None
+        sender = transaction.sender
+        del self.__by_sender[sender][tx_id]
+        if not self.__by_sender[sender]:
+            del self.__by_sender[sender]
+            del self.__pending_sent[sender]
+        else:
+            self.__pending_sent[sender] -= transaction.amount
+        for outpoint in transaction.inputs:
+            if self.__claimed.get(outpoint) == tx_id:
+                del self.__claimed[outpoint]
+        key = self.__rank_keys.pop(tx_id)
+        del self.__ranking[bisect.bisect_left(self.__ranking, key)]
+        del self.__sizes[tx_id]
+        if self.__added.pop(tx_id, None) is None:
+            self.__removed.add(tx_id)
+        return transaction
+
+    def remove_mined(self, transactions):
+        """
+        Removes the transactions of a mined block. Mined ids are rejected by
+        the chain, see utxo.
+        """
+        for tx in transactions:
+            self.remove(tx.id)
+
+    def select(self, max_count, max_bytes=None):
+        """
+        Returns the highest ranked transactions, best first, at most
+        max_count of them and at most max_bytes encoded. Transactions too
+        large for the bytes left are skipped for smaller ones.
+        """
+        if max_bytes is None:
+            return [
+                self.__transactions[tx_id]
+                for _, _, tx_id in self.__ranking[:max_count]
+            ]
+        selected = []
+        for _, _, tx_id in self.__ranking:
+            if len(selected) >= max_count or max_bytes <= 0:
+                break
+            size = self.__sizes[tx_id]
+            if size <= max_bytes:
+                selected.append(self.__transactions[tx_id])
+                max_bytes -= size
+        return selected
+
+    def changes(self):
+        """
+        Returns (reset, added, removed): whether the pool was cleared since
+        the last save (so everything must be saved), the transactions added
+        since and the ids of the saved transactions removed since
+        """
+        return (self.__reset, list(self.__added.values()),
+                list(self.__removed))
+
+    def saved(self):
+        """ Forgets the changes, once they were saved """
+        self.__added.clear()
+        self.__removed.clear()
+        self.__reset = False
+
+    def clear(self):
+        self.__added.clear()
+        self.__removed.clear()
+        self.__reset = True
+        self.__transactions.clear()
+        self.__by_sender.clear()
+        self.__pending_sent.clear()
+        self.__claimed.clear()
+        self.__ranking = []
+        self.__rank_keys.clear()
+        self.__sizes.clear()
@@ -0,0 +1,274 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+
+from utils import metrics
+from utils.encoding import BLOCK_VERSION_BINARY, encode_header_prefix
+from utils.verification import Verification, DEFAULT_DIFFICULTY
+
+logger = logging.getLogger(__name__)
+
+NONCES_TRIED = metrics.Counter('miner_nonces',
+                               'Nonces hashed by proof of work searches')
+HASH_RATE = metrics.Gauge(
+    'miner_hash_rate', 'Hashes per second of the last proof of work search')
+SEARCH_SECONDS = metrics.Histogram('miner_search_seconds',
+                                   'Duration of proof of work searches')
+
+# Set in the pool workers once any worker has found a valid proof
+_found = None
+
+
+def _init_worker(found):
+    global _found
+    _found = found
+
+
+def search_nonces(prefix, target, start, stop, check_every=4096):
+    """
+    Searches the nonces in [start, stop) for the first one whose digest is
+    below the target. The prefix is hashed once and the hash state is
+    copied for every nonce.
+
+    Returns
+    -------
+        (proof, tried): The valid proof (or None) and the number of nonces
+                        that were hashed
+    """
+    base = hashlib.sha256(prefix)
+    for nonce in range(start, stop):
+        guess = base.copy()
+        guess.update(str(nonce).encode())
+        if guess.digest() < target:
+            return nonce, nonce - start + 1
+        if (_found is not None and (nonce - start) % check_every == 0
+                and _found.is_set()):
+            return None, nonce - start + 1
+    return None, stop - start
+
+
+class ProofOfWorkMiner:
+    """
+    Proof of work engine. Small searches run in the calling process; once
+    the first chunk of nonces is exhausted the nonce space is split into
+    chunks across a process pool. The lowest valid nonce is returned, so the
+    result is the same proof the serial search would find. Threads share
+    the pool one round at a time, as its workers share the found flag.
+    """
+    def __init__(self, processes=None, chunk_size=65536):
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.hash_rate = 0.0
+        self.nonces_tried = 0
+        self.__pool = None
+        self.__found = None
+        self.__pool_lock = threading.Lock()
+
+    def __get_pool(self):
+        if self.__pool is None:
+            self.__found = multiprocessing.Event()
+            self.__pool = multiprocessing.Pool(self.processes,
+                                               initializer=_init_worker,
+                                               initargs=(self.__found, ))
+        return self.__pool
+
+    def close(self):
+        """ Shuts down the worker processes """
+        with self.__pool_lock:
+            if self.__pool is not None:
+                self.__pool.terminate()
+                self.__pool.join()
+                self.__pool = None
+
+    def mine(self,
+             transactions,
+             previous_hash,
+             difficulty=DEFAULT_DIFFICULTY,
+             version=BLOCK_VERSION_BINARY,
+             should_stop=None):
+        """
+        Finds the proof of work of a block older than BLOCK_VERSION_MERKLE
+        for the given transactions on top of the block with the given hash
+        at the given difficulty. should_stop is polled between chunks of
+        nonces to abandon the search.
+
+        Returns
+        -------
+            proof (integer): Lowest proof which satisfies the condition, or
+                             None if the search was stopped
+        """
+        return self.__search(
+            Verification.proof_prefix(transactions, previous_hash, version),
+            difficulty, should_stop)
+
+    def mine_header(self, header, difficulty=None, should_stop=None):
+        """
+        Finds the proof of work of a BLOCK_VERSION_MERKLE block: the proof
+        which makes the hash of its header satisfy the difficulty (by
+        default the difficulty recorded in the header). The proof of the
+        given header is ignored.
+
+        Returns
+        -------
+            proof (integer): Lowest proof which satisfies the condition, or
+                             None if the search was stopped
+        """
+        if difficulty is None:
+            difficulty = Verification.block_difficulty(header)
+        return self.__search(encode_header_prefix(header), difficulty,
+                             should_stop)
+
+    def __search(self, prefix, difficulty, should_stop):
+        start_time = time.perf_counter()
+        target = Verification.target(difficulty)
+
+        proof, tried = search_nonces(prefix, target, 0, self.chunk_size)
+        start = self.chunk_size
+        while proof is None and not (should_stop and should_stop()):
+            if self.processes > 1:
+                proof, round_tried = self.__search_round(prefix, target, start)
+                start += self.chunk_size * self.processes * 2
+            else:
+                proof, round_tried = search_nonces(prefix, target, start,
+                                                   start + self.chunk_size)
+                start += self.chunk_size
+            tried += round_tried
+
+        elapsed = time.perf_counter() - start_time
+        self.nonces_tried = tried
+        self.hash_rate = tried / elapsed if elapsed > 0 else 0.0
+        NONCES_TRIED.inc(tried)
+        HASH_RATE.set(self.hash_rate)
+        SEARCH_SECONDS.observe(elapsed)
+        logger.info(f'Searched {tried} nonces, proof {proof} '
+                    f'({self.hash_rate:.0f} hashes/sec)')
+        return proof
+
+    def __search_round(self, prefix, target, start):
+        with self.__pool_lock:
+            return self.__search_pool(prefix, target, start)
+
+    def __search_pool(self, prefix, target, start):
+        pool = self.__get_pool()
+        self.__found.clear()
+        chunks = [(prefix, target, chunk_start,
+                   chunk_start + self.chunk_size)
+                  for chunk_start in range(
+                      start, start + self.chunk_size * self.processes * 2,
+                      self.chunk_size)]
+        proof = None
+        tried = 0
+        # Results come back in nonce order, so the first hit is the lowest
+        for chunk_proof, chunk_tried in pool.imap(_search_chunk, chunks):
+            tried += chunk_tried
+            if proof is None and chunk_proof is not None:
+                proof = chunk_proof
+                # Remaining chunks stop early once they see the flag
+                self.__found.set()
+        return proof, tried
+
+
+def _search_chunk(args):
+    return search_nonces(*args)
+
+
+class MiningJob:
+    """
+    Mines one or more consecutive blocks on a background thread. Whenever
+    the open transactions change while the proof is being searched, the
+    search is restarted against the new set of transactions. Blocks added
+    to the chain by anyone else change the open transactions too, so a job
+    never commits a block on a stale tip. With until_empty the job stops
+    early once no open transactions are left, so a backlog is drained
+    block by block.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, block_chain, blocks=1, until_empty=False):
+        self.job_id = uuid.uuid4().hex
+        self.block_chain = block_chain
+        self.blocks = blocks
+        self.until_empty = until_empty
+        self.status = self.PENDING
+        # Last mined block and every block mined so far
+        self.block = None
+        self.mined = []
+        self.restarts = 0
+        self.started_at = None
+        self.finished_at = None
+        self.__cancelled = threading.Event()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name=f'mining-job-{self.job_id}',
+                                         daemon=True)
+
+    def start(self):
+        self.started_at = time.time()
+        self.status = self.RUNNING
+        self.__thread.start()
+        return self
+
+    def cancel(self):
+        """ Asks the job to stop; it stops at the next batch of nonces """
+        self.__cancelled.set()
+
+    def join(self, timeout=None):
+        self.__thread.join(timeout)
+
+    def is_active(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def __run(self):
+        try:
+            while not self.__cancelled.is_set():
+                mempool_version = self.block_chain.get_mempool_version()
+
+                def should_stop():
+                    return (self.__cancelled.is_set()
+                            or self.block_chain.get_mempool_version() !=
+                            mempool_version)
+
+                block = self.block_chain.mine_block(should_stop)
+                if block is not None:
+                    self.block = block
+                    self.mined.append(block)
+                    if self.__finished():
+                        self.status = self.DONE
+                        return
+                    continue
+                if not should_stop():
+                    self.status = self.FAILED
+                    return
+                if not self.__cancelled.is_set():
+                    logger.info(f'Open transactions changed, restarting '
+                                f'mining job {self.job_id}')
+                    self.restarts += 1
+            self.status = self.CANCELLED
+        except Exception:
+            logger.exception(f'Mining job {self.job_id} failed')
+            self.status = self.FAILED
+        finally:
+            self.finished_at = time.time()
+
+    def __finished(self):
+        return (len(self.mined) >= self.blocks
+                or self.until_empty
+                and not self.block_chain.get_open_transactions())
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'blocks': self.blocks,
+            'mined': [block.hash for block in self.mined],
+            'restarts': self.restarts,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
@@ -0,0 +1,271 @@
+import os
+import json
+import struct
+import logging
+import threading
+import urllib.error
+import urllib.request
+
+from block import Block, BlockHeader
+from broadcaster import BLOCK, TRANSACTION, Broadcaster
+from storage import ExtendedChain
+from utils.encoding import iter_chain
+from utils.verification import Verification
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a peer to answer
+PEER_TIMEOUT = 5
+# Largest number of headers requested at once while looking for the last
+# block shared with a peer
+HEADER_BATCH = 512
+# Number of blocks requested at once while downloading a fork
+BLOCK_BATCH = 500
+BINARY_MIMETYPE = 'application/octet-stream'
+
+
+class PeerError(Exception):
+    """ Raised when a peer can't be reached or sends an unusable answer """
+
+
+class PeerNetwork:
+    """
+    Peer nodes (as host:port) this node talks to. New transactions and
+    blocks are broadcast to every peer in the background by a Broadcaster.
+    Syncing with a peer compares block
+    headers to find the last block both chains share, verifies the peer's
+    headers after it and only then downloads the blocks.
+    """
+    def __init__(self,
+                 path=None,
+                 address=None,
+                 timeout=PEER_TIMEOUT,
+                 broadcaster=None):
+        # File the peers are saved to, None keeps them in memory only
+        self.path = path
+        # Address of this node, sent along with broadcast blocks
+        self.address = address
+        self.timeout = timeout
+        self.broadcaster = (broadcaster if broadcaster is not None else
+                            Broadcaster(timeout=timeout))
+        self.__peers = set()
+        self.__lock = threading.Lock()
+        self.load_peers()
+
+    def load_peers(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.__peers = set(json.loads(f.read()))
+        except (IOError, ValueError):
+            self.__peers = set()
+
+    def save_peers(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(sorted(self.__peers)))
+        os.replace(tmp_path, self.path)
+
+    def add_peer(self, node):
+        """ Adds a peer node, e.g. 'localhost:5001' """
+        with self.__lock:
+            self.__peers.add(node)
+            self.save_peers()
+
+    def remove_peer(self, node):
+        with self.__lock:
+            self.__peers.discard(node)
+            self.save_peers()
+        self.broadcaster.remove_peer(node)
+
+    def get_peers(self):
+        with self.__lock:
+            return sorted(self.__peers)
+
+    def request(self, peer, path, data=None, accept='application/json'):
+        """
+        Sends a GET request to the peer, or a POST request with data as the
+        JSON body
+
+        Returns
+        -------
+            (status, body): HTTP status and body of the answer
+        """
+        headers = {'Accept': accept}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(f'http://{peer}{path}', body, headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+        except (urllib.error.URLError, OSError) as error:
+            raise PeerError(f'Peer {peer} is unreachable: {error}')
+
+    def get_json(self, peer, path):
+        status, body = self.request(peer, path)
+        if status != 200:
+            raise PeerError(f'Peer {peer} answered {path} with {status}')
+        try:
+            return json.loads(body.decode('utf8'))
+        except ValueError:
+            raise PeerError(f'Peer {peer} sent invalid JSON for {path}')
+
+    def broadcast_transaction(self, transaction):
+        """ Queues a new transaction for every peer """
+        self.broadcaster.send(self.get_peers(), TRANSACTION,
+                              transaction.to_dict())
+
+    def broadcast_block(self, block):
+        """ Queues a new block for every peer """
+        self.broadcaster.send(self.get_peers(), BLOCK, {
+            'block': block.to_dict(),
+            'node': self.address
+        })
+
+    def fetch_tip(self, peer):
+        """ Returns the chain length and tip hash of the peer """
+        tip = self.get_json(peer, '/tip')
+        try:
+            return int(tip['length']), tip['hash']
+        except (KeyError, TypeError, ValueError):
+            raise PeerError(f'Peer {peer} sent an invalid tip')
+
+    def fetch_headers(self, peer, start, stop):
+        """ Returns the headers of the peer's blocks in [start, stop) """
+        return self.get_json(peer,
+                             f'/headers?from_height={start}&limit={stop - start}')
+
+    def fetch_header_chain(self, peer, start, stop):
+        """ Downloads the headers of the peer's blocks in [start, stop) """
+        headers = []
+        while start < stop:
+            batch = self.fetch_headers(peer, start,
+                                       min(stop, start + HEADER_BATCH))
+            try:
+                batch = [BlockHeader.from_dict(header) for header in batch]
+            except (KeyError, TypeError, ValueError) as error:
+                raise PeerError(f'Peer {peer} sent invalid headers: {error}')
+            if not batch:
+                raise PeerError(f'Peer {peer} has no headers from {start}')
+            for height, header in enumerate(batch, start):
+                if header.index != height:
+                    raise PeerError(f'Peer {peer} sent headers out of order')
+            headers.extend(batch)
+            start += len(batch)
+        return headers
+
+    def fetch_blocks(self, peer, start, stop):
+        """ Downloads the peer's blocks in [start, stop) in batches """
+        blocks = []
+        while start < stop:
+            limit = min(BLOCK_BATCH, stop - start)
+            status, body = self.request(
+                peer, f'/chain?from_height={start}&limit={limit}',
+                accept=BINARY_MIMETYPE)
+            if status != 200:
+                raise PeerError(f'Peer {peer} answered /chain with {status}')
+            try:
+                batch = [Block.from_bytes(record) for record in iter_chain(body)]
+            except (ValueError, IndexError, struct.error) as error:
+                raise PeerError(f'Peer {peer} sent invalid blocks: {error}')
+            if not batch:
+                raise PeerError(f'Peer {peer} has no blocks from {start}')
+            blocks.extend(batch)
+            start += len(batch)
+        return blocks
+
+    def find_fork(self, block_chain, peer, top):
+        """
+        Returns the height of the last block at or below top that the chain
+        shares with the peer, or None if the chains don't even share the
+        genesis block. Headers are compared in windows that double in size,
+        so peers on the same chain need a single small request.
+        """
+        size = 1
+        while top >= 0:
+            start = max(0, top - size + 1)
+            headers = self.fetch_headers(peer, start, top + 1)
+            try:
+                hashes = [(int(header['index']), header['hash'])
+                          for header in headers]
+            except (KeyError, TypeError, ValueError):
+                raise PeerError(f'Peer {peer} sent invalid headers')
+            for height, block_hash in reversed(hashes):
+                block = block_chain.get_block(height)
+                if block is not None and block.hash == block_hash:
+                    return height
+            top = start - 1
+            size = min(size * 2, HEADER_BATCH)
+        return None
+
+    def sync(self, block_chain, peer):
+        """
+        Switches the chain to the peer's chain if it is longer and valid.
+        Only the blocks after the last shared block are downloaded and
+        verified.
+
+        Returns
+        -------
+            True (Boolean): If the chain was replaced
+            False (Boolean): If the local chain was kept
+        """
+        length, _ = self.fetch_tip(peer)
+        local_length = block_chain.chain_length()
+        if length <= local_length:
+            return False
+        fork_height = self.find_fork(block_chain, peer,
+                                     min(local_length, length) - 1)
+        if fork_height is None:
+            logger.warning('Peer %s has a different genesis block', peer)
+            return False
+        # Headers are checked first, so a fork with invalid proofs of work
+        # is turned down without downloading its transactions
+        headers = self.fetch_header_chain(peer, fork_height + 1, length)
+        chain = block_chain.get_chain()
+        if len(chain) <= fork_height or not Verification.verify_headers(
+                ExtendedChain(chain, fork_height + 1, headers),
+                fork_height + 1):
+            logger.warning('Peer %s sent an invalid chain of headers', peer)
+            return False
+        logger.info('Syncing blocks %d to %d from %s', fork_height + 1,
+                    length - 1, peer)
+        blocks = self.fetch_blocks(peer, fork_height + 1, length)
+        if [block.hash for block in blocks] != [
+                header.hash for header in headers[:len(blocks)]]:
+            raise PeerError(f'Peer {peer} sent blocks not matching its '
+                            'headers')
+        return block_chain.replace_chain(fork_height, blocks)
+
+    def start_sync(self, block_chain, peer):
+        """ Syncs with the peer on a background thread """
+        def run():
+            try:
+                self.sync(block_chain, peer)
+            except PeerError as error:
+                logger.warning('Syncing with %s failed: %s', peer, error)
+
+        threading.Thread(target=run, name=f'sync-{peer}', daemon=True).start()
+
+    def resolve_conflicts(self, block_chain):
+        """
+        Syncs with every peer, so the chain ends up as the longest valid
+        chain among them
+
+        Returns
+        -------
+            True (Boolean): If the chain was replaced
+        """
+        replaced = False
+        for peer in self.get_peers():
+            try:
+                replaced = self.sync(block_chain, peer) or replaced
+            except PeerError as error:
+                logger.warning('Syncing with %s failed: %s', peer, error)
+        return replaced
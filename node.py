@@ -1,14 +1,54 @@
-# import os
 # import logging
-from flask import Flask, jsonify, request
+import os
+import json
+import time
+import threading
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 
-from wallet import Wallet
-from blockchain import BlockChain
+from block import Block, BlockHeader
+from transaction import (Transaction, new_nonce, parse_outpoint,
+                         valid_amount)
+from wallet import SCHEMES, Wallet
+from blockchain import (MAX_BLOCK_BYTES, MAX_BLOCK_TRANSACTIONS,
+                        MIN_PRUNE_BLOCKS, BlockChain)
+from miner import MiningJob
+from network import PeerNetwork
+from storage import BlockPrunedError, BlockStore
+from utils import metrics
+from utils.encoding import SCHEME_RSA, encode_chain
+
+BINARY_MIMETYPE = 'application/octet-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Number of finished mining jobs kept for status requests
+MAX_MINING_JOBS = 100
+# Most blocks mined by one /mine request
+MAX_MINE_BLOCKS = 100
+# Transactions returned per page of address history by default
+HISTORY_PAGE_SIZE = 50
+# Port of the node which keeps the original wallet and data file names
+DEFAULT_PORT = 5000
+
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    'http_request_seconds', 'Latency of HTTP requests by route',
+    ['method', 'route', 'status'])
+CHAIN_LENGTH = metrics.Gauge('chain_length', 'Number of blocks in the chain')
+OPEN_TRANSACTIONS = metrics.Gauge('open_transactions',
+                                  'Number of open transactions')
 
 app = Flask(__name__)
-wallet = Wallet()
-block_chain = BlockChain(wallet.public_key)
+wallet = None
+block_chain = None
+# Peer nodes of this node
+network = None
+# Background mining jobs by id, oldest first
+mining_jobs = OrderedDict()
+# Guards mining_jobs, so that two requests can't both find no active job
+# and start one each
+mining_jobs_lock = threading.RLock()
 CORS(app)  # Open the App to clients running outside the server
 
 # log_folder = os.path.join(os.getcwd(), 'logs')
@@ -22,15 +62,74 @@ CORS(app)  # Open the App to clients running outside the server
 #     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
+@app.before_request
+def start_request_timer():
+    if metrics.enabled():
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    # Streamed responses are timed until their first byte
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = (request.url_rule.rule
+                 if request.url_rule is not None else 'unmatched')
+        HTTP_REQUEST_SECONDS.labels(request.method, route,
+                                    response.status_code).observe(
+                                        time.perf_counter() - start)
+    return response
+
+
+def create_node(port=DEFAULT_PORT,
+                max_block_transactions=MAX_BLOCK_TRANSACTIONS,
+                max_block_bytes=MAX_BLOCK_BYTES,
+                prune=None):
+    """
+    Sets up the wallet, block chain and peers of the node listening on the
+    given port. Every node keeps its own wallet file and data directory so
+    several nodes can run side by side. With prune, only the transactions
+    of the last prune blocks are kept.
+    """
+    global wallet, block_chain, network
+    node_id = None if port == DEFAULT_PORT else port
+    data_dir = ('blockchain_data'
+                if node_id is None else f'blockchain_data-{node_id}')
+    wallet = Wallet(node_id)
+    store = BlockStore(data_dir)
+    network = PeerNetwork(os.path.join(data_dir, 'peers.json'),
+                          f'localhost:{port}')
+    block_chain = BlockChain(wallet.public_key,
+                             store,
+                             network,
+                             max_block_transactions=max_block_transactions,
+                             max_block_bytes=max_block_bytes,
+                             prune=prune)
+
+
 @app.route('/wallet', methods=['POST'])
 def create_keys():
-    global block_chain
+    """
+    Creates new keys for the node's wallet, of the signature scheme given
+    as {'scheme': ...} (RSA by default)
+    """
+    values = json_body() if request.get_data() else {}
+    if values is None:
+        response = {'message': 'Invalid data.'}
+        return jsonify(response), 400
+    scheme = values.get('scheme', SCHEME_RSA)
+    if not isinstance(scheme, str) or scheme not in SCHEMES:
+        response = {'message': f'Unknown signature scheme {scheme}'}
+        return jsonify(response), 400
+    wallet.scheme = scheme
     wallet.create_keys()
     if wallet.save_keys():
-        block_chain = BlockChain(wallet.public_key)
+        cancel_mining_jobs()
+        block_chain.set_hosting_node(wallet.public_key)
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
+            'scheme': wallet.scheme,
             'funds': block_chain.get_balances()
         }
         return jsonify(response), 201
@@ -41,12 +140,13 @@ def create_keys():
 
 @app.route('/wallet', methods=['GET'])
 def load_keys():
-    global block_chain
     if wallet.load_keys():
-        block_chain = BlockChain(wallet.public_key)
+        cancel_mining_jobs()
+        block_chain.set_hosting_node(wallet.public_key)
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
+            'scheme': wallet.scheme,
             'funds': block_chain.get_balances()
         }
         return jsonify(response), 201
@@ -55,6 +155,14 @@ def load_keys():
         return jsonify(response), 500
 
 
+def cancel_mining_jobs():
+    """ Stops mining for the wallet that is about to be replaced """
+    job = active_mining_job()
+    if job is not None:
+        job.cancel()
+        job.join()
+
+
 @app.route('/balance', methods=['GET'])
 def get_balance():
     balance = block_chain.get_balances()
@@ -71,13 +179,51 @@ def get_balance():
     return jsonify(response), 500
 
 
+@app.route('/history/<address>', methods=['GET'])
+def get_history(address):
+    """
+    Returns the mined transactions the address sent or received, newest
+    first, HISTORY_PAGE_SIZE at a time unless a limit is given
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 0)
+    # Mined transactions only change with the tip
+    etag = (f'{block_chain.get_last_blockchain_value().hash}-'
+            f'{offset}-{limit}')
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    total, history = block_chain.get_history(address, offset, limit)
+    response = jsonify({
+        'address': address,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'history': history
+    })
+    response.set_etag(etag)
+    return response, 200
+
+
+@app.route('/utxos/<address>', methods=['GET'])
+def get_unspent_outputs(address):
+    """ Returns the unspent outputs of the address, oldest first """
+    outputs = block_chain.get_unspent_outputs(address)
+    response = {
+        'address': address,
+        'total': sum(output['amount'] for output in outputs),
+        'outputs': outputs
+    }
+    return jsonify(response), 200
+
+
 @app.route('/transaction', methods=['POST'])
 def add_transaction():
     if wallet.public_key is None:
         response = {'message': 'No wallet setup'}
         return jsonify(response), 400
 
-    user_input = request.get_json()
+    user_input = json_body()
     if not user_input:
         response = {'message': 'No data received'}
         return jsonify(response), 400
@@ -89,16 +235,36 @@ def add_transaction():
 
     recipient = user_input['recipient']
     amount = user_input['amount']
-    signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
-    if block_chain.add_transaction(recipient, wallet.public_key, signature,
-                                   amount):
+    if not isinstance(recipient, str):
+        response = {'message': 'Invalid recipient.'}
+        return jsonify(response), 400
+    if not valid_amount(amount):
+        response = {'message': 'Invalid amount.'}
+        return jsonify(response), 400
+    inputs = wallet_inputs(user_input.get('inputs', ()), amount)
+    if inputs is None:
+        response = {'message': 'Invalid inputs.'}
+        return jsonify(response), 400
+    nonce = new_nonce()
+    signature = wallet.sign_transaction(wallet.public_key, recipient, amount,
+                                        inputs, nonce)
+    if block_chain.add_transaction(recipient,
+                                   wallet.public_key,
+                                   signature,
+                                   amount,
+                                   scheme=wallet.scheme,
+                                   inputs=inputs,
+                                   nonce=nonce):
         response = {
             'message': 'Successfully added transaction',
             'transaction': {
                 'sender': wallet.public_key,
                 'recipient': recipient,
                 'amount': amount,
-                'signature': signature
+                'signature': signature,
+                'scheme': wallet.scheme,
+                'inputs': [list(outpoint) for outpoint in inputs],
+                'nonce': nonce
             },
             'funds': block_chain.get_balances()
         }
@@ -108,19 +274,157 @@ def add_transaction():
         return jsonify(response), 500
 
 
+def wallet_inputs(inputs, amount):
+    """
+    Returns the outputs a transaction of the node's wallet spends: the
+    [transaction id, output index] pairs given, or the oldest unspent
+    outputs covering the amount for 'auto'. None if they are invalid.
+    """
+    if inputs == 'auto':
+        return block_chain.select_inputs(wallet.public_key, amount)
+    try:
+        return [parse_outpoint(outpoint) for outpoint in inputs]
+    except (TypeError, ValueError):
+        return None
+
+
+def batch_transaction(item):
+    """
+    Returns (transaction, None) for an item of a /transactions batch, or
+    (None, the reason the item is rejected)
+    """
+    if not isinstance(item, dict) or not all(
+            field in item for field in ['recipient', 'amount']):
+        return None, 'Required data is missing.'
+    if not isinstance(item['recipient'], str):
+        return None, 'Invalid recipient.'
+    if not valid_amount(item['amount']):
+        return None, 'Invalid amount.'
+    if 'signature' in item:
+        if 'sender' not in item:
+            return None, 'Required data is missing.'
+        try:
+            return Transaction.from_dict(item), None
+        except (TypeError, ValueError):
+            return None, 'Invalid transaction data.'
+    if wallet.public_key is None:
+        return None, 'No wallet setup'
+    inputs = wallet_inputs(item.get('inputs', ()), item['amount'])
+    if inputs is None:
+        return None, 'Invalid inputs.'
+    nonce = new_nonce()
+    signature = wallet.sign_transaction(wallet.public_key, item['recipient'],
+                                        item['amount'], inputs, nonce)
+    return Transaction(wallet.public_key, item['recipient'], signature,
+                       item['amount'], wallet.scheme, inputs, nonce), None
+
+
+@app.route('/transactions', methods=['POST'])
+def add_transactions():
+    """
+    Adds a batch of transactions, given as {'transactions': [...]}. Items
+    with a sender and signature are added as they are, items with only a
+    recipient and amount (and optionally inputs) are sent and signed by the
+    node's wallet. The response reports for every item whether it was
+    accepted.
+    """
+    user_input = json_body()
+    if not user_input or not isinstance(user_input.get('transactions'),
+                                        list):
+        response = {'message': 'No data received'}
+        return jsonify(response), 400
+
+    items = user_input['transactions']
+    results = [None] * len(items)
+    transactions = []
+    positions = []
+    for position, item in enumerate(items):
+        transaction, error = batch_transaction(item)
+        if error is None:
+            transactions.append(transaction)
+            positions.append(position)
+        else:
+            results[position] = {'accepted': False, 'message': error}
+
+    errors = block_chain.add_transactions(transactions)
+    for position, transaction, error in zip(positions, transactions, errors):
+        if error is None:
+            results[position] = {
+                'accepted': True,
+                'transaction': transaction.to_dict()
+            }
+        else:
+            results[position] = {'accepted': False, 'message': error}
+
+    accepted = sum(result['accepted'] for result in results)
+    response = {
+        'message': f'Added {accepted} of {len(results)} transactions',
+        'results': results,
+        'funds': block_chain.get_balances()
+    }
+    return jsonify(response), 201 if accepted else 200
+
+
 @app.route('/mine', methods=['POST'])
 def mine():
+    """
+    Starts a background job mining a block and returns it with status 202.
+    With wait=true the block is mined before responding instead. blocks=N
+    mines N consecutive blocks, blocks=all mines until no open transactions
+    are left (at most MAX_MINE_BLOCKS blocks).
+    """
+    blocks = request.args.get('blocks', '1')
+    until_empty = blocks == 'all'
+    if until_empty:
+        blocks = MAX_MINE_BLOCKS
+    else:
+        blocks = int(blocks) if blocks.isdigit() else 0
+    if not 1 <= blocks <= MAX_MINE_BLOCKS:
+        response = {
+            'message': f'blocks must be from 1 to {MAX_MINE_BLOCKS} or all'
+        }
+        return jsonify(response), 400
+
+    if request.args.get('wait') == 'true':
+        return mine_now(blocks, until_empty)
+
+    if wallet.public_key is None:
+        response = {
+            'message': 'Mining a block failed.',
+            'wallet_setup': False
+        }
+        return jsonify(response), 500
+
+    # Only one block is mined at a time; a second request joins the
+    # running job
+    with mining_jobs_lock:
+        job = active_mining_job()
+        if job is None:
+            job = MiningJob(block_chain, blocks, until_empty).start()
+            mining_jobs[job.job_id] = job
+            if len(mining_jobs) > MAX_MINING_JOBS:
+                mining_jobs.popitem(last=False)
+    response = mining_job_response(job)
+    response['message'] = 'Mining job started'
+    return jsonify(response), 202, {'Location': f'/mine/{job.job_id}'}
+
+
+def mine_now(blocks=1, until_empty=False):
     # logging.info('Mining a new block')
-    block = block_chain.mine_block()
+    mined = []
+    while len(mined) < blocks:
+        block = block_chain.mine_block()
+        if block is None:
+            break
+        mined.append(block)
+        if until_empty and not block_chain.get_open_transactions():
+            break
 
-    if block is not None:
-        block_copy = block.__dict__.copy()
-        block_copy['transactions'] = [
-            tx.__dict__ for tx in block_copy['transactions']
-        ]
+    if mined:
         response = {
             'message': 'Block added successfully',
-            'block': block_copy,
+            'block': presentable_block(mined[-1]),
+            'mined': [block.hash for block in mined],
             'funds': block_chain.get_balances()
         }
         return jsonify(response), 201
@@ -133,22 +437,401 @@ def mine():
         return jsonify(response), 500
 
 
+@app.route('/mine/<job_id>', methods=['GET'])
+def get_mining_job(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        response = {'message': 'Mining job not found.'}
+        return jsonify(response), 404
+    return jsonify(mining_job_response(job)), 200
+
+
+@app.route('/mine/<job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        response = {'message': 'Mining job not found.'}
+        return jsonify(response), 404
+    job.cancel()
+    response = mining_job_response(job)
+    response['message'] = 'Cancelling mining job'
+    return jsonify(response), 202
+
+
+def active_mining_job():
+    with mining_jobs_lock:
+        for job in mining_jobs.values():
+            if job.is_active():
+                return job
+    return None
+
+
+def mining_job_response(job):
+    response = {'job': job.to_dict()}
+    if job.block is not None:
+        response['block'] = presentable_block(job.block)
+        response['funds'] = job.block_chain.get_balances()
+    return response
+
+
 @app.route('/transactions', methods=['GET'])
 def get_open_transactions():
-    transactions = block_chain.get_open_transactions()
-    tx_display = [tx.__dict__ for tx in transactions]
-    return jsonify(tx_display), 200
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    stop = None if limit is None else offset + max(limit, 0)
+    # The ids of the open transactions identify the response across restarts
+    etag = f'{block_chain.get_mempool_digest()}-{offset}-{stop}'
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    transactions = block_chain.get_open_transactions()[offset:stop]
+    tx_display = [tx.to_dict() for tx in transactions]
+    response = jsonify(tx_display)
+    response.set_etag(etag)
+    return response, 200
+
+
+def presentable_block(block):
+    """
+    Returns the block as a dict including its hash. Blocks pruned by the
+    node are presented as their header.
+    """
+    block_dict = block.to_dict()
+    block_dict['hash'] = block.hash
+    if isinstance(block, BlockHeader):
+        block_dict['pruned'] = True
+    return block_dict
+
+
+def json_body():
+    """ Returns the JSON object sent with the request, or None """
+    values = request.get_json(silent=True)
+    return values if isinstance(values, dict) else None
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_snapshot = block_chain.get_chain()
-    presentable_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for block in presentable_chain:
-        block['transactions'] = [tx.__dict__ for tx in block['transactions']]
-    # logging.info('Displaying the blockchain blocks')
-    return jsonify(presentable_chain), 200
+    """
+    Returns the blocks with heights in [from_height, from_height + limit)
+    (the whole chain by default) as JSON, as newline delimited JSON streamed
+    block by block (format=ndjson or Accept: application/x-ndjson) or in the
+    binary canonical encoding (Accept: application/octet-stream)
+    """
+    from_height = max(request.args.get('from_height', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    length = block_chain.chain_length()
+    stop = length if limit is None else min(length,
+                                            from_height + max(limit, 0))
+    if request.args.get('format') == 'ndjson':
+        mimetype = NDJSON_MIMETYPE
+    else:
+        mimetype = request.accept_mimetypes.best_match(
+            ['application/json', NDJSON_MIMETYPE, BINARY_MIMETYPE],
+            default='application/json')
+
+    # Blocks never change once added, so the tip identifies the response
+    etag = (f'{block_chain.get_block(length - 1).hash}-'
+            f'{from_height}-{stop}-{mimetype}')
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    if (mimetype == BINARY_MIMETYPE
+            and from_height < block_chain.pruned_height()):
+        response = {
+            'message': 'The blocks were pruned.',
+            'pruned_height': block_chain.pruned_height()
+        }
+        return jsonify(response), 410
+    if mimetype == BINARY_MIMETYPE:
+        # Peers ask for the binary canonical encoding instead of JSON
+        response = Response(encode_chain(
+            block_chain.get_blocks(from_height, stop)),
+                            mimetype=BINARY_MIMETYPE)
+    elif mimetype == NDJSON_MIMETYPE:
+        blocks = block_chain.iter_blocks(from_height, stop)
+        response = Response(
+            (json.dumps(presentable_block(block)) + '\n' for block in blocks),
+            mimetype=NDJSON_MIMETYPE)
+    else:
+        # logging.info('Displaying the blockchain blocks')
+        response = jsonify([
+            presentable_block(block)
+            for block in block_chain.iter_blocks(from_height, stop)
+        ])
+    response.set_etag(etag)
+    return response, 200
+
+
+@app.route('/tip', methods=['GET'])
+def get_tip():
+    chain = block_chain.get_chain()
+    response = {'length': len(chain), 'hash': chain[-1].hash}
+    return jsonify(response), 200
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    """
+    Returns the headers of the blocks with heights in
+    [from_height, from_height + limit), so peers can find where their
+    chains fork before downloading blocks and light clients can verify
+    the chain without the transactions
+    """
+    from_height = max(request.args.get('from_height', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    stop = None if limit is None else from_height + max(limit, 0)
+    headers = [
+        header.to_dict()
+        for header in block_chain.iter_headers(from_height, stop)
+    ]
+    return jsonify(headers), 200
+
+
+@app.route('/block/<int:height>', methods=['GET'])
+def get_block_by_height(height):
+    return block_response(block_chain.get_block(height))
+
+
+@app.route('/block/<block_hash>', methods=['GET'])
+def get_block_by_hash(block_hash):
+    return block_response(block_chain.get_block_by_hash(block_hash))
+
+
+@app.route('/block/<int:height>/proof/<tx_id>', methods=['GET'])
+def get_transaction_proof_by_height(height, tx_id):
+    return transaction_proof_response(block_chain.get_block(height), tx_id)
+
+
+@app.route('/block/<block_hash>/proof/<tx_id>', methods=['GET'])
+def get_transaction_proof_by_hash(block_hash, tx_id):
+    return transaction_proof_response(
+        block_chain.get_block_by_hash(block_hash), tx_id)
+
+
+def transaction_proof_response(block, tx_id):
+    """
+    Returns the Merkle inclusion proof of the transaction in the block, which
+    a light client checks against the Merkle root of the block header
+    """
+    if block is None:
+        response = {'message': 'Block not found.'}
+        return jsonify(response), 404
+    proof = block_chain.get_transaction_proof(block, tx_id)
+    if proof is None:
+        response = {
+            'message': 'Transaction not found in the block, or the block '
+                       'predates Merkle roots.'
+        }
+        return jsonify(response), 404
+    return jsonify(proof), 200
+
+
+def block_response(block):
+    if block is None:
+        response = {'message': 'Block not found.'}
+        return jsonify(response), 404
+    # A block's hash identifies its content
+    if request.if_none_match.contains(block.hash):
+        return not_modified(block.hash)
+    response = jsonify(presentable_block(block))
+    response.set_etag(block.hash)
+    return response, 200
+
+
+@app.route('/broadcast-transaction', methods=['POST'])
+def broadcast_transaction():
+    """ Receives a transaction broadcast by a peer """
+    values = json_body()
+    if not values:
+        response = {'message': 'No data received'}
+        return jsonify(response), 400
+    required_fields = ['sender', 'recipient', 'amount', 'signature']
+    if not all(field in values for field in required_fields):
+        response = {'message': 'Required data is missing.'}
+        return jsonify(response), 400
+
+    try:
+        transaction = Transaction.from_dict(values)
+    except (TypeError, ValueError):
+        response = {'message': 'Invalid transaction data.'}
+        return jsonify(response), 400
+    if block_chain.add_transaction(transaction.recipient,
+                                   transaction.sender,
+                                   transaction.signature,
+                                   transaction.amount,
+                                   is_receiving=True,
+                                   scheme=transaction.scheme,
+                                   inputs=transaction.inputs,
+                                   nonce=transaction.nonce):
+        response = {
+            'message': 'Successfully added transaction',
+            'transaction': transaction.to_dict()
+        }
+        return jsonify(response), 201
+    response = {'message': 'Creating a transaction failed.'}
+    return jsonify(response), 409
+
+
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    """ Receives a batch of transactions broadcast by a peer """
+    values = json_body()
+    if not values or not isinstance(values.get('transactions'), list):
+        response = {'message': 'Required data is missing.'}
+        return jsonify(response), 400
+    required_fields = ['sender', 'recipient', 'amount', 'signature']
+    transactions = []
+    for tx in values['transactions']:
+        if isinstance(tx, dict) and all(field in tx
+                                        for field in required_fields):
+            try:
+                transactions.append(Transaction.from_dict(tx))
+            except (TypeError, ValueError):
+                pass
+    results = [
+        error is None for error in block_chain.add_transactions(
+            transactions, is_receiving=True)
+    ]
+    response = {
+        'message': f'Added {sum(results)} of {len(results)} transactions',
+        'results': results
+    }
+    return jsonify(response), 200
+
+
+@app.route('/broadcast-block', methods=['POST'])
+def broadcast_block():
+    """
+    Receives a block mined by a peer. A block on top of the chain is
+    added; a block further ahead means the peer's chain is longer, so the
+    missing blocks are synced from the peer in the background. Only known
+    peers are synced from, so callers can't point the node at any host.
+    """
+    values = json_body()
+    if not values or 'block' not in values:
+        response = {'message': 'Required data is missing.'}
+        return jsonify(response), 400
+    try:
+        block = Block.from_dict(values['block'])
+    except (KeyError, TypeError, ValueError):
+        response = {'message': 'Invalid block data.'}
+        return jsonify(response), 400
+
+    length = block_chain.chain_length()
+    if block.index == length:
+        if block_chain.add_block(block):
+            response = {'message': 'Block added'}
+            return jsonify(response), 201
+        response = {'message': 'Block seems invalid.'}
+        return jsonify(response), 409
+    if block.index > length:
+        peer = values.get('node')
+        if peer and peer not in network.get_peers():
+            response = {'message': 'Unknown peer node.'}
+            return jsonify(response), 400
+        if peer:
+            network.start_sync(block_chain, peer)
+        response = {
+            'message': 'Blockchain seems to differ from local blockchain.'
+        }
+        return jsonify(response), 202
+    response = {'message': 'Blockchain seems to be shorter, block not added'}
+    return jsonify(response), 409
+
+
+@app.route('/resolve-conflicts', methods=['POST'])
+def resolve_conflicts():
+    """ Switches to the longest valid chain among the peers """
+    replaced = network.resolve_conflicts(block_chain)
+    message = 'Chain was replaced!' if replaced else 'Local chain kept!'
+    response = {'message': message, 'length': block_chain.chain_length()}
+    return jsonify(response), 200
+
+
+@app.route('/node', methods=['POST'])
+def add_node():
+    values = json_body()
+    if not values:
+        response = {'message': 'No data attached.'}
+        return jsonify(response), 400
+    if 'node' not in values:
+        response = {'message': 'No node data found.'}
+        return jsonify(response), 400
+    if not isinstance(values['node'], str) or not values['node']:
+        response = {'message': 'Invalid node.'}
+        return jsonify(response), 400
+    network.add_peer(values['node'])
+    response = {
+        'message': 'Node added successfully.',
+        'all_nodes': network.get_peers()
+    }
+    return jsonify(response), 201
+
+
+@app.route('/node/<node_url>', methods=['DELETE'])
+def remove_node(node_url):
+    network.remove_peer(node_url)
+    response = {
+        'message': 'Node removed',
+        'all_nodes': network.get_peers()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/nodes', methods=['GET'])
+def get_nodes():
+    response = {'all_nodes': network.get_peers()}
+    return jsonify(response), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Exposes the metrics of the node in the Prometheus text format """
+    if not metrics.enabled():
+        response = {'message': 'Metrics are disabled'}
+        return jsonify(response), 404
+    CHAIN_LENGTH.set(block_chain.chain_length())
+    OPEN_TRANSACTIONS.set(len(block_chain.get_open_transactions()))
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--no-metrics',
+                        action='store_true',
+                        help='Record no metrics and disable /metrics')
+    parser.add_argument('--max-block-transactions',
+                        type=int,
+                        default=MAX_BLOCK_TRANSACTIONS,
+                        help='Most open transactions mined into one block')
+    parser.add_argument('--max-block-bytes',
+                        type=int,
+                        default=MAX_BLOCK_BYTES,
+                        help='Largest encoded size of the open transactions '
+                        'mined into one block')
+    parser.add_argument('--prune',
+                        type=int,
+                        metavar='BLOCKS',
+                        help='Keep the transactions of the last BLOCKS '
+                        f'blocks only (at least {MIN_PRUNE_BLOCKS})')
+    args = parser.parse_args()
+    if args.prune is not None and args.prune < MIN_PRUNE_BLOCKS:
+        parser.error(f'--prune must be at least {MIN_PRUNE_BLOCKS}')
+    if args.no_metrics:
+        metrics.disable()
+    try:
+        create_node(args.port, args.max_block_transactions,
+                    args.max_block_bytes, args.prune)
+    except BlockPrunedError as e:
+        parser.exit(1, f'{e}\n')
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+else:
+    # Imported by a WSGI server or a test client
+    create_node()
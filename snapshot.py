@@ -0,0 +1,114 @@
+import os
+import zlib
+import struct
+import logging
+from collections import namedtuple
+
+from ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+# A snapshot is taken whenever the chain has grown this many blocks past
+# the last one
+SNAPSHOT_INTERVAL = 1000
+# Number of snapshot files kept. Older ones still help after a
+# reorganization dropped the block of the newest.
+SNAPSHOTS_KEPT = 2
+# Changes with the encoding of the ledger, older snapshots are skipped
+SNAPSHOT_MAGIC = b'BCSNAP04'
+# <magic><height><block hash><verified height><ledger length>, followed by
+# the crc32 of those fields and the body. The body is the encoded Ledger.
+SNAPSHOT_FIELDS = struct.Struct('>8sQ32sQQ')
+SNAPSHOT_CRC = struct.Struct('>I')
+
+Snapshot = namedtuple('Snapshot',
+                      ['height', 'block_hash', 'verified_height', 'ledger'])
+
+
+class SnapshotStore:
+    """
+    Snapshot files of the state derived from the chain up to a block: the
+    balance and history index (with the unspent outputs and the ids of the
+    mined transactions) and the number of blocks known to be valid. Every
+    snapshot is stamped with
+    the height and hash of its block, so a node restarts from the newest
+    snapshot still matching its chain and only replays the blocks after
+    it. Open transactions have their own file, saved on every change.
+    """
+    def __init__(self,
+                 directory,
+                 interval=SNAPSHOT_INTERVAL,
+                 keep=SNAPSHOTS_KEPT):
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+
+    def path(self, height):
+        return os.path.join(self.directory, f'snapshot-{height:012d}.snap')
+
+    def heights(self):
+        """ Returns the heights of the stored snapshots, newest first """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted((int(name[9:21]) for name in names
+                       if name.startswith('snapshot-')
+                       and name.endswith('.snap') and name[9:21].isdigit()),
+                      reverse=True)
+
+    def save(self, height, block_hash, verified_height, ledger):
+        """
+        Writes the snapshot of the chain at the given height, replacing any
+        snapshot of that height, and drops the oldest snapshots beyond keep
+
+        Parameters
+        ----------
+            height (integer): Height of the block the state belongs to
+            block_hash (string): Hash of that block
+            verified_height (integer): Number of blocks known to be valid
+            ledger (Ledger): Balance and history index up to the block
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        body = ledger.to_bytes()
+        fields = SNAPSHOT_FIELDS.pack(SNAPSHOT_MAGIC, height,
+                                      bytes.fromhex(block_hash),
+                                      verified_height, len(body))
+        crc = zlib.crc32(body, zlib.crc32(fields))
+        path = self.path(height)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(fields)
+            f.write(SNAPSHOT_CRC.pack(crc))
+            f.write(body)
+        os.replace(tmp_path, path)
+        logger.info('Saved snapshot of the chain at height %d', height)
+        for old in self.heights()[self.keep:]:
+            os.remove(self.path(old))
+
+    def latest(self, is_current):
+        """
+        Returns the newest snapshot which is intact and for which
+        is_current(height, block_hash) holds, or None
+        """
+        for height in self.heights():
+            try:
+                with open(self.path(height), 'rb') as f:
+                    fields = f.read(SNAPSHOT_FIELDS.size)
+                    (magic, stored_height, block_hash, verified_height,
+                     ledger_size) = SNAPSHOT_FIELDS.unpack(fields)
+                    if (magic != SNAPSHOT_MAGIC or stored_height != height
+                            or not is_current(height, block_hash.hex())):
+                        continue
+                    crc, = SNAPSHOT_CRC.unpack(f.read(SNAPSHOT_CRC.size))
+                    body = f.read()
+                if zlib.crc32(body, zlib.crc32(fields)) != crc:
+                    logger.warning('Snapshot at height %d is corrupt', height)
+                    continue
+                ledger = Ledger.from_bytes(memoryview(body)[:ledger_size])
+            except (IOError, ValueError, IndexError, struct.error) as error:
+                logger.warning('Snapshot at height %d is unusable: %s',
+                               height, error)
+                continue
+            return Snapshot(height, block_hash.hex(), verified_height, ledger)
+        return None
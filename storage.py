@@ -0,0 +1,833 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+from block import Block, BlockHeader
+from transaction import Transaction
+from utils.encoding import Decoder, encode_transaction, encode_transactions
+
+logger = logging.getLogger(__name__)
+
+
+class BlockPrunedError(LookupError):
+    """ The transactions of a block were discarded by pruning """
+
+
+# fsync policies of the block store
+FSYNC_ALWAYS = 'always'  # fsync every append and mempool write
+FSYNC_NEVER = 'never'  # leave flushing to the OS
+
+# Every record in a segment is framed as <payload length><crc32><payload>.
+# Payloads are binary encoded blocks; logs written before the binary
+# encoding hold JSON payloads, which are told apart by their leading '{'.
+RECORD_HEADER = struct.Struct('>II')
+# Index entry of a block: <segment><payload offset><payload length><hash>
+INDEX_ENTRY = struct.Struct('>IQI32s')
+# Set in the segment of the index entries of pruned blocks, whose records
+# hold only the header and live in a headers segment
+PRUNED_FLAG = 0x80000000
+LEGACY_DATA_FILE = 'blockchain_data.txt'
+# Mempool journal records start with the kind of change: an added
+# transaction (encoded) or the raw id of a removed one
+MEMPOOL_ADDED = b'+'
+MEMPOOL_REMOVED = b'-'
+# Number of decoded blocks a StoredChain keeps in memory
+BLOCK_CACHE_SIZE = 256
+
+
+class BlockStore:
+    """
+    Append-only storage engine for the block chain. Blocks are appended as
+    checksummed records to a log split into fixed size segments.
+
+    The open transactions are saved as a snapshot file and a journal of
+    the transactions added and removed since, appended in the same record
+    framing as the log; saving all of them rewrites the snapshot and starts
+    a new journal.
+
+    An index file holds one fixed size entry per block height (segment,
+    offset and length of the record plus the block hash), and the segments
+    are read through memory maps, so single blocks and ranges can be read
+    without loading the rest of the chain.
+
+    Old segments can be pruned: they are replaced by headers segments
+    holding only the block headers, so the chain can still be linked and
+    verified from its headers while the transactions are gone.
+    """
+    def __init__(self,
+                 directory='blockchain_data',
+                 segment_size=1000,
+                 fsync=FSYNC_ALWAYS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        os.makedirs(self.directory, exist_ok=True)
+        self.__maps = {}
+        self.__index_map = None
+        self.__heights_by_hash = None
+        self.__block_count = 0
+        self.__pruned_height = 0
+        # Records in the mempool journal, known once it was loaded
+        self.__journal_records = 0
+        self.__open_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'blocks.idx')
+
+    @property
+    def mempool_path(self):
+        return os.path.join(self.directory, 'mempool.dat')
+
+    @property
+    def mempool_journal_path(self):
+        return os.path.join(self.directory, 'mempool.log')
+
+    @property
+    def legacy_mempool_path(self):
+        return os.path.join(self.directory, 'mempool.json')
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'blocks_{segment:06d}.log')
+
+    def headers_path(self, segment):
+        return os.path.join(self.directory, f'headers_{segment:06d}.log')
+
+    def __record_path(self, segment):
+        # Path of the segment an index entry points to
+        if segment & PRUNED_FLAG:
+            return self.headers_path(segment & ~PRUNED_FLAG)
+        return self.segment_path(segment)
+
+    def segments(self):
+        """ Returns the numbers of the existing segments in order """
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('blocks_') and name.endswith('.log'):
+                numbers.append(int(name[len('blocks_'):-len('.log')]))
+        return sorted(numbers)
+
+    def block_count(self):
+        """ Returns the number of blocks stored in the log """
+        return self.__block_count
+
+    def pruned_height(self):
+        """ Returns the number of blocks whose transactions were pruned """
+        return self.__pruned_height
+
+    def __open_index(self):
+        """
+        Brings the index in line with the log after a restart: entries for
+        records that never made it to disk are dropped and records appended
+        after the last index write are indexed.
+        """
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'wb').close()
+        count = os.path.getsize(self.index_path) // INDEX_ENTRY.size
+        with open(self.index_path, 'rb') as f:
+            while count > 0:
+                f.seek((count - 1) * INDEX_ENTRY.size)
+                segment, offset, length, _ = INDEX_ENTRY.unpack(
+                    f.read(INDEX_ENTRY.size))
+                path = self.__record_path(segment)
+                if (os.path.exists(path)
+                        and os.path.getsize(path) >= offset + length):
+                    break
+                count -= 1
+        with open(self.index_path, 'r+b') as f:
+            f.truncate(count * INDEX_ENTRY.size)
+
+        self.__block_count = count
+        if count:
+            entry = self.__read_entry_from_file(count - 1)
+            resume = (entry[0], entry[1] + entry[2])
+        else:
+            resume = (0, 0)
+        missing = [(segment, offset, length,
+                    bytes.fromhex(self.decode_block(payload).hash))
+                   for segment, offset, length, payload in self.__scan(*resume)
+                   ]
+        if missing:
+            logger.info(f'Indexing {len(missing)} unindexed blocks')
+            self.__append_index(missing)
+        self.__pruned_height = self.__find_pruned_height()
+        # Segments left behind by a prune interrupted after the index was
+        # written
+        for segment in self.segments():
+            if (segment + 1) * self.segment_size <= self.__pruned_height:
+                os.remove(self.segment_path(segment))
+
+    def __find_pruned_height(self):
+        # Pruned blocks are a prefix of the chain, found by binary search
+        low, high = 0, self.__block_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__entry(middle)[0] & PRUNED_FLAG:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __read_entry_from_file(self, height):
+        with open(self.index_path, 'rb') as f:
+            f.seek(height * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def __scan(self, start_segment, start_offset):
+        """
+        Reads the records of the log from the given position, yielding
+        (segment, payload offset, payload length, payload). A torn record at
+        the end of the last segment (crash in the middle of an append) is
+        cut off so the next append starts from a clean offset.
+        """
+        segments = [
+            segment for segment in self.segments() if segment >= start_segment
+        ]
+        for position, segment in enumerate(segments):
+            path = self.segment_path(segment)
+            with open(path, 'rb') as f:
+                valid_offset = start_offset if segment == start_segment else 0
+                f.seek(valid_offset)
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if not header:
+                        break
+                    payload = None
+                    if len(header) == RECORD_HEADER.size:
+                        length, checksum = RECORD_HEADER.unpack(header)
+                        payload = f.read(length)
+                        if (len(payload) != length
+                                or zlib.crc32(payload) != checksum):
+                            payload = None
+                    if payload is None:
+                        self.__recover(path, valid_offset,
+                                       position == len(segments) - 1)
+                        break
+                    yield (segment, valid_offset + RECORD_HEADER.size, length,
+                           payload)
+                    valid_offset = f.tell()
+
+    def __recover(self, path, valid_offset, is_last_segment):
+        if not is_last_segment:
+            raise IOError(f'Corrupt record in block log segment {path}')
+        logger.warning(
+            f'Truncating torn record in {path} at offset {valid_offset}')
+        with open(path, 'r+b') as f:
+            f.truncate(valid_offset)
+            self.__sync(f)
+
+    def __entry(self, height):
+        if not 0 <= height < self.__block_count:
+            raise IndexError(f'Block height {height} is not stored')
+        end = (height + 1) * INDEX_ENTRY.size
+        if self.__index_map is None or len(self.__index_map) < end:
+            self.__index_map = self.__map(self.index_path)
+        return INDEX_ENTRY.unpack_from(self.__index_map,
+                                       height * INDEX_ENTRY.size)
+
+    @staticmethod
+    def __map(path):
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_record(self, height):
+        """
+        Returns the encoded block at the given height as a memoryview into
+        the memory mapped segment, without copying it
+        """
+        segment, offset, length, _ = self.__entry(height)
+        segment_map = self.__maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + length:
+            # Segments grow as blocks are appended, so they are remapped
+            segment_map = self.__map(self.__record_path(segment))
+            self.__maps[segment] = segment_map
+        return memoryview(segment_map)[offset:offset + length]
+
+    def __check_not_pruned(self, height):
+        if 0 <= height < self.__pruned_height:
+            raise BlockPrunedError(f'Block {height} was pruned')
+
+    def get_block(self, height):
+        """
+        Returns the stored block at the given height, raising
+        BlockPrunedError if its transactions were pruned
+        """
+        self.__check_not_pruned(height)
+        return self.decode_block(self.read_record(height))
+
+    def get_header(self, height):
+        """
+        Returns the header of the stored block at the given height without
+        decoding its transactions
+        """
+        payload = self.read_record(height)
+        if payload[:1] == b'{':
+            return self.decode_block(payload).header()
+        return BlockHeader.from_bytes(payload, self.block_hash(height))
+
+    def get_transaction(self, height, position):
+        """
+        Returns the header of the stored block at the given height and its
+        transaction at the given position, skipping over the transactions
+        before it without decoding them
+        """
+        self.__check_not_pruned(height)
+        payload = self.read_record(height)
+        if payload[:1] == b'{':
+            block = self.decode_block(payload)
+            return block.header(), block.transactions[position]
+        decoder = Decoder(payload)
+        (index, previous_hash, proof, timestamp, difficulty, version, root,
+         count) = decoder.header()
+        if not 0 <= position < count:
+            raise IndexError('Transaction position out of range')
+        for _ in range(position):
+            decoder.skip_transaction()
+        header = BlockHeader(index, previous_hash, root, proof, timestamp,
+                             difficulty, version, count,
+                             self.block_hash(height))
+        return header, Transaction(*decoder.transaction())
+
+    def block_hash(self, height):
+        """ Returns the hash of the stored block at the given height """
+        return self.__entry(height)[3].hex()
+
+    def height_of(self, block_hash):
+        """ Returns the height of the stored block with the given hash """
+        if self.__heights_by_hash is None:
+            # Built on the first lookup so that opening the store stays cheap
+            index_map = self.__map(self.index_path)
+            entries = INDEX_ENTRY.iter_unpack(
+                memoryview(index_map)[:self.__block_count * INDEX_ENTRY.size])
+            self.__heights_by_hash = {
+                entry[3]: height
+                for height, entry in enumerate(entries)
+            }
+        try:
+            return self.__heights_by_hash.get(bytes.fromhex(block_hash))
+        except ValueError:
+            return None
+
+    def iter_records(self, start=0, stop=None):
+        """ Streams the encoded blocks in [start, stop) in order """
+        if stop is None:
+            stop = self.__block_count
+        for height in range(start, min(stop, self.__block_count)):
+            yield self.read_record(height)
+
+    def iter_blocks(self, start=0, stop=None):
+        """ Streams the stored blocks in [start, stop) in order """
+        for payload in self.iter_records(start, stop):
+            yield self.decode_block(payload)
+
+    def iter_headers(self, start=0, stop=None):
+        """ Streams the headers of the stored blocks in [start, stop) """
+        if stop is None:
+            stop = self.__block_count
+        for height in range(start, min(stop, self.__block_count)):
+            yield self.get_header(height)
+
+    @staticmethod
+    def decode_block(payload):
+        """ Builds a block from a binary or legacy JSON record payload """
+        if payload[:1] == b'{':
+            return Block.from_dict(json.loads(bytes(payload).decode('utf8')))
+        return Block.from_bytes(payload)
+
+    def append_blocks(self, blocks):
+        """
+        Appends blocks to the end of the log and the index
+
+        Parameters
+        ----------
+            blocks (list): Blocks that follow the last stored block
+        """
+        height = self.__block_count
+        entries = []
+        f = None
+        open_segment = None
+        try:
+            for block in blocks:
+                segment = height // self.segment_size
+                if segment != open_segment:
+                    self.__close(f)
+                    f = open(self.segment_path(segment), 'ab')
+                    open_segment = segment
+                payload = block.to_bytes()
+                f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                entries.append((segment, f.tell(), len(payload),
+                                bytes.fromhex(block.hash)))
+                f.write(payload)
+                height += 1
+        finally:
+            self.__close(f)
+        # The index is written after the log, so a crash in between leaves
+        # records the next start indexes again
+        self.__append_index(entries)
+
+    def __append_index(self, entries):
+        with open(self.index_path, 'ab') as f:
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+            self.__sync(f)
+        if self.__heights_by_hash is not None:
+            for height, entry in enumerate(entries, self.__block_count):
+                self.__heights_by_hash[entry[3]] = height
+        self.__block_count += len(entries)
+
+    def __close(self, f):
+        if f is not None:
+            self.__sync(f)
+            f.close()
+
+    def __sync(self, f):
+        f.flush()
+        if self.fsync == FSYNC_ALWAYS:
+            os.fsync(f.fileno())
+
+    def truncate(self, height):
+        """
+        Drops the stored blocks from the given height on, when the chain is
+        reorganized onto a fork. The log is cut before the index, so a crash
+        in between leaves index entries the next start drops.
+        """
+        if height >= self.__block_count:
+            return
+        if height < self.__pruned_height:
+            raise BlockPrunedError(f'Block {height} was pruned')
+        segment, offset, _, _ = self.__entry(height)
+        for number in self.segments():
+            if number > segment:
+                os.remove(self.segment_path(number))
+        with open(self.segment_path(segment), 'r+b') as f:
+            f.truncate(offset - RECORD_HEADER.size)
+            self.__sync(f)
+        with open(self.index_path, 'r+b') as f:
+            f.truncate(height * INDEX_ENTRY.size)
+            self.__sync(f)
+        self.__block_count = height
+        # Maps of the cut files must not be read again
+        self.__maps = {}
+        self.__index_map = None
+        self.__heights_by_hash = None
+
+    def prune(self, height):
+        """
+        Discards the transactions of the blocks below the given height,
+        whole segments at a time, keeping their headers. Every pruned
+        segment is replaced by a headers segment, then its index entries
+        are pointed there and only then the segment is removed, so a crash
+        at any point leaves every block readable.
+
+        Returns
+        -------
+            pruned_height (integer): Number of blocks now pruned
+        """
+        height = min(height, self.__block_count)
+        first = self.__pruned_height // self.segment_size
+        for segment in range(first, height // self.segment_size):
+            start = segment * self.segment_size
+            heights = range(start, start + self.segment_size)
+            tmp_path = self.headers_path(segment) + '.tmp'
+            entries = []
+            with open(tmp_path, 'wb') as f:
+                for block_height in heights:
+                    payload = self.__header_payload(
+                        self.read_record(block_height))
+                    f.write(
+                        RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                    entries.append((segment | PRUNED_FLAG, f.tell(),
+                                    len(payload),
+                                    self.__entry(block_height)[3]))
+                    f.write(payload)
+                self.__sync(f)
+            os.replace(tmp_path, self.headers_path(segment))
+            with open(self.index_path, 'r+b') as f:
+                f.seek(start * INDEX_ENTRY.size)
+                for entry in entries:
+                    f.write(INDEX_ENTRY.pack(*entry))
+                self.__sync(f)
+            self.__maps.pop(segment, None)
+            self.__index_map = None
+            self.__pruned_height = start + self.segment_size
+            os.remove(self.segment_path(segment))
+            logger.info(f'Pruned the transactions of blocks {start} to '
+                        f'{self.__pruned_height - 1}')
+        return self.__pruned_height
+
+    @classmethod
+    def __header_payload(cls, payload):
+        # The binary encoding of the block up to its transactions, which
+        # BlockHeader.from_bytes reads
+        if payload[:1] == b'{':
+            payload = cls.decode_block(payload).to_bytes()
+        decoder = Decoder(payload)
+        decoder.header()
+        return bytes(payload[:decoder.offset])
+
+    def save_mempool(self, transactions):
+        """
+        Atomically replaces the mempool snapshot with the given transactions
+        and starts an empty journal
+        """
+        tmp_path = self.mempool_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_transactions(transactions))
+            self.__sync(f)
+        os.replace(tmp_path, self.mempool_path)
+        # Replaying the old journal on the new snapshot after a crash here
+        # gives the new snapshot again, as it already holds its changes
+        if os.path.exists(self.mempool_journal_path):
+            os.remove(self.mempool_journal_path)
+        self.__journal_records = 0
+        if os.path.exists(self.legacy_mempool_path):
+            os.remove(self.legacy_mempool_path)
+
+    def append_mempool(self, added, removed):
+        """
+        Appends the open transactions added and the ids of those removed
+        since the last save to the mempool journal. Removals are replayed
+        first, so a transaction removed and added again stays.
+        """
+        records = [MEMPOOL_REMOVED + bytes.fromhex(tx_id) for tx_id in removed]
+        records.extend(MEMPOOL_ADDED + encode_transaction(tx) for tx in added)
+        with open(self.mempool_journal_path, 'ab') as f:
+            for payload in records:
+                f.write(
+                    RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                f.write(payload)
+            self.__sync(f)
+        self.__journal_records += len(records)
+
+    def mempool_journal_records(self):
+        """ Returns the number of records in the mempool journal """
+        return self.__journal_records
+
+    def load_mempool(self):
+        """ Returns the stored open transactions, the journal replayed """
+        try:
+            with open(self.mempool_path, 'rb') as f:
+                transactions = [
+                    Transaction(*tx) for tx in Decoder(f.read()).transactions()
+                ]
+        except IOError:
+            try:
+                with open(self.legacy_mempool_path, 'r') as f:
+                    transactions = [
+                        Transaction.from_dict(tx)
+                        for tx in json.loads(f.read())
+                    ]
+            except IOError:
+                transactions = []
+        by_id = OrderedDict((tx.id, tx) for tx in transactions)
+        self.__journal_records = 0
+        for payload in self.__scan_journal():
+            if payload[:1] == MEMPOOL_REMOVED:
+                by_id.pop(payload[1:].hex(), None)
+            else:
+                tx = Transaction(*Decoder(payload, 1).transaction())
+                by_id[tx.id] = tx
+            self.__journal_records += 1
+        return list(by_id.values())
+
+    def __scan_journal(self):
+        # Yields the payloads of the journal, cutting off a torn record at
+        # its end like __scan does for the log
+        path = self.mempool_journal_path
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return
+        with f:
+            valid_offset = 0
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return
+                payload = None
+                if len(header) == RECORD_HEADER.size:
+                    length, checksum = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if (len(payload) != length
+                            or zlib.crc32(payload) != checksum):
+                        payload = None
+                if payload is None:
+                    break
+                yield payload
+                valid_offset = f.tell()
+        self.__recover(path, valid_offset, True)
+
+    def migrate_legacy(self, path=LEGACY_DATA_FILE):
+        """
+        Imports a chain saved in the old single file format (the whole
+        chain on the first line and the open transactions on the second)
+        into an empty store. The old file is kept with a '.migrated' suffix.
+
+        Returns
+        -------
+            True (Boolean): If a legacy file was migrated
+            False (Boolean): If there was nothing to migrate
+        """
+        if not os.path.exists(path) or self.block_count() > 0:
+            return False
+        logger.info(f'Migrating legacy block chain file {path}')
+        with open(path, mode='r') as f:
+            file_content = f.readlines()
+        self.append_blocks(
+            [Block.from_dict(block) for block in json.loads(file_content[0])])
+        self.save_mempool([
+            Transaction.from_dict(tx) for tx in json.loads(file_content[1])
+        ] if len(file_content) > 1 else [])
+        os.replace(path, path + '.migrated')
+        return True
+
+
+class StoredChain:
+    """
+    Sequence of the blocks of the chain backed by a BlockStore. Stored
+    blocks are decoded from the memory mapped log when accessed (recently
+    used ones are cached), blocks appended since the last flush are kept in
+    memory until they are written.
+
+    Blocks are only appended, except when the chain is reorganized onto a
+    fork, so snapshot() hands out fixed length views that stay valid while
+    blocks are appended. Access to the store and the cache is serialized
+    internally, as the memory maps must not be read while the log is cut.
+
+    Blocks whose transactions were pruned are returned as their
+    BlockHeader, which is all that linking and verifying the chain below
+    the pruned height needs.
+    """
+    def __init__(self, store, cache_size=BLOCK_CACHE_SIZE):
+        self.__store = store
+        self.__cache_size = cache_size
+        self.__cache = OrderedDict()
+        self.__unsaved = []
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return self.__store.block_count() + len(self.__unsaved)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[height] for height in range(*key.indices(len(self)))]
+        height = key + len(self) if key < 0 else key
+        with self.__lock:
+            stored = self.__store.block_count()
+            if not 0 <= height < stored + len(self.__unsaved):
+                raise IndexError('Block height out of range')
+            if height >= stored:
+                return self.__unsaved[height - stored]
+            if height < self.__store.pruned_height():
+                return self.__store.get_header(height)
+            block = self.__cache.get(height)
+            if block is not None:
+                self.__cache.move_to_end(height)
+                return block
+            block = self.__store.get_block(height)
+            self.__remember(height, block)
+            return block
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def pruned_height(self):
+        """ Returns the number of blocks whose transactions were pruned """
+        with self.__lock:
+            return self.__store.pruned_height()
+
+    def prune(self, height):
+        """
+        Discards the transactions of the stored blocks below the given
+        height (see BlockStore.prune)
+
+        Returns
+        -------
+            pruned_height (integer): Number of blocks now pruned
+        """
+        with self.__lock:
+            pruned_height = self.__store.prune(height)
+            for cached in [h for h in self.__cache if h < pruned_height]:
+                del self.__cache[cached]
+            return pruned_height
+
+    def transaction_at(self, height, position):
+        """
+        Returns the header of the block at the given height and its
+        transaction at the given position, without decoding the whole
+        block unless it is cached
+        """
+        with self.__lock:
+            stored = self.__store.block_count()
+            if height >= stored:
+                block = self.__unsaved[height - stored]
+            else:
+                block = self.__cache.get(height)
+                if block is None:
+                    return self.__store.get_transaction(height, position)
+        return block.header(), block.transactions[position]
+
+    def iter_range(self, start=0, stop=None):
+        """ Streams the blocks in [start, stop) in order """
+        # Streamed without going through the cache to keep memory flat
+        height = max(start, 0)
+        while stop is None or height < stop:
+            with self.__lock:
+                stored = self.__store.block_count()
+                if height < self.__store.pruned_height():
+                    block = self.__store.get_header(height)
+                elif height < stored:
+                    block = self.__store.get_block(height)
+                elif height - stored < len(self.__unsaved):
+                    block = self.__unsaved[height - stored]
+                else:
+                    return
+            yield block
+            height += 1
+
+    def iter_headers(self, start=0, stop=None):
+        """
+        Streams the headers of the blocks in [start, stop) in order, without
+        decoding the transactions of stored blocks
+        """
+        height = max(start, 0)
+        while stop is None or height < stop:
+            with self.__lock:
+                stored = self.__store.block_count()
+                if height < stored:
+                    header = self.__store.get_header(height)
+                elif height - stored < len(self.__unsaved):
+                    header = self.__unsaved[height - stored].header()
+                else:
+                    return
+            yield header
+            height += 1
+
+    def snapshot(self, length=None):
+        """
+        Returns a view of the blocks in the chain right now, or of its first
+        length blocks
+        """
+        return ChainSnapshot(self, len(self) if length is None else length)
+
+    def __remember(self, height, block):
+        self.__cache[height] = block
+        if len(self.__cache) > self.__cache_size:
+            self.__cache.popitem(last=False)
+
+    def append(self, block):
+        """ Adds a block to the end of the chain (written on flush) """
+        with self.__lock:
+            self.__unsaved.append(block)
+
+    def flush(self):
+        """ Writes the blocks appended since the last flush to the store """
+        with self.__lock:
+            if not self.__unsaved:
+                return
+            height = self.__store.block_count()
+            self.__store.append_blocks(self.__unsaved)
+            for block in self.__unsaved:
+                self.__remember(height, block)
+                height += 1
+            self.__unsaved = []
+
+    def truncate(self, height):
+        """ Drops the blocks from the given height on """
+        with self.__lock:
+            stored = self.__store.block_count()
+            if height >= stored:
+                del self.__unsaved[height - stored:]
+            else:
+                self.__unsaved = []
+                self.__store.truncate(height)
+            for cached in [h for h in self.__cache if h >= height]:
+                del self.__cache[cached]
+
+    def height_of(self, block_hash):
+        """ Returns the height of the block with the given hash (or None) """
+        with self.__lock:
+            height = self.__store.height_of(block_hash)
+            if height is not None:
+                return height
+            for height, block in enumerate(self.__unsaved,
+                                           self.__store.block_count()):
+                if block.hash == block_hash:
+                    return height
+        return None
+
+
+class ChainSnapshot:
+    """
+    Read only view of the first blocks of a StoredChain. Blocks appended to
+    the chain later are not part of the view.
+    """
+    def __init__(self, chain, length):
+        self.__chain = chain
+        self.__length = length
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [
+                self.__chain[height]
+                for height in range(*key.indices(self.__length))
+            ]
+        height = key + self.__length if key < 0 else key
+        if not 0 <= height < self.__length:
+            raise IndexError('Block height out of range')
+        return self.__chain[height]
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def iter_range(self, start=0, stop=None):
+        """ Streams the blocks of the view in [start, stop) in order """
+        stop = self.__length if stop is None else min(stop, self.__length)
+        return self.__chain.iter_range(start, stop)
+
+    def iter_headers(self, start=0, stop=None):
+        """ Streams the headers of the view in [start, stop) in order """
+        stop = self.__length if stop is None else min(stop, self.__length)
+        return self.__chain.iter_headers(start, stop)
+
+    def height_of(self, block_hash):
+        """ Returns the height of the block with the given hash (or None) """
+        height = self.__chain.height_of(block_hash)
+        return height if height is not None and height < self.__length else None
+
+
+class ExtendedChain:
+    """
+    Read only view of the first blocks of a chain followed by other blocks,
+    used to check a fork before the chain switches to it
+    """
+    def __init__(self, base, length, blocks):
+        self.__base = base
+        self.__length = length
+        self.__blocks = blocks
+
+    def __len__(self):
+        return self.__length + len(self.__blocks)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[height] for height in range(*key.indices(len(self)))]
+        height = key + len(self) if key < 0 else key
+        if not 0 <= height < len(self):
+            raise IndexError('Block height out of range')
+        if height < self.__length:
+            return self.__base[height]
+        return self.__blocks[height - self.__length]
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
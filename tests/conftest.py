@@ -0,0 +1,125 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block import Block  # noqa: E402
+from blockchain import MINING_REWARD, BlockChain  # noqa: E402
+from miner import ProofOfWorkMiner  # noqa: E402
+from network import PeerNetwork  # noqa: E402
+from snapshot import SnapshotStore  # noqa: E402
+from storage import FSYNC_NEVER, BlockStore  # noqa: E402
+from transaction import Transaction  # noqa: E402
+from utils.encoding import BLOCK_VERSION_JSON  # noqa: E402
+from utils.verification import TARGET_BLOCK_TIME, Verification  # noqa: E402
+from utxo import REWARD_SENDER  # noqa: E402
+from wallet import Wallet  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def wallets():
+    """ Two Ed25519 wallets, the fastest scheme to sign with """
+    keys = []
+    for _ in range(2):
+        wallet = Wallet(scheme='ed25519')
+        wallet.create_keys()
+        keys.append(wallet)
+    return keys
+
+
+@pytest.fixture(scope='session')
+def miner():
+    miner = ProofOfWorkMiner(processes=1)
+    yield miner
+    miner.close()
+
+
+@pytest.fixture
+def genesis():
+    return Block(0, '', [], 100, 0, version=BLOCK_VERSION_JSON)
+
+
+@pytest.fixture
+def pay():
+    """ Returns a function signing a payment of a wallet """
+    def pay(wallet, recipient, amount, inputs=(), nonce=None):
+        signature = wallet.sign_transaction(wallet.public_key, recipient,
+                                            amount, inputs, nonce)
+        return Transaction(wallet.public_key, recipient, signature, amount,
+                           wallet.scheme, inputs, nonce)
+
+    return pay
+
+
+@pytest.fixture
+def mine(miner):
+    """
+    Returns a function mining a block of the transactions and a reward on
+    top of a list of blocks, which it appends the block to. The block is
+    TARGET_BLOCK_TIME after the previous one unless given a timestamp.
+    """
+    def mine(chain, transactions, rewarded, timestamp=None):
+        height = len(chain)
+        transactions = list(transactions) + [
+            Transaction(REWARD_SENDER, rewarded, '', MINING_REWARD,
+                        nonce=height)
+        ]
+        candidate = Block(height,
+                          chain[-1].hash,
+                          transactions,
+                          None,
+                          (chain[-1].timestamp + TARGET_BLOCK_TIME
+                           if timestamp is None else timestamp),
+                          difficulty=Verification.next_difficulty(chain))
+        block = Block(height,
+                      candidate.previous_hash,
+                      transactions,
+                      miner.mine_header(candidate),
+                      candidate.timestamp,
+                      candidate.difficulty,
+                      merkle_root=candidate.merkle_root)
+        chain.append(block)
+        return block
+
+    return mine
+
+
+@pytest.fixture
+def open_chain(tmp_path, wallets):
+    """
+    Returns a function opening the block chain of the first wallet stored
+    in tmp_path, taking a snapshot every snapshot_interval blocks
+    """
+    directory = str(tmp_path / 'blockchain_data')
+
+    def open_chain(snapshot_interval=1000, segment_size=1000, **kwargs):
+        snapshots = SnapshotStore(os.path.join(directory, 'snapshots'),
+                                  snapshot_interval)
+        store = BlockStore(directory, segment_size, FSYNC_NEVER)
+        return BlockChain(wallets[0].public_key,
+                          store,
+                          snapshots=snapshots,
+                          **kwargs)
+
+    return open_chain
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch, wallets, open_chain):
+    """
+    The node module serving the chain of open_chain with the first wallet
+    and no peers, imported in tmp_path where it creates its files
+    """
+    monkeypatch.chdir(tmp_path)
+    import node
+    monkeypatch.setattr(node, 'wallet', wallets[0])
+    monkeypatch.setattr(node, 'block_chain', open_chain())
+    monkeypatch.setattr(node, 'network', PeerNetwork())
+    return node
+
+
+@pytest.fixture
+def client(node):
+    return node.app.test_client()
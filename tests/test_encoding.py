@@ -0,0 +1,88 @@
+import pytest
+
+from block import Block, BlockHeader
+from transaction import Transaction
+from utils.encoding import (BLOCK_VERSION_BINARY, BLOCK_VERSION_JSON,
+                            BLOCK_VERSION_MERKLE, BLOCK_VERSION_UNIQUE_IDS,
+                            Decoder, encode_chain, encode_text,
+                            encode_transaction, iter_chain)
+
+SENDER = '30' * 81
+RECIPIENT = '31' * 81
+SIGNATURE = 'ab' * 64
+OUTPOINT = ('cd' * 32, 1)
+
+TRANSACTIONS = [
+    # Signed before there were other schemes, inputs and nonces
+    Transaction(SENDER, RECIPIENT, SIGNATURE, 1.5),
+    Transaction(SENDER, 'bob', SIGNATURE, 3, 'ed25519'),
+    Transaction(SENDER, RECIPIENT, SIGNATURE, 2.25, 'ecdsa', [OUTPOINT]),
+    Transaction(SENDER, RECIPIENT, SIGNATURE, 7, 'ed25519', [OUTPOINT],
+                nonce=2**64 - 1),
+    Transaction('MINING', RECIPIENT, '', 10, nonce=0),
+    Transaction('Ümlaut sender', 'ü', 'not hex', 0.1),
+]
+
+
+@pytest.mark.parametrize('transaction', TRANSACTIONS)
+def test_transaction_round_trip(transaction):
+    encoded = encode_transaction(transaction)
+    decoder = Decoder(encoded)
+    decoded = Transaction(*decoder.transaction())
+    assert decoder.offset == len(encoded)
+    assert decoded.to_dict() == transaction.to_dict()
+    assert type(decoded.amount) is type(transaction.amount)
+    assert decoded.id == transaction.id
+
+
+@pytest.mark.parametrize('transaction', TRANSACTIONS)
+def test_skip_transaction(transaction):
+    decoder = Decoder(encode_transaction(transaction) + b'rest')
+    decoder.skip_transaction()
+    assert decoder.offset == len(encode_transaction(transaction))
+
+
+def test_transaction_without_nonce_keeps_its_encoding():
+    transaction = TRANSACTIONS[0]
+    assert encode_transaction(transaction).startswith(encode_text(SENDER))
+    with_nonce = Transaction(SENDER, RECIPIENT, SIGNATURE, 1.5, nonce=0)
+    assert with_nonce.id != transaction.id
+
+
+def test_int_and_float_amounts_differ():
+    assert (Transaction(SENDER, RECIPIENT, SIGNATURE, 1).id !=
+            Transaction(SENDER, RECIPIENT, SIGNATURE, 1.0).id)
+
+
+@pytest.mark.parametrize('version', [
+    BLOCK_VERSION_JSON, BLOCK_VERSION_BINARY, BLOCK_VERSION_MERKLE,
+    BLOCK_VERSION_UNIQUE_IDS
+])
+def test_block_round_trip(version):
+    block = Block(3, 'ef' * 32, TRANSACTIONS, 1234, 1600000000.5, 12,
+                  version)
+    decoded = Block.from_bytes(block.to_bytes())
+    assert decoded.to_dict() == block.to_dict()
+    assert decoded.hash == block.hash
+    header = BlockHeader.from_bytes(block.to_bytes())
+    assert header.hash == block.hash
+    assert header.transaction_count == len(TRANSACTIONS)
+
+
+def test_block_without_difficulty_round_trip():
+    block = Block(1, 'ef' * 32, TRANSACTIONS[:1], 7, 1600000000,
+                  version=BLOCK_VERSION_JSON)
+    assert Block.from_bytes(block.to_bytes()).difficulty is None
+
+
+def test_chain_round_trip(genesis):
+    block = Block(1, genesis.hash, TRANSACTIONS, 5, 1600000000.0, 8)
+    decoded = [Block.from_bytes(data)
+               for data in iter_chain(encode_chain([genesis, block]))]
+    assert [b.hash for b in decoded] == [genesis.hash, block.hash]
+
+
+def test_truncated_transaction_is_rejected():
+    encoded = encode_transaction(TRANSACTIONS[3])
+    with pytest.raises(ValueError):
+        Decoder(encoded[:-10]).transaction()
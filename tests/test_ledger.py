@@ -0,0 +1,130 @@
+import pytest
+
+from block import Block
+from ledger import Ledger
+from transaction import Transaction
+from utils.encoding import BLOCK_VERSION_MERKLE
+from utxo import InvalidSpend, UtxoSet
+
+
+@pytest.fixture
+def chain(wallets, genesis, mine, pay):
+    """
+    Blocks mined by the first wallet, which then pays the second once from
+    a named output and once from its balance, and the second pays back
+    """
+    a, b = wallets
+    chain = [genesis]
+    first = mine(chain, [], a.public_key)
+    mine(chain, [], a.public_key)
+    reward = (first.transactions[-1].id, 0)
+    mine(chain, [pay(a, b.public_key, 4, [reward], nonce=1)], a.public_key)
+    mine(chain, [pay(a, b.public_key, 2.5, nonce=2)], b.public_key)
+    mine(chain, [pay(b, a.public_key, 1, nonce=3)], a.public_key)
+    return chain
+
+
+def state(ledger, wallets):
+    addresses = [wallet.public_key for wallet in wallets]
+    return ({address: ledger.balance(address) for address in addresses},
+            {address: ledger.history(address) for address in addresses},
+            {address: ledger.utxos.outputs(address) for address in addresses},
+            len(ledger.utxos))
+
+
+def test_outputs_add_up_to_balances(chain, wallets):
+    ledger = Ledger.from_chain(chain)
+    for wallet in wallets:
+        outputs = ledger.utxos.outputs(wallet.public_key)
+        assert sum(amount for _, amount in outputs) == pytest.approx(
+            ledger.balance(wallet.public_key))
+
+
+def test_utxo_set_round_trip(chain, wallets):
+    utxos = Ledger.from_chain(chain).utxos
+    data = utxos.to_bytes()
+    restored, offset = UtxoSet.from_bytes(b'prefix' + data, len(b'prefix'))
+    assert offset == len(b'prefix') + len(data)
+    assert restored.to_bytes() == data
+    for wallet in wallets:
+        assert (restored.outputs(wallet.public_key) ==
+                utxos.outputs(wallet.public_key))
+    for block in chain[1:]:
+        for tx in block.transactions:
+            assert restored.has_transaction(tx.id)
+
+    # The logged changes survive the round trip
+    utxos.revert_block(chain[-1])
+    restored.revert_block(chain[-1])
+    assert restored.to_bytes() == utxos.to_bytes()
+
+
+def test_ledger_round_trip(chain, wallets):
+    ledger = Ledger.from_chain(chain)
+    restored = Ledger.from_bytes(ledger.to_bytes())
+    assert state(restored, wallets) == state(ledger, wallets)
+    assert restored.to_bytes() == ledger.to_bytes()
+
+
+def test_revert_block_restores_the_previous_state(chain, wallets):
+    ledger = Ledger.from_chain(chain)
+    for block in reversed(chain[2:]):
+        assert ledger.can_revert(block)
+        ledger.revert_block(block)
+    assert state(ledger, wallets) == state(Ledger.from_chain(chain[:2]),
+                                           wallets)
+    for block in chain[2:]:
+        for tx in block.transactions:
+            assert not ledger.utxos.has_transaction(tx.id)
+
+    # Applying the blocks again gives the same state as before
+    for block in chain[2:]:
+        ledger.apply_block(block)
+    assert state(ledger, wallets) == state(Ledger.from_chain(chain), wallets)
+
+
+def test_mined_transaction_ids_are_not_repeated(chain, wallets, mine):
+    ledger = Ledger.from_chain(chain)
+    before = ledger.to_bytes()
+    replay = mine(list(chain), chain[-1].transactions[:-1],
+                  wallets[0].public_key)
+    with pytest.raises(InvalidSpend):
+        ledger.apply_block(replay)
+    assert ledger.to_bytes() == before
+
+
+def test_block_spending_an_output_twice_is_left_unapplied(
+        chain, wallets, mine, pay):
+    a, b = wallets
+    ledger = Ledger.from_chain(chain)
+    before = ledger.to_bytes()
+    spent = chain[3].transactions[0].inputs
+    block = mine(list(chain), [pay(a, b.public_key, 1, spent, nonce=4)],
+                 a.public_key)
+    with pytest.raises(InvalidSpend):
+        ledger.apply_block(block)
+    assert ledger.to_bytes() == before
+
+
+def test_legacy_repeated_ids_keep_separate_outputs(genesis):
+    chain = [genesis]
+    for height in range(1, 4):
+        # Rewards had no nonce before BLOCK_VERSION_UNIQUE_IDS
+        reward = Transaction('MINING', 'miner', '', 10)
+        chain.append(
+            Block(height, chain[-1].hash, [reward], 0, height, 8,
+                  BLOCK_VERSION_MERKLE))
+    ledger = Ledger.from_chain(chain)
+    tx_id = chain[1].transactions[0].id
+    assert ledger.utxos.outputs('miner') == [((tx_id, 0), 10), ((tx_id, 2), 10),
+                                             ((tx_id, 4), 10)]
+
+    ledger.revert_block(chain[3])
+    assert ledger.utxos.outputs('miner') == [((tx_id, 0), 10),
+                                             ((tx_id, 2), 10)]
+    assert ledger.utxos.has_transaction(tx_id)
+    restored = Ledger.from_bytes(ledger.to_bytes())
+    restored.apply_block(chain[3])
+    assert restored.utxos.outputs('miner') == [((tx_id, 0), 10),
+                                               ((tx_id, 2), 10),
+                                               ((tx_id, 4), 10)]
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+import blockchain
+from mempool import Mempool
+from storage import FSYNC_NEVER, BlockStore
+
+
+def ids(transactions):
+    return [tx.id for tx in transactions]
+
+
+@pytest.fixture
+def payments(wallets, pay):
+    a, b = wallets
+    return [pay(a, b.public_key, amount, nonce=amount) for amount in range(1, 6)]
+
+
+def test_journal_replays_onto_the_snapshot(tmp_path, payments):
+    store = BlockStore(str(tmp_path), fsync=FSYNC_NEVER)
+    store.save_mempool(payments[:2])
+    store.append_mempool(payments[2:4], [payments[0].id])
+    # Removed and added again since the last save
+    store.append_mempool([payments[0]], [payments[0].id, payments[3].id])
+    assert store.mempool_journal_records() == 6
+
+    reopened = BlockStore(str(tmp_path), fsync=FSYNC_NEVER)
+    assert [tx.id for tx in reopened.load_mempool()] == [
+        payments[1].id, payments[2].id, payments[0].id
+    ]
+    assert reopened.mempool_journal_records() == 6
+
+    reopened.save_mempool(payments[4:])
+    assert not os.path.exists(reopened.mempool_journal_path)
+    assert [tx.id for tx in reopened.load_mempool()] == [payments[4].id]
+
+
+def test_torn_journal_record_is_cut_off(tmp_path, payments):
+    store = BlockStore(str(tmp_path), fsync=FSYNC_NEVER)
+    store.append_mempool(payments[:2], [])
+    with open(store.mempool_journal_path, 'r+b') as f:
+        f.truncate(os.path.getsize(store.mempool_journal_path) - 3)
+    assert [tx.id for tx in store.load_mempool()] == [payments[0].id]
+    store.append_mempool(payments[2:3], [])
+    assert [tx.id for tx in store.load_mempool()] == [
+        payments[0].id, payments[2].id
+    ]
+
+
+def test_chain_appends_changes_to_the_journal(tmp_path, open_chain, wallets,
+                                              genesis, mine, pay,
+                                              monkeypatch):
+    monkeypatch.setattr(blockchain, 'MEMPOOL_JOURNAL_SLACK', 1)
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    block_chain = open_chain()
+    assert block_chain.add_block(chain[1])
+    store = BlockStore(str(tmp_path / 'blockchain_data'))
+    snapshot_size = os.path.getsize(store.mempool_path)
+
+    payments = [pay(a, b.public_key, 1, nonce=nonce) for nonce in range(3)]
+    for payment in payments:
+        assert block_chain.add_transactions([payment]) == [None]
+    assert os.path.getsize(store.mempool_path) == snapshot_size
+    assert ids(open_chain().get_open_transactions()) == ids(payments)
+
+    # Mining removes them all, which outgrows the slack
+    block = block_chain.mine_block()
+    assert ids(block.transactions[:-1]) == ids(payments)
+    assert not os.path.exists(store.mempool_journal_path)
+    assert open_chain().get_open_transactions() == ()
+
+
+def test_full_pool_evicts_the_lowest_ranked(payments):
+    pool = Mempool(max_size=3)
+    # Ranked by amount, then arrival
+    for payment in payments[1:4]:
+        assert pool.add(payment) == []
+    assert pool.add(payments[0]) is None
+    evicted = pool.add(payments[4])
+    assert ids(evicted) == [payments[1].id]
+    assert ids(pool.select(10)) == ids([payments[4], payments[3],
+                                        payments[2]])
+    assert pool.pending_sent(payments[0].sender) == 5 + 4 + 3
+
+
+def test_pool_keeps_its_indexes_on_removal(wallets, pay, payments):
+    a, b = wallets
+    pool = Mempool()
+    spending = pay(a, b.public_key, 1, [('ab' * 32, 0)], nonce=9)
+    for transaction in [spending] + payments[:2]:
+        pool.add(transaction)
+    assert pool.add(payments[0]) is None
+    assert pool.spends_inputs(a.public_key)
+    assert ('ab' * 32, 0) in pool.claimed_outputs()
+
+    pool.remove(spending.id)
+    assert ('ab' * 32, 0) not in pool.claimed_outputs()
+    pool.remove_mined(payments[:2])
+    assert len(pool) == 0
+    assert pool.spends_inputs(a.public_key) is None
+    assert pool.pending_sent(a.public_key) == 0
+    assert pool.select(10) == []
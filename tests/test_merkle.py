@@ -0,0 +1,81 @@
+import hashlib
+
+import pytest
+
+from utils.merkle import (LEFT, RIGHT, merkle_proof, merkle_root,
+                          verify_merkle_proof)
+
+TX_IDS = [hashlib.sha256(bytes([index])).hexdigest() for index in range(7)]
+
+
+def test_root_of_no_transactions():
+    assert merkle_root([]) == hashlib.sha256(b'').hexdigest()
+
+
+@pytest.mark.parametrize('count', range(1, len(TX_IDS) + 1))
+def test_every_transaction_has_a_proof(count):
+    tx_ids = TX_IDS[:count]
+    root = merkle_root(tx_ids)
+    for position, tx_id in enumerate(tx_ids):
+        proof = merkle_proof(tx_ids, position)
+        assert verify_merkle_proof(tx_id, proof, root)
+        # The proof is bound to the transaction and the root
+        other = TX_IDS[(position + 1) % len(TX_IDS)]
+        assert not verify_merkle_proof(other, proof, root)
+        assert not verify_merkle_proof(tx_id, proof, merkle_root(TX_IDS[1:]))
+
+
+def test_odd_node_is_carried_up_unpaired():
+    # Repeating the last transaction would pair it with itself otherwise
+    assert merkle_root(TX_IDS[:3]) != merkle_root(TX_IDS[:3] + TX_IDS[2:3])
+    assert len(merkle_proof(TX_IDS[:3], 2)) == 1
+
+
+def test_inner_node_is_not_a_transaction():
+    root = merkle_root(TX_IDS[:4])
+    left = merkle_proof(TX_IDS[:4], 2)[-1]
+    assert left['side'] == LEFT
+    # The left inner node passed off as a leaf with the right one as sibling
+    right = merkle_proof(TX_IDS[:4], 0)[-1]
+    assert right['side'] == RIGHT
+    assert not verify_merkle_proof(left['hash'], [right], root)
+
+
+@pytest.mark.parametrize('proof', [
+    [{'hash': 'zz', 'side': LEFT}],
+    [{'hash': TX_IDS[0], 'side': 'up'}],
+    [{'side': LEFT}],
+    [None],
+])
+def test_malformed_proofs_are_rejected(proof):
+    assert not verify_merkle_proof(TX_IDS[1], proof, merkle_root(TX_IDS[:2]))
+
+
+def test_position_out_of_range():
+    with pytest.raises(IndexError):
+        merkle_proof(TX_IDS[:2], 2)
+
+
+def test_block_proof_route(client, node, wallets, genesis, mine, pay):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    payment = pay(a, b.public_key, 2, nonce=1)
+    block = mine(chain, [payment], a.public_key)
+    for added in chain[1:]:
+        assert node.block_chain.add_block(added)
+
+    response = client.get(f'/block/2/proof/{payment.id}')
+    assert response.status_code == 200
+    proof = response.get_json()
+    assert proof['position'] == 0
+    assert proof['header']['merkle_root'] == block.merkle_root
+    assert verify_merkle_proof(payment.id, proof['proof'],
+                               proof['merkle_root'])
+    assert client.get(f'/block/{block.hash}/proof/{payment.id}').get_json(
+    ) == proof
+
+    assert client.get(f'/block/1/proof/{payment.id}').status_code == 404
+    assert client.get(f'/block/9/proof/{payment.id}').status_code == 404
+    # The genesis block predates Merkle roots
+    assert client.get(f'/block/0/proof/{payment.id}').status_code == 404
@@ -0,0 +1,69 @@
+import pytest
+
+from utils import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """ An empty registry with metrics enabled, restored after the test """
+    monkeypatch.setattr(metrics, '_registry', [])
+    monkeypatch.setattr(metrics, '_enabled', True)
+    return metrics._registry
+
+
+def test_metrics_render_in_the_text_format(registry):
+    requests = metrics.Counter('requests', 'Requests served', ['path'])
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    height = metrics.Gauge('height', 'Chain height')
+    height.set(7)
+    seconds = metrics.Histogram('seconds', 'Latency', buckets=(1.0, 0.1))
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+    seconds.observe(5)
+
+    assert metrics.render().splitlines() == [
+        '# HELP blockchain_requests Requests served',
+        '# TYPE blockchain_requests counter',
+        'blockchain_requests_total{path="/a\\"b"} 3',
+        '# HELP blockchain_height Chain height',
+        '# TYPE blockchain_height gauge',
+        'blockchain_height 7',
+        '# HELP blockchain_seconds Latency',
+        '# TYPE blockchain_seconds histogram',
+        'blockchain_seconds_bucket{le="0.1"} 1',
+        'blockchain_seconds_bucket{le="1.0"} 2',
+        'blockchain_seconds_bucket{le="+Inf"} 3',
+        'blockchain_seconds_sum 5.55',
+        'blockchain_seconds_count 3',
+    ]
+    with pytest.raises(ValueError):
+        requests.labels('/a', 'GET')
+
+
+def test_disabled_metrics_record_nothing(registry):
+    requests = metrics.Counter('requests', 'Requests served')
+    seconds = metrics.Histogram('seconds', 'Latency')
+    requests.inc()
+    metrics.disable()
+    assert not metrics.enabled()
+    requests.inc()
+    with seconds.time():
+        pass
+    assert 'blockchain_requests_total 1' in metrics.render()
+    assert 'blockchain_seconds_count 0' in metrics.render()
+
+
+def test_metrics_route(client, monkeypatch):
+    monkeypatch.setattr(metrics, '_enabled', True)
+    client.get('/chain')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert 'blockchain_chain_length 1\n' in text
+    assert ('blockchain_http_request_seconds_count{method="GET",'
+            'route="/chain",status="200"}') in text
+
+    metrics.disable()
+    assert client.get('/metrics').status_code == 404
@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict
+
+import pytest
+
+from mempool import Mempool
+from utils.encoding import encode_transaction
+
+
+def ids(transactions):
+    return [tx.id for tx in transactions]
+
+
+@pytest.fixture
+def funded_chain(open_chain, wallets, genesis, mine):
+    """ Returns a function opening the chain with 30 coins for the wallet """
+    chain = [genesis]
+    for _ in range(3):
+        mine(chain, [], wallets[0].public_key)
+
+    def funded_chain(**kwargs):
+        block_chain = open_chain(**kwargs)
+        for block in chain[1:]:
+            assert block_chain.add_block(block)
+        return block_chain
+
+    return funded_chain
+
+
+def test_select_skips_transactions_too_large_for_the_bytes_left(
+        wallets, pay):
+    a, b = wallets
+    large = pay(a, b.public_key, 3, [('ab' * 32, index) for index in range(8)],
+                nonce=1)
+    small = [pay(a, b.public_key, amount, nonce=amount) for amount in (2, 1)]
+    pool = Mempool()
+    for transaction in [large] + small:
+        pool.add(transaction)
+    size = len(encode_transaction(small[0]))
+    assert len(encode_transaction(large)) > 2 * size
+
+    assert ids(pool.select(10, 2 * size)) == ids(small)
+    assert ids(pool.select(1, 2 * size)) == ids(small[:1])
+    assert ids(pool.select(10, size - 1)) == []
+    assert ids(pool.select(10)) == ids([large] + small)
+
+
+def test_block_holds_a_bounded_subset(funded_chain, wallets, pay):
+    a, b = wallets
+    block_chain = funded_chain(max_block_transactions=2)
+    payments = [pay(a, b.public_key, amount, nonce=amount)
+                for amount in (1, 3, 2)]
+    assert block_chain.add_transactions(payments) == [None] * 3
+
+    block = block_chain.mine_block()
+    # The highest amounts are mined first, the rest stays open
+    assert ids(block.transactions[:-1]) == ids([payments[1], payments[2]])
+    assert ids(block_chain.get_open_transactions()) == ids(payments[:1])
+    assert ids(block_chain.mine_block().transactions[:-1]) == ids(
+        payments[:1])
+    assert block_chain.get_open_transactions() == ()
+
+
+def test_block_bytes_are_limited(funded_chain, wallets, pay):
+    a, b = wallets
+    payments = [pay(a, b.public_key, amount, nonce=amount)
+                for amount in (1, 2, 3)]
+    size = len(encode_transaction(payments[0]))
+    block_chain = funded_chain(max_block_bytes=2 * size)
+    assert block_chain.add_transactions(payments) == [None] * 3
+    assert len(block_chain.mine_block().transactions) == 3
+    assert len(block_chain.get_open_transactions()) == 1
+
+
+def test_mine_drains_the_backlog(node, client, wallets, genesis, mine, pay,
+                                 monkeypatch):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    for block in chain[1:]:
+        assert node.block_chain.add_block(block)
+    monkeypatch.setattr(node.block_chain, 'max_block_transactions', 2)
+    payments = [pay(a, b.public_key, 1, nonce=nonce) for nonce in range(5)]
+    assert node.block_chain.add_transactions(payments) == [None] * 5
+
+    response = client.post('/mine?blocks=all&wait=true')
+    assert response.status_code == 201
+    assert len(response.get_json()['mined']) == 3
+    assert node.block_chain.get_open_transactions() == ()
+    assert node.block_chain.chain_length() == 5
+
+    response = client.post('/mine?blocks=2&wait=true')
+    assert len(response.get_json()['mined']) == 2
+    for blocks in ['0', 'many', node.MAX_MINE_BLOCKS + 1]:
+        assert client.post(f'/mine?blocks={blocks}').status_code == 400
+
+
+@pytest.fixture
+def jobs(node, monkeypatch):
+    """ Mining jobs of the node, cancelled once the test is done """
+    jobs = OrderedDict()
+    monkeypatch.setattr(node, 'mining_jobs', jobs)
+    yield jobs
+    for job in jobs.values():
+        job.cancel()
+        job.join(5)
+
+
+def test_mining_job_runs_in_the_background(node, client, jobs):
+    response = client.post('/mine')
+    assert response.status_code == 202
+    job_id = response.get_json()['job']['job_id']
+    assert response.headers['Location'].endswith(f'/mine/{job_id}')
+    jobs[job_id].join(5)
+
+    job = client.get(f'/mine/{job_id}').get_json()
+    assert job['job']['status'] == 'done'
+    assert job['job']['mined'] == [job['block']['hash']]
+    assert node.block_chain.chain_length() == 2
+    assert client.get('/mine/unknown').status_code == 404
+    assert client.delete('/mine/unknown').status_code == 404
+
+
+def test_second_request_joins_the_running_job(node, client, jobs,
+                                              monkeypatch):
+    def mine_block(should_stop=None):
+        # Mines until the job is cancelled
+        while not should_stop():
+            time.sleep(0.01)
+        return None
+
+    monkeypatch.setattr(node.block_chain, 'mine_block', mine_block)
+    job_id = client.post('/mine').get_json()['job']['job_id']
+    assert client.post('/mine?blocks=3').get_json()['job']['job_id'] == job_id
+    assert len(jobs) == 1
+
+    response = client.delete(f'/mine/{job_id}')
+    assert response.status_code == 202
+    jobs[job_id].join(5)
+    assert client.get(f'/mine/{job_id}').get_json()['job'][
+        'status'] == 'cancelled'
+    # The next request starts a new job
+    assert client.post('/mine').get_json()['job']['job_id'] != job_id
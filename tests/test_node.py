@@ -0,0 +1,190 @@
+import pytest
+
+
+@pytest.mark.parametrize('recipient', [5, ['a'], None, {'a': 1}])
+def test_transaction_needs_a_text_recipient(client, recipient):
+    response = client.post('/transaction',
+                           json={
+                               'recipient': recipient,
+                               'amount': 1
+                           })
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid recipient.'
+
+
+@pytest.mark.parametrize('field, value', [('recipient', 5),
+                                          ('recipient', None),
+                                          ('sender', ['a']),
+                                          ('signature', 7),
+                                          ('scheme', ['rsa'])])
+def test_broadcast_transaction_needs_text_fields(client, wallets, pay, field,
+                                                 value):
+    transaction = pay(wallets[0], wallets[1].public_key, 1, nonce=1)
+    values = transaction.to_dict()
+    values[field] = value
+    response = client.post('/broadcast-transaction', json=values)
+    assert response.status_code == 400
+
+
+def test_batch_reports_every_invalid_item(client, wallets, pay):
+    signed = pay(wallets[0], wallets[1].public_key, 1, nonce=1).to_dict()
+    unsigned_to_number = {'recipient': 5, 'amount': 1}
+    signed_to_list = dict(signed, recipient=['a'])
+    signed_by_number = dict(signed, sender=3)
+    response = client.post('/transactions',
+                           json={
+                               'transactions': [
+                                   unsigned_to_number, signed_to_list,
+                                   signed_by_number, {
+                                       'recipient': 'bob',
+                                       'amount': -1
+                                   }, 'not a dict'
+                               ]
+                           })
+    assert response.status_code == 200
+    assert [result['message']
+            for result in response.get_json()['results']] == [
+                'Invalid recipient.', 'Invalid recipient.',
+                'Invalid transaction data.', 'Invalid amount.',
+                'Required data is missing.'
+            ]
+
+
+@pytest.fixture
+def served_chain(node, wallets, genesis, mine, pay):
+    """ The blocks of a chain of four blocks added to the node """
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    for nonce in range(1, 3):
+        mine(chain, [pay(a, b.public_key, 1, nonce=nonce)], a.public_key)
+    for block in chain[1:]:
+        assert node.block_chain.add_block(block)
+    return chain
+
+
+def test_chain_pages_and_etags(client, served_chain):
+    response = client.get('/chain?from_height=1&limit=2')
+    assert [block['hash'] for block in response.get_json()
+            ] == [block.hash for block in served_chain[1:3]]
+    etag = response.headers['ETag']
+    assert client.get('/chain?from_height=1&limit=2',
+                      headers={
+                          'If-None-Match': etag
+                      }).status_code == 304
+    # Another page or format is another response
+    assert client.get('/chain?from_height=2&limit=2',
+                      headers={
+                          'If-None-Match': etag
+                      }).status_code == 200
+    assert client.get('/chain?from_height=1&limit=2&format=ndjson',
+                      headers={
+                          'If-None-Match': etag
+                      }).status_code == 200
+    assert len(client.get('/chain?from_height=3').get_json()) == 1
+
+
+def test_chain_etag_changes_with_the_tip(client, node, served_chain):
+    etag = client.get('/chain').headers['ETag']
+    node.block_chain.mine_block()
+    response = client.get('/chain', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == len(served_chain) + 1
+
+
+def test_block_etag_is_its_hash(client, served_chain):
+    block = served_chain[2]
+    response = client.get('/block/2')
+    assert response.get_json()['hash'] == block.hash
+    assert response.headers['ETag'] == f'"{block.hash}"'
+    for path in ['/block/2', f'/block/{block.hash}']:
+        assert client.get(path, headers={
+            'If-None-Match': f'"{block.hash}"'
+        }).status_code == 304
+    assert client.get('/block/9').status_code == 404
+
+
+def test_open_transactions_page_and_etag(client, node, open_chain, wallets,
+                                         pay, served_chain, monkeypatch):
+    a, b = wallets
+    payments = [pay(a, b.public_key, 1, nonce=nonce) for nonce in (5, 6, 7)]
+    assert node.block_chain.add_transactions(payments) == [None] * 3
+    response = client.get('/transactions?offset=1&limit=1')
+    assert [tx['signature'] for tx in response.get_json()
+            ] == [payments[1].signature]
+    etag = response.headers['ETag']
+
+    # The same open transactions give the same ETag after a restart
+    monkeypatch.setattr(node, 'block_chain', open_chain())
+    assert client.get('/transactions?offset=1&limit=1',
+                      headers={
+                          'If-None-Match': etag
+                      }).status_code == 304
+    node.block_chain.mine_block()
+    response = client.get('/transactions?offset=1&limit=1',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json() == []
+
+
+def test_broadcast_block_syncs_only_from_known_peers(client, node, wallets,
+                                                     genesis, mine,
+                                                     monkeypatch):
+    chain = [genesis]
+    for _ in range(2):
+        mine(chain, [], wallets[1].public_key)
+    synced = []
+    monkeypatch.setattr(node.network, 'start_sync',
+                        lambda block_chain, peer: synced.append(peer))
+    node.network.add_peer('localhost:5001')
+
+    ahead = {'block': chain[2].to_dict()}
+    for peer in ['evil.example:80', ['localhost:5001']]:
+        response = client.post('/broadcast-block', json=dict(ahead, node=peer))
+        assert response.status_code == 400
+    assert client.post('/broadcast-block', json=ahead).status_code == 202
+    assert synced == []
+    response = client.post('/broadcast-block',
+                           json=dict(ahead, node='localhost:5001'))
+    assert response.status_code == 202
+    assert synced == ['localhost:5001']
+
+    # The next block is added without syncing
+    response = client.post('/broadcast-block',
+                           json={
+                               'block': chain[1].to_dict(),
+                               'node': 'evil.example:80'
+                           })
+    assert response.status_code == 201
+    assert node.block_chain.chain_length() == 2
+
+
+@pytest.mark.parametrize('values', [None, {}, {'block': 'x'}, {'block': {}}])
+def test_broadcast_block_needs_a_block(client, values):
+    assert client.post('/broadcast-block', json=values).status_code == 400
+
+
+@pytest.mark.parametrize('path', [
+    '/wallet', '/transaction', '/transactions', '/broadcast-transaction',
+    '/broadcast-transactions', '/broadcast-block', '/node'
+])
+@pytest.mark.parametrize('values', [
+    ['recipient', 'amount', 'transactions', 'block', 'node', 'sender',
+     'signature'], 'recipient amount block node'
+])
+def test_routes_need_a_json_object(client, path, values):
+    response = client.post(path, json=values)
+    assert response.status_code == 400
+    assert client.post(path, data='{', content_type='application/json'
+                       ).status_code == 400
+
+
+@pytest.mark.parametrize('values', [{'scheme': ['rsa']}, {'scheme': 'dsa'}])
+def test_wallet_needs_a_known_scheme(client, values):
+    assert client.post('/wallet', json=values).status_code == 400
+
+
+@pytest.mark.parametrize('peer', ['', 5, ['localhost:5001']])
+def test_node_needs_a_peer_address(client, node, peer):
+    assert client.post('/node', json={'node': peer}).status_code == 400
+    assert node.network.get_peers() == []
@@ -0,0 +1,89 @@
+import pytest
+
+from ledger import Ledger
+from utils.verification import Verification
+
+
+def test_reorg_reverts_the_dropped_blocks(open_chain, wallets, genesis, mine,
+                                          pay, monkeypatch):
+    a, b = wallets
+    chain = [genesis]
+    first = mine(chain, [], a.public_key)
+    fork = list(chain)
+    reward = (first.transactions[-1].id, 0)
+    payment = pay(a, b.public_key, 4, [reward], nonce=1)
+    mine(chain, [], a.public_key)
+    mine(chain, [payment], a.public_key)
+    for _ in range(3):
+        mine(fork, [], b.public_key)
+
+    block_chain = open_chain()
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+    addresses = [a.public_key, b.public_key]
+    assert [block_chain.get_balances(address)
+            for address in addresses] == [26, 4]
+
+    # The balance index must switch by reverting the two dropped blocks
+    # rather than being built again from the fork
+    def rebuild(chain):
+        raise AssertionError('Rebuilt the balance index for a short reorg')
+
+    monkeypatch.setattr(Ledger, 'from_chain', rebuild)
+    assert block_chain.replace_chain(1, fork[2:])
+    monkeypatch.undo()
+
+    assert [block.hash for block in block_chain.get_chain()] == [
+        block.hash for block in fork
+    ]
+    expected = Ledger.from_chain(fork)
+    for address in addresses:
+        outputs = [((output['tx_id'], output['index']), output['amount'])
+                   for output in block_chain.get_unspent_outputs(address)]
+        assert outputs == expected.utxos.outputs(address)
+        assert (sum(amount for _, amount in outputs) == pytest.approx(
+            expected.balance(address)))
+        assert (block_chain.get_history(address)[0] == expected.history_count(
+            address))
+    # The dropped payment is open again and still spends the shared reward
+    assert block_chain.get_open_transactions() == (payment, )
+    assert [block_chain.get_balances(address)
+            for address in addresses] == [6, 30]
+
+
+def test_blocks_replaced_while_verifying_stay_unverified(
+        open_chain, wallets, genesis, mine, monkeypatch):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    fork = list(chain)
+    for _ in range(2):
+        mine(chain, [], a.public_key)
+    for _ in range(3):
+        mine(fork, [], b.public_key)
+    block_chain = open_chain()
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+    # Reopened, nothing is verified yet
+    block_chain = open_chain()
+
+    verify_chain = Verification.verify_chain
+    heights = []
+
+    def verify_and_switch(blocks, from_height=1):
+        # The fork wins while the old chain is being verified
+        heights.append(from_height)
+        if len(heights) == 1:
+            assert block_chain.replace_chain(1, fork[2:])
+        return verify_chain(blocks, from_height)
+
+    monkeypatch.setattr(Verification, 'verify_chain',
+                        staticmethod(verify_and_switch))
+    assert block_chain.verify_chain()
+    assert block_chain.get_last_blockchain_value().hash == fork[-1].hash
+    assert heights == [1, 2]
+    # The blocks verified were replaced, so the chain is verified again
+    assert block_chain.verify_chain()
+    assert heights[-1] == 1
+    assert block_chain.verify_chain()
+    assert heights[-1] == len(fork)
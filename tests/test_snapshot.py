@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from ledger import Ledger
+from snapshot import SnapshotStore
+from storage import FSYNC_NEVER, BlockPrunedError, BlockStore
+
+
+@pytest.fixture
+def chain(wallets, genesis, mine, pay):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    mine(chain, [pay(a, b.public_key, 3, nonce=1)], a.public_key)
+    mine(chain, [pay(b, a.public_key, 1, nonce=2)], b.public_key)
+    mine(chain, [pay(a, b.public_key, 2.5, nonce=3)], a.public_key)
+    return chain
+
+
+def on_chain(chain):
+    return lambda height, block_hash: (height < len(chain)
+                                       and chain[height].hash == block_hash)
+
+
+def test_latest_snapshot_of_the_chain(tmp_path, chain, wallets):
+    store = SnapshotStore(str(tmp_path), keep=2)
+    for height in (1, 2, 4):
+        store.save(height, chain[height].hash, height + 1,
+                   Ledger.from_chain(chain[:height + 1]))
+    assert store.heights() == [4, 2]
+
+    snapshot = store.latest(on_chain(chain))
+    assert snapshot.height == 4
+    assert snapshot.block_hash == chain[4].hash
+    assert snapshot.verified_height == 5
+    assert (snapshot.ledger.to_bytes() ==
+            Ledger.from_chain(chain).to_bytes())
+
+    # A snapshot of a block no longer on the chain is skipped
+    assert store.latest(on_chain(chain[:4])).height == 2
+
+
+def test_corrupt_snapshot_falls_back_to_an_older_one(tmp_path, chain):
+    store = SnapshotStore(str(tmp_path))
+    for height in (2, 4):
+        store.save(height, chain[height].hash, height + 1,
+                   Ledger.from_chain(chain[:height + 1]))
+    with open(store.path(4), 'r+b') as f:
+        f.seek(-1, 2)
+        last = f.read(1)
+        f.seek(-1, 2)
+        f.write(bytes([last[0] ^ 1]))
+    assert store.latest(on_chain(chain)).height == 2
+
+
+def test_restart_restores_the_snapshot(open_chain, chain, wallets,
+                                       monkeypatch):
+    block_chain = open_chain(snapshot_interval=3)
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+    addresses = [wallet.public_key for wallet in wallets]
+    balances = [block_chain.get_balances(address) for address in addresses]
+
+    def from_chain(chain):
+        raise AssertionError('Walked the chain instead of the snapshot')
+
+    monkeypatch.setattr(Ledger, 'from_chain', from_chain)
+    restarted = open_chain(snapshot_interval=3)
+    assert [restarted.get_balances(address)
+            for address in addresses] == balances
+    assert (restarted.get_history(addresses[1]) ==
+            block_chain.get_history(addresses[1]))
+
+
+@pytest.mark.parametrize('snapshot_interval', [3, 1000])
+def test_restart_rejects_mined_transactions(open_chain, chain,
+                                            snapshot_interval):
+    block_chain = open_chain(snapshot_interval=snapshot_interval)
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+
+    restarted = open_chain(snapshot_interval=snapshot_interval)
+    for block in chain[2:]:
+        assert restarted.add_transactions(block.transactions[:-1],
+                                          is_receiving=True) == [
+                                              'Duplicate transaction'
+                                          ]
+    assert restarted.get_open_transactions() == ()
+
+
+def prune_chain(tmp_path, open_chain, chain, snapshot_heights):
+    """
+    Stores the chain pruned below its tip with snapshots at the given
+    heights only
+    """
+    block_chain = open_chain(segment_size=2)
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+    directory = str(tmp_path / 'blockchain_data')
+    assert BlockStore(directory, 2, FSYNC_NEVER).prune(len(chain) - 1) == 4
+    snapshots = SnapshotStore(os.path.join(directory, 'snapshots'))
+    for height in snapshot_heights:
+        snapshots.save(height, chain[height].hash, height + 1,
+                       Ledger.from_chain(chain[:height + 1]))
+
+
+@pytest.mark.parametrize('snapshot_heights', [(), (1, )])
+def test_pruned_chain_without_a_usable_snapshot_must_resync(
+        tmp_path, open_chain, chain, snapshot_heights):
+    # A snapshot below the pruned blocks can't be replayed up to the tip
+    prune_chain(tmp_path, open_chain, chain, snapshot_heights)
+    with pytest.raises(BlockPrunedError, match='must resync'):
+        open_chain(segment_size=2)
+
+
+def test_pruned_chain_restarts_from_a_snapshot(tmp_path, open_chain, chain,
+                                               wallets):
+    prune_chain(tmp_path, open_chain, chain, (3, ))
+    block_chain = open_chain(segment_size=2)
+    expected = Ledger.from_chain(chain)
+    for wallet in wallets:
+        assert (block_chain.get_balances(wallet.public_key) ==
+                expected.balance(wallet.public_key))
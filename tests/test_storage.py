@@ -0,0 +1,119 @@
+import os
+import json
+
+import pytest
+
+from storage import FSYNC_NEVER, INDEX_ENTRY, BlockStore
+
+
+@pytest.fixture
+def chain(wallets, genesis, mine, pay):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    for nonce in range(1, 5):
+        mine(chain, [pay(a, b.public_key, nonce, nonce=nonce)], a.public_key)
+    return chain
+
+
+def open_store(tmp_path):
+    return BlockStore(str(tmp_path), segment_size=2, fsync=FSYNC_NEVER)
+
+
+def hashes(blocks):
+    return [block.hash for block in blocks]
+
+
+def test_blocks_round_trip_across_segments(tmp_path, chain):
+    store = open_store(tmp_path)
+    store.append_blocks(chain[:3])
+    store.append_blocks(chain[3:])
+    assert store.segments() == [0, 1, 2]
+
+    store = open_store(tmp_path)
+    assert store.block_count() == len(chain)
+    assert hashes(store.iter_blocks()) == hashes(chain)
+    assert hashes(store.iter_blocks(2, 4)) == hashes(chain[2:4])
+    assert store.get_header(3).hash == chain[3].hash
+    header, transaction = store.get_transaction(4, 1)
+    assert header.hash == chain[4].hash
+    assert transaction.id == chain[4].transactions[1].id
+    for height, block in enumerate(chain):
+        assert store.height_of(block.hash) == height
+    assert store.height_of('00' * 32) is None
+
+
+def test_torn_record_at_the_end_is_cut_off(tmp_path, chain):
+    store = open_store(tmp_path)
+    store.append_blocks(chain[:5])
+    path = store.segment_path(2)
+    size = os.path.getsize(path)
+    # A crash in the middle of appending the next block
+    store.append_blocks(chain[5:])
+    with open(path, 'r+b') as f:
+        f.truncate(size + 10)
+
+    store = open_store(tmp_path)
+    assert store.block_count() == 5
+    assert os.path.getsize(path) == size
+    store.append_blocks(chain[5:])
+    assert hashes(open_store(tmp_path).iter_blocks()) == hashes(chain)
+
+
+def test_corrupt_record_in_an_older_segment_is_an_error(tmp_path, chain):
+    store = open_store(tmp_path)
+    store.append_blocks(chain)
+    # Unindexed records are read back from the log on the next start
+    os.remove(store.index_path)
+    with open(store.segment_path(0), 'r+b') as f:
+        f.seek(-1, 2)
+        last = f.read(1)
+        f.seek(-1, 2)
+        f.write(bytes([last[0] ^ 1]))
+    with pytest.raises(IOError):
+        open_store(tmp_path)
+
+
+def test_index_is_reconciled_with_the_log(tmp_path, chain):
+    store = open_store(tmp_path)
+    store.append_blocks(chain)
+
+    # Records written after the last index write are indexed
+    with open(store.index_path, 'r+b') as f:
+        f.truncate(2 * INDEX_ENTRY.size)
+    store = open_store(tmp_path)
+    assert store.block_count() == len(chain)
+    assert hashes(store.iter_blocks()) == hashes(chain)
+    assert store.height_of(chain[-1].hash) == len(chain) - 1
+
+    # Entries of records lost from the log are dropped
+    os.remove(store.segment_path(2))
+    store = open_store(tmp_path)
+    assert store.block_count() == 4
+    assert os.path.getsize(store.index_path) == 4 * INDEX_ENTRY.size
+    assert store.height_of(chain[4].hash) is None
+
+
+def test_truncate_drops_the_blocks_of_a_fork(tmp_path, chain):
+    store = open_store(tmp_path)
+    store.append_blocks(chain)
+    store.truncate(3)
+    assert store.segments() == [0, 1]
+    store.append_blocks(chain[3:4])
+    store = open_store(tmp_path)
+    assert hashes(store.iter_blocks()) == hashes(chain[:4])
+
+
+def test_legacy_file_is_migrated(tmp_path, chain, wallets, pay):
+    path = str(tmp_path / 'blockchain_data.txt')
+    payment = pay(wallets[0], wallets[1].public_key, 1, nonce=9)
+    with open(path, 'w') as f:
+        f.write(json.dumps([block.to_dict() for block in chain]) + '\n')
+        f.write(json.dumps([payment.to_dict()]))
+
+    store = open_store(tmp_path / 'data')
+    assert store.migrate_legacy(path)
+    assert not store.migrate_legacy(path)
+    assert os.path.exists(path + '.migrated')
+    assert hashes(store.iter_blocks()) == hashes(chain)
+    assert [tx.id for tx in store.load_mempool()] == [payment.id]
@@ -0,0 +1,58 @@
+import pytest
+
+from transaction import Transaction
+from wallet import Wallet
+
+
+def upper_case(transaction, field):
+    values = transaction.to_dict()
+    values[field] = values[field].upper()
+    return Transaction(values['sender'], values['recipient'],
+                       values['signature'], values['amount'],
+                       values['scheme'], values['inputs'], values['nonce'])
+
+
+@pytest.mark.parametrize('field', ['signature', 'sender'])
+def test_upper_case_hex_is_rejected(wallets, pay, field):
+    a, b = wallets
+    payment = pay(a, b.public_key, 5, nonce=1)
+    assert Wallet.verify_transaction_signature(payment)
+    copy = upper_case(payment, field)
+    assert copy.id != payment.id
+    assert not Wallet.verify_transaction_signature(copy)
+    with pytest.raises(ValueError):
+        Transaction.from_dict(copy.to_dict())
+
+
+def test_mined_payment_is_not_mined_again_in_upper_case(
+        open_chain, wallets, genesis, mine, pay):
+    a, b = wallets
+    chain = [genesis]
+    mine(chain, [], a.public_key)
+    payment = pay(a, b.public_key, 5, nonce=1)
+    mine(chain, [payment], a.public_key)
+    block_chain = open_chain()
+    for block in chain[1:]:
+        assert block_chain.add_block(block)
+
+    copy = upper_case(payment, 'signature')
+    assert block_chain.add_transactions([copy],
+                                        is_receiving=True) == [
+                                            'Invalid signature'
+                                        ]
+    assert not block_chain.add_block(mine(list(chain), [copy], a.public_key))
+    assert block_chain.get_balances(b.public_key) == 5
+
+
+@pytest.mark.parametrize('field, value', [('sender', None),
+                                          ('recipient', 5),
+                                          ('recipient', ['a']),
+                                          ('signature', b'ab'),
+                                          ('scheme', 'dsa'),
+                                          ('scheme', ['rsa'])])
+def test_from_dict_rejects_fields_the_encoding_cant_hold(
+        wallets, pay, field, value):
+    values = pay(wallets[0], wallets[1].public_key, 1, nonce=1).to_dict()
+    values[field] = value
+    with pytest.raises(ValueError):
+        Transaction.from_dict(values)
@@ -0,0 +1,48 @@
+import time
+
+from block import Block
+from transaction import Transaction
+from utils.encoding import BLOCK_VERSION_JSON
+from utils.verification import MAX_FUTURE_BLOCK_TIME, Verification
+
+
+def legacy_chain(genesis, miner, length, timestamp=1600000000.0):
+    """
+    Returns a chain of BLOCK_VERSION_JSON blocks with the same timestamp,
+    as the original code mined them in one process
+    """
+    chain = [genesis]
+    for index in range(1, length):
+        proof = miner.mine([], chain[-1].hash, version=BLOCK_VERSION_JSON)
+        reward = Transaction('MINING', 'miner', '', 10)
+        chain.append(
+            Block(index, chain[-1].hash, [reward], proof, timestamp,
+                  version=BLOCK_VERSION_JSON))
+    return chain
+
+
+def test_legacy_blocks_may_share_a_timestamp(genesis, miner, mine):
+    chain = legacy_chain(genesis, miner, 4)
+    assert Verification.verify_chain(chain)
+    mine(chain, [], 'miner')
+    assert Verification.verify_chain(chain)
+
+
+def test_newer_blocks_must_be_after_the_previous_block(genesis, miner, mine):
+    chain = legacy_chain(genesis, miner, 3)
+    mine(chain, [], 'miner', timestamp=chain[-1].timestamp)
+    assert not Verification.verify_chain(chain)
+
+    chain = legacy_chain(genesis, miner, 3)
+    mine(chain, [], 'miner')
+    mine(chain, [], 'miner', timestamp=chain[-1].timestamp)
+    assert not Verification.verify_chain(chain)
+
+
+def test_blocks_far_in_the_future_are_rejected(genesis, miner, mine):
+    future = time.time() + MAX_FUTURE_BLOCK_TIME + 60
+    assert not Verification.verify_chain(
+        legacy_chain(genesis, miner, 2, future))
+    chain = [genesis]
+    mine(chain, [], 'miner', timestamp=future)
+    assert not Verification.verify_chain(chain)
@@ -1,17 +1,136 @@
+import math
 import logging
+import secrets
 from collections import OrderedDict
+from utils.encoding import SCHEME_CODES, SCHEME_RSA, is_canonical_hex
+from utils.hash_utils import hash_transaction
 from utils.printable import Printable
 
 logger = logging.getLogger(__name__)
 
+# Nonces are unsigned 64 bit integers, see utils.encoding
+NONCE_BITS = 64
+
+
+def new_nonce():
+    """ Returns a random nonce for a new transaction """
+    return secrets.randbits(NONCE_BITS)
+
+
+def parse_nonce(nonce):
+    """
+    Returns the nonce of a transaction sent by a client or peer (None for
+    transactions signed before there were nonces), raising ValueError if it
+    isn't one
+    """
+    if nonce is not None and (type(nonce) is not int
+                              or not 0 <= nonce < 2**NONCE_BITS):
+        raise ValueError(f'Invalid nonce {nonce}')
+    return nonce
+
+
+def valid_amount(amount):
+    """
+    Returns whether an amount can be sent: a positive int or float (not a
+    bool) the encoding can hold
+    """
+    if type(amount) is int:
+        return 0 < amount < 2**63
+    return type(amount) is float and 0 < amount < math.inf
+
+
+def parse_amount(amount):
+    """
+    Returns the amount of a transaction sent by a client or peer, raising
+    ValueError if it isn't valid_amount
+    """
+    if not valid_amount(amount):
+        raise ValueError(f'Invalid amount {amount!r}')
+    return amount
+
+
+def parse_text(text):
+    """
+    Returns a text field of a transaction sent by a client or peer, raising
+    ValueError if it isn't a string, which the encoding can't hold
+    """
+    if not isinstance(text, str):
+        raise ValueError(f'Invalid text {text!r}')
+    return text
+
+
+def parse_hex_text(text):
+    """
+    Returns the sender or signature of a transaction sent by a client or
+    peer, raising ValueError if it isn't a string or is hex not in lower
+    case: it would verify as the lower case hex but give the transaction
+    another id
+    """
+    if (not is_canonical_hex(parse_text(text))
+            and is_canonical_hex(text.lower())):
+        raise ValueError(f'Hex text {text} is not in lower case')
+    return text
+
+
+def parse_scheme(scheme):
+    """
+    Returns the signature scheme of a transaction sent by a client or peer,
+    raising ValueError if it isn't one the encoding knows
+    """
+    if scheme != SCHEME_RSA and (not isinstance(scheme, str)
+                                 or scheme not in SCHEME_CODES):
+        raise ValueError(f'Unknown signature scheme {scheme!r}')
+    return scheme
+
+
+def parse_outpoint(outpoint):
+    """
+    Returns the (transaction id, output index) of an output named by a
+    client or peer, raising ValueError if it doesn't name one
+    """
+    tx_id, index = outpoint
+    if (not isinstance(tx_id, str) or len(tx_id) != 64
+            or tx_id != tx_id.lower() or type(index) is not int
+            or not 0 <= index < 2**32):
+        raise ValueError(f'Invalid output {outpoint}')
+    bytes.fromhex(tx_id)
+    return tx_id, index
+
 
 class Transaction(Printable):
-    def __init__(self, sender, recipient, signature, amount):
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', 'scheme',
+                 'inputs', 'nonce', '_id')
+
+    def __init__(self,
+                 sender,
+                 recipient,
+                 signature,
+                 amount,
+                 scheme=SCHEME_RSA,
+                 inputs=(),
+                 nonce=None):
         self.sender = sender
         self.recipient = recipient
         self.amount = amount
         self.signature = signature
-        logger.info('Initializing transaction: {}'.format(self.__dict__))
+        # Signature scheme of the sender's key, see wallet
+        self.scheme = scheme
+        # (transaction id, output index) of the outputs of the sender the
+        # transaction spends. Without inputs it spends from the balance of
+        # the sender, see utxo.
+        self.inputs = tuple((tx_id, index) for tx_id, index in inputs)
+        # Signed number which makes the id of a payment repeated on purpose
+        # (or of a mining reward, see blockchain) differ from the first.
+        # None for transactions signed before there were nonces.
+        self.nonce = nonce
+        self._id = None
+
+    @property
+    def id(self):
+        """ Hash identifying the transaction, signature included """
+        if self._id is None:
+            self._id = hash_transaction(self)
+        return self._id
 
     def to_ordered_dict(self):
         """
@@ -20,3 +139,30 @@ class Transaction(Printable):
         return OrderedDict([('sender', self.sender),
                             ('recipient', self.recipient),
                             ('amount', self.amount)])
+
+    def to_dict(self):
+        """ Returns the transaction (including its signature) as a dict """
+        return {
+            'sender': self.sender,
+            'recipient': self.recipient,
+            'amount': self.amount,
+            'signature': self.signature,
+            'scheme': self.scheme,
+            'inputs': [list(outpoint) for outpoint in self.inputs],
+            'nonce': self.nonce
+        }
+
+    @classmethod
+    def from_dict(cls, tx):
+        """
+        Builds a transaction from the dict produced by to_dict. Dicts
+        without a scheme come from before there were other schemes than RSA,
+        dicts without inputs from before transactions could name them and
+        dicts without a nonce from before there were nonces.
+        """
+        inputs = [parse_outpoint(output) for output in tx.get('inputs', ())]
+        return cls(parse_hex_text(tx['sender']), parse_text(tx['recipient']),
+                   parse_hex_text(tx['signature']),
+                   parse_amount(tx['amount']),
+                   parse_scheme(tx.get('scheme', SCHEME_RSA)), inputs,
+                   parse_nonce(tx.get('nonce')))
@@ -0,0 +1,346 @@
+"""
+Versioned binary canonical encoding of blocks and transactions, shared by
+hashing, persistence and network transfer.
+
+All integers are big-endian. Fields are written in a fixed order:
+
+    transaction := [u8 SCHEME_TAG | u8 scheme]
+                   [u8 INPUTS_TAG | u32 count | outpoint*]
+                   [u8 NONCE_TAG | u64 nonce]
+                   text sender | text recipient | number amount
+                   | text signature
+                   (the scheme is left out for RSA, the scheme of every
+                   transaction signed before there were others, the
+                   inputs for transactions spending from the balance and
+                   the nonce for transactions signed before there were
+                   nonces; texts start with their kind, which is never a
+                   tag)
+    outpoint    := bytes32 transaction id | u32 output index
+    block       := u8 ENCODING_VERSION | u8 block version | u64 index
+                   | text previous_hash | number proof | number timestamp
+                   | optional u16 difficulty | [bytes32 merkle_root]
+                   | u32 count | transaction*
+                   (the merkle root is only stored from BLOCK_VERSION_MERKLE)
+    header      := u8 ENCODING_VERSION | u8 block version | u64 index
+                   | text previous_hash | bytes32 merkle_root
+                   | number timestamp | optional u16 difficulty
+                   | proof as decimal ASCII
+                   (hashed as the block hash and proof of work of
+                   BLOCK_VERSION_MERKLE blocks, never stored)
+    text        := u8 kind | u32 length | bytes
+                   (kind HEX stores hex strings such as keys, signatures and
+                   hashes as their raw bytes, kind UTF8 anything else)
+    number      := b'i' i64 | b'f' f64
+                   (ints and floats are kept apart, as they hash differently
+                   in the legacy JSON hashing and in signatures)
+    optional    := u8 0 | u8 1 value
+"""
+import struct
+import binascii
+
+ENCODING_VERSION = 1
+
+# Block versions select how a block is hashed and how its proof is checked:
+# blocks of BLOCK_VERSION_JSON (everything mined before this encoding
+# existed) hash their JSON form, BLOCK_VERSION_BINARY blocks hash this
+# encoding directly. BLOCK_VERSION_MERKLE blocks hash only their compact
+# header, which commits to the transactions through their Merkle root, and
+# the proof of work is the header hash itself. BLOCK_VERSION_UNIQUE_IDS
+# blocks are encoded and hashed as BLOCK_VERSION_MERKLE ones, but can't hold
+# a transaction id already on the chain and their reward commits to the
+# height (see blockchain).
+BLOCK_VERSION_JSON = 1
+BLOCK_VERSION_BINARY = 2
+BLOCK_VERSION_MERKLE = 3
+BLOCK_VERSION_UNIQUE_IDS = 4
+BLOCK_VERSION = BLOCK_VERSION_UNIQUE_IDS
+
+TEXT_UTF8 = 0
+TEXT_HEX = 1
+
+# Signature schemes of transactions and their codes in the encoding
+SCHEME_RSA = 'rsa'
+SCHEME_ED25519 = 'ed25519'
+SCHEME_ECDSA = 'ecdsa'
+SCHEME_TAG = 0xff
+SCHEME_CODES = {SCHEME_ED25519: 1, SCHEME_ECDSA: 2}
+SCHEMES_BY_CODE = {code: scheme for scheme, code in SCHEME_CODES.items()}
+# Precedes the outputs a transaction spends, see utxo
+INPUTS_TAG = 0xfe
+# Precedes the nonce which tells apart transactions that are otherwise the
+# same, such as a payment repeated on purpose
+NONCE_TAG = 0xfd
+
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+_TEXT_HEADER = struct.Struct('>BI')
+
+
+def is_canonical_hex(text):
+    """
+    Returns whether the text is hex as hexlify writes it: lower case and of
+    even length. Only such text is stored as raw bytes, and only such keys
+    and signatures are accepted, so a transaction has a single id.
+    """
+    if not isinstance(text, str) or not text or len(text) % 2:
+        return False
+    try:
+        return binascii.hexlify(binascii.unhexlify(text)).decode() == text
+    except (binascii.Error, ValueError):
+        return False
+
+
+def encode_text(text):
+    if is_canonical_hex(text):
+        raw = binascii.unhexlify(text)
+        return _TEXT_HEADER.pack(TEXT_HEX, len(raw)) + raw
+    raw = text.encode('utf8')
+    return _TEXT_HEADER.pack(TEXT_UTF8, len(raw)) + raw
+
+
+def encode_number(number):
+    if isinstance(number, int):
+        return b'i' + _I64.pack(number)
+    return b'f' + _F64.pack(number)
+
+
+def encode_scheme(scheme):
+    if scheme == SCHEME_RSA:
+        return b''
+    if scheme not in SCHEME_CODES:
+        raise ValueError(f'Unknown signature scheme {scheme}')
+    return _U8.pack(SCHEME_TAG) + _U8.pack(SCHEME_CODES[scheme])
+
+
+def encode_inputs(inputs):
+    if not inputs:
+        return b''
+    parts = [_U8.pack(INPUTS_TAG), _U32.pack(len(inputs))]
+    for tx_id, index in inputs:
+        raw = binascii.unhexlify(tx_id)
+        if len(raw) != 32:
+            raise ValueError(f'Invalid transaction id {tx_id}')
+        parts.append(raw + _U32.pack(index))
+    return b''.join(parts)
+
+
+def encode_nonce(nonce):
+    if nonce is None:
+        return b''
+    return _U8.pack(NONCE_TAG) + _U64.pack(nonce)
+
+
+def encode_transaction(transaction):
+    return b''.join((encode_scheme(transaction.scheme),
+                     encode_inputs(transaction.inputs),
+                     encode_nonce(transaction.nonce),
+                     encode_text(transaction.sender),
+                     encode_text(transaction.recipient),
+                     encode_number(transaction.amount),
+                     encode_text(transaction.signature)))
+
+
+def encode_transactions(transactions):
+    return _U32.pack(len(transactions)) + b''.join(
+        encode_transaction(tx) for tx in transactions)
+
+
+def encode_difficulty(difficulty):
+    if difficulty is None:
+        return _U8.pack(0)
+    return _U8.pack(1) + _U16.pack(difficulty)
+
+
+def encode_block(block):
+    merkle_root = b''
+    if block.version >= BLOCK_VERSION_MERKLE:
+        merkle_root = binascii.unhexlify(block.merkle_root)
+    return b''.join((_U8.pack(ENCODING_VERSION), _U8.pack(block.version),
+                     _U64.pack(block.index),
+                     encode_text(block.previous_hash),
+                     encode_number(block.proof),
+                     encode_number(block.timestamp),
+                     encode_difficulty(block.difficulty), merkle_root,
+                     encode_transactions(block.transactions)))
+
+
+def encode_header_prefix(header):
+    """
+    Returns the encoded header without its proof: the bytes miners hash
+    once and extend with every guessed proof
+    """
+    return b''.join((_U8.pack(ENCODING_VERSION), _U8.pack(header.version),
+                     _U64.pack(header.index),
+                     encode_text(header.previous_hash),
+                     binascii.unhexlify(header.merkle_root),
+                     encode_number(header.timestamp),
+                     encode_difficulty(header.difficulty)))
+
+
+def encode_header(header):
+    """ Returns the encoded header of a BLOCK_VERSION_MERKLE block """
+    return encode_header_prefix(header) + str(header.proof).encode()
+
+
+class Decoder:
+    """ Reads the fields of the encoding back from a bytes-like buffer """
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def __unpack(self, fmt):
+        value, = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return value
+
+    def text(self):
+        kind, length = _TEXT_HEADER.unpack_from(self.data, self.offset)
+        start = self.offset + _TEXT_HEADER.size
+        raw = bytes(self.data[start:start + length])
+        if len(raw) != length:
+            raise ValueError('Truncated encoding')
+        self.offset = start + length
+        if kind == TEXT_HEX:
+            return binascii.hexlify(raw).decode('ascii')
+        return raw.decode('utf8')
+
+    def number(self):
+        tag = self.data[self.offset]
+        self.offset += 1
+        if tag == 0x69:  # b'i'
+            return self.__unpack(_I64)
+        if tag == 0x66:  # b'f'
+            return self.__unpack(_F64)
+        raise ValueError(f'Unknown number tag {tag}')
+
+    def transaction(self):
+        """
+        Returns (sender, recipient, signature, amount, scheme, inputs,
+        nonce)
+        """
+        scheme = self.scheme()
+        inputs = self.inputs()
+        nonce = self.nonce()
+        sender = self.text()
+        recipient = self.text()
+        amount = self.number()
+        signature = self.text()
+        return sender, recipient, signature, amount, scheme, inputs, nonce
+
+    def skip_text(self):
+        _, length = _TEXT_HEADER.unpack_from(self.data, self.offset)
+        self.offset += _TEXT_HEADER.size + length
+
+    def scheme(self):
+        if self.data[self.offset] != SCHEME_TAG:
+            return SCHEME_RSA
+        code = self.data[self.offset + 1]
+        self.offset += 2
+        if code not in SCHEMES_BY_CODE:
+            raise ValueError(f'Unknown signature scheme code {code}')
+        return SCHEMES_BY_CODE[code]
+
+    def inputs(self):
+        """ Returns the (transaction id, output index) a transaction spends """
+        if self.data[self.offset] != INPUTS_TAG:
+            return ()
+        self.offset += 1
+        count = self.__unpack(_U32)
+        inputs = []
+        for _ in range(count):
+            raw = bytes(self.data[self.offset:self.offset + 32])
+            if len(raw) != 32:
+                raise ValueError('Truncated encoding')
+            self.offset += 32
+            inputs.append((binascii.hexlify(raw).decode('ascii'),
+                           self.__unpack(_U32)))
+        return tuple(inputs)
+
+    def nonce(self):
+        """ Returns the nonce of a transaction, None if it has none """
+        if self.data[self.offset] != NONCE_TAG:
+            return None
+        self.offset += 1
+        return self.__unpack(_U64)
+
+    def skip_transaction(self):
+        """ Moves past a transaction without decoding it """
+        self.scheme()
+        if self.data[self.offset] == INPUTS_TAG:
+            self.offset += 1
+            count = self.__unpack(_U32)
+            self.offset += count * (32 + _U32.size)
+        self.nonce()
+        self.skip_text()
+        self.skip_text()
+        # A number is its tag followed by 8 bytes
+        self.offset += 9
+        self.skip_text()
+
+    def transactions(self):
+        return [self.transaction() for _ in range(self.__unpack(_U32))]
+
+    def header(self):
+        """
+        Returns (index, previous_hash, proof, timestamp, difficulty,
+        version, merkle_root, transaction_count) of an encoded block
+        without decoding its transactions. The merkle root is None for
+        blocks older than BLOCK_VERSION_MERKLE.
+        """
+        encoding_version = self.__unpack(_U8)
+        if encoding_version != ENCODING_VERSION:
+            raise ValueError(
+                f'Unsupported block encoding version {encoding_version}')
+        version = self.__unpack(_U8)
+        index = self.__unpack(_U64)
+        previous_hash = self.text()
+        proof = self.number()
+        timestamp = self.number()
+        difficulty = self.__unpack(_U16) if self.__unpack(_U8) else None
+        merkle_root = None
+        if version >= BLOCK_VERSION_MERKLE:
+            raw = bytes(self.data[self.offset:self.offset + 32])
+            if len(raw) != 32:
+                raise ValueError('Truncated encoding')
+            self.offset += 32
+            merkle_root = binascii.hexlify(raw).decode('ascii')
+        transaction_count = self.__unpack(_U32)
+        return (index, previous_hash, proof, timestamp, difficulty, version,
+                merkle_root, transaction_count)
+
+    def block(self):
+        """
+        Returns (index, previous_hash, transactions, proof, timestamp,
+        difficulty, version, merkle_root) with the transactions as tuples
+        in the order of the Transaction constructor
+        """
+        (index, previous_hash, proof, timestamp, difficulty, version,
+         merkle_root, count) = self.header()
+        transactions = [self.transaction() for _ in range(count)]
+        return (index, previous_hash, transactions, proof, timestamp,
+                difficulty, version, merkle_root)
+
+
+def encode_chain(blocks):
+    """ Encodes a list of blocks as a count followed by sized records """
+    parts = [_U32.pack(len(blocks))]
+    for block in blocks:
+        encoded = encode_block(block)
+        parts.append(_U32.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def iter_chain(data):
+    """ Yields the encoded blocks of a buffer produced by encode_chain """
+    count, = _U32.unpack_from(data, 0)
+    offset = _U32.size
+    for _ in range(count):
+        length, = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        yield data[offset:offset + length]
+        offset += length
@@ -2,6 +2,9 @@ import json
 import logging
 import hashlib
 
+from utils.encoding import (BLOCK_VERSION_JSON, BLOCK_VERSION_MERKLE,
+                            encode_block, encode_header, encode_transaction)
+
 logger = logging.getLogger(__name__)
 
 
@@ -9,15 +12,34 @@ def hash_string_sha256(sstring):
     return hashlib.sha256(sstring).hexdigest()
 
 
+def hash_transaction(transaction):
+    """ Returns the id of the transaction, the hash of its encoding """
+    return hash_string_sha256(encode_transaction(transaction))
+
+
+def hash_header(header):
+    """ Returns the hash of the header of a BLOCK_VERSION_MERKLE block """
+    return hash_string_sha256(encode_header(header))
+
+
 def hash_block(block):
     """ Returns the hash of the block """
-    logger.info("Computing hash of the block")
-    hashable_block = block.__dict__.copy()  # Create a copy as it would
-    # otherwise change the prev dict while hashing
+    if block.version >= BLOCK_VERSION_MERKLE:
+        return hash_header(block)
+    if block.version != BLOCK_VERSION_JSON:
+        return hash_string_sha256(encode_block(block))
+
     # Convert transaction objects within a block to dictionaries as well
-    hashable_block['transactions'] = [
-        tx.to_ordered_dict() for tx in hashable_block['transactions']
-    ]
+    hashable_block = {
+        'index': block.index,
+        'previous_hash': block.previous_hash,
+        'transactions': [tx.to_ordered_dict() for tx in block.transactions],
+        'proof': block.proof,
+        'timestamp': block.timestamp
+    }
+    # Blocks without a recorded difficulty keep the hash they were mined with
+    if block.difficulty is not None:
+        hashable_block['difficulty'] = block.difficulty
 
     return hash_string_sha256(
         json.dumps(hashable_block, sort_keys=True).encode())
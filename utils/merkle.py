@@ -0,0 +1,97 @@
+"""
+Merkle trees over the transaction ids of a block.
+
+Leaves and inner nodes are hashed with different prefixes, so an inner
+node can never be passed off as a transaction. A node without a sibling
+is carried up to the next level unchanged instead of being paired with
+itself, so no two different lists of transactions share a root.
+"""
+import hashlib
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+LEFT = 'left'
+RIGHT = 'right'
+
+
+def _leaf(tx_id):
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(tx_id)).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _next_level(level):
+    paired = [
+        _node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)
+    ]
+    if len(level) % 2:
+        paired.append(level[-1])
+    return paired
+
+
+def merkle_root(tx_ids):
+    """
+    Returns the Merkle root (as hex) of the transaction ids, in order. The
+    root of no transactions is the hash of the empty string.
+    """
+    if not tx_ids:
+        return hashlib.sha256(b'').hexdigest()
+    level = [_leaf(tx_id) for tx_id in tx_ids]
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(tx_ids, position):
+    """
+    Returns the inclusion proof of the transaction at the given position
+
+    Parameters
+    ----------
+        tx_ids (list): Transaction ids of the block, in order
+        position (integer): Position of the transaction in the block
+
+    Returns
+    -------
+        proof (list): Sibling hashes from the leaf up to the root as dicts
+                      {'hash': hex, 'side': LEFT or RIGHT}
+    """
+    if not 0 <= position < len(tx_ids):
+        raise IndexError('Transaction position out of range')
+    proof = []
+    level = [_leaf(tx_id) for tx_id in tx_ids]
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({
+                'hash': level[sibling].hex(),
+                'side': LEFT if sibling < position else RIGHT
+            })
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_merkle_proof(tx_id, proof, root):
+    """
+    Checks an inclusion proof produced by merkle_proof
+
+    Returns
+    -------
+        True (Boolean): If the proof links the transaction id to the root
+    """
+    try:
+        current = _leaf(tx_id)
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            if step['side'] == LEFT:
+                current = _node(sibling, current)
+            elif step['side'] == RIGHT:
+                current = _node(current, sibling)
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return current.hex() == root
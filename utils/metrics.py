@@ -0,0 +1,240 @@
+import os
+import time
+import bisect
+import threading
+
+# Metrics are collected unless the node is started with BLOCKCHAIN_METRICS=0
+# or disable() is called. Disabled metrics record nothing and cost a flag
+# check.
+_enabled = os.environ.get('BLOCKCHAIN_METRICS', '1') != '0'
+# Prefix of the exposed metric names
+NAMESPACE = 'blockchain'
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Every metric created, in the order they are rendered
+_registry = []
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """ Stops recording; values recorded so far are kept """
+    global _enabled
+    _enabled = False
+
+
+class _Timer:
+    """ Observes the seconds spent in a with block """
+    __slots__ = ('_values', '_start')
+
+    def __init__(self, values):
+        self._values = values
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._values.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Metric:
+    """
+    A named metric with optional labels. Values are kept per combination of
+    label values; a metric without labels records into its only child.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = f'{NAMESPACE}_{name}'
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """ Returns the values recorded for the given label values """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"'
+                              for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.TYPE}'
+        ]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.samples(self, values))
+        return lines
+
+
+class _CounterValues:
+    __slots__ = ('_value', '_lock')
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not _enabled:
+            return
+        with self._lock:
+            self._value += amount
+
+    def samples(self, metric, values):
+        yield (f'{metric.name}_total{metric._label_text(values)} '
+               f'{_number(self._value)}')
+
+
+class Counter(_Metric):
+    """ Monotonic total, exposed as <name>_total """
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterValues()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class _GaugeValues:
+    __slots__ = ('_value', )
+
+    def __init__(self):
+        self._value = 0
+
+    def set(self, value):
+        if _enabled:
+            self._value = value
+
+    def samples(self, metric, values):
+        yield f'{metric.name}{metric._label_text(values)} {_number(self._value)}'
+
+
+class Gauge(_Metric):
+    """ Last recorded value """
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValues()
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class _HistogramValues:
+    __slots__ = ('_buckets', '_counts', '_sum', '_lock')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # Observations per bucket, the last one is +Inf
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """ Context manager observing the seconds spent in its block """
+        return _Timer(self) if _enabled else _null_timer
+
+    def samples(self, metric, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'), ), counts):
+            cumulative += count
+            labels = metric._label_text(values, [('le', _number(bound))])
+            yield f'{metric.name}_bucket{labels} {cumulative}'
+        labels = metric._label_text(values)
+        yield f'{metric.name}_sum{labels} {_number(total)}'
+        yield f'{metric.name}_count{labels} {cumulative}'
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (latencies in seconds by default) over
+    cumulative buckets, exposed as <name>_bucket, <name>_sum and
+    <name>_count
+    """
+    TYPE = 'histogram'
+
+    def __init__(self,
+                 name,
+                 documentation,
+                 labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValues(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+
+def render():
+    """ Returns every metric in the Prometheus text exposition format """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
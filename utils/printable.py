@@ -1,3 +1,5 @@
 class Printable:
+    __slots__ = ()
+
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
@@ -0,0 +1,135 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from transaction import Transaction
+from utils import metrics
+from wallet import Wallet
+
+logger = logging.getLogger(__name__)
+
+# Batches smaller than this are verified in the calling process
+PARALLEL_THRESHOLD = 64
+# Number of verified signatures remembered
+VERIFIED_CACHE_SIZE = 100000
+
+SIGNATURES = metrics.Counter(
+    'signatures', 'Transaction signatures checked, by result', ['result'])
+SIGNATURE_BATCH_SECONDS = metrics.Histogram(
+    'signature_batch_seconds',
+    'Duration of verifying the uncached signatures of a batch')
+
+
+def _signature_key(transaction):
+    return (transaction.sender, transaction.recipient, transaction.amount,
+            transaction.signature, transaction.scheme, transaction.inputs,
+            transaction.nonce)
+
+
+def _verify_chunk(chunk):
+    return [
+        Wallet.verify_transaction_signature(
+            Transaction(sender, recipient, signature, amount, scheme, inputs,
+                        nonce))
+        for (sender, recipient, amount, signature, scheme, inputs,
+             nonce) in chunk
+    ]
+
+
+class SignatureVerifier:
+    """
+    Verifies transaction signatures in batches. Signatures that were
+    already found valid are remembered, and large batches are split across a
+    process pool. Results are returned in transaction order, so they are the
+    same as verifying the transactions one by one.
+    """
+    def __init__(self, processes=None, cache_size=VERIFIED_CACHE_SIZE):
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.__verified = OrderedDict()
+        self.__executor = None
+        # Guards the cache and the pool, the verifier is shared by threads
+        self.__lock = threading.Lock()
+
+    def close(self):
+        """ Shuts down the worker processes """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def __remember(self, key):
+        self.__verified[key] = True
+        if len(self.__verified) > self.cache_size:
+            self.__verified.popitem(last=False)
+
+    def verify(self, transaction):
+        """ Verifies the signature of a single transaction """
+        return self.verify_all([transaction])[0]
+
+    def verify_all(self, transactions):
+        """
+        Verifies the signatures of a batch of transactions
+
+        Returns
+        -------
+            results (list): True/False for every transaction, in order
+        """
+        keys = [_signature_key(tx) for tx in transactions]
+        with self.__lock:
+            results = [key in self.__verified for key in keys]
+            for key, valid in zip(keys, results):
+                if valid:
+                    self.__verified.move_to_end(key)
+        pending = [index for index, valid in enumerate(results) if not valid]
+        SIGNATURES.labels('cached').inc(len(results) - len(pending))
+        if not pending:
+            return results
+        with SIGNATURE_BATCH_SECONDS.time():
+            verified = self.__verify_pending([keys[index] for index in pending])
+
+        with self.__lock:
+            for index, valid in zip(pending, verified):
+                results[index] = valid
+                if valid:
+                    self.__remember(keys[index])
+        valid_count = sum(verified)
+        SIGNATURES.labels('valid').inc(valid_count)
+        SIGNATURES.labels('invalid').inc(len(verified) - valid_count)
+        return results
+
+    def __verify_pending(self, pending_keys):
+        if self.processes > 1 and len(pending_keys) >= PARALLEL_THRESHOLD:
+            logger.debug(
+                f'Verifying {len(pending_keys)} signatures on {self.processes} processes'
+            )
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = ProcessPoolExecutor(self.processes)
+                executor = self.__executor
+            chunk_size = -(-len(pending_keys) // self.processes)
+            chunks = [
+                pending_keys[start:start + chunk_size]
+                for start in range(0, len(pending_keys), chunk_size)
+            ]
+            return [
+                valid for chunk_results in executor.map(
+                    _verify_chunk, chunks) for valid in chunk_results
+            ]
+        return _verify_chunk(pending_keys)
+
+    def first_invalid(self, transactions):
+        """
+        Returns the position of the first transaction with an invalid
+        signature, or None if all the signatures are valid
+        """
+        for index, valid in enumerate(self.verify_all(transactions)):
+            if not valid:
+                return index
+        return None
+
+
+# Verifier shared by the block chain and the verification helpers
+signature_verifier = SignatureVerifier()
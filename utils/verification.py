@@ -1,64 +1,266 @@
+import math
+import time
+import hashlib
 import logging
-from wallet import Wallet
-from utils.hash_utils import hash_block, hash_string_sha256
+from utils.encoding import (BLOCK_VERSION, BLOCK_VERSION_BINARY,
+                            BLOCK_VERSION_JSON, BLOCK_VERSION_MERKLE,
+                            encode_text, encode_transactions)
+from utils.signature_verifier import signature_verifier
 
 logger = logging.getLogger(__name__)
 
+# Leading zero bits of the proof hash. 8 bits matches the original '00' hex
+# prefix and is used for BLOCK_VERSION_JSON blocks, which don't record a
+# difficulty. Newer blocks must record theirs.
+DEFAULT_DIFFICULTY = 8
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 255
+# Difficulty is retargeted every RETARGET_INTERVAL blocks so that blocks are
+# spaced TARGET_BLOCK_TIME seconds apart
+RETARGET_INTERVAL = 10
+TARGET_BLOCK_TIME = 10
+# Largest change (in bits) of a single retarget
+MAX_RETARGET_STEP = 2
+# How far (in seconds) the timestamp of a block may be ahead of the clock
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
+
 
 class Verification:
     """
     A helper class which provides various static and class based verification functions
     """
     @staticmethod
-    def valid_proof(transactions, previous_hash, proof):
+    def proof_prefix(transactions, previous_hash,
+                     version=BLOCK_VERSION_BINARY):
+        """
+        Returns the bytes of the proof of work guess which don't depend on
+        the proof, so miners can hash them once and reuse the state. Only
+        blocks older than BLOCK_VERSION_MERKLE hash their transactions for
+        the proof; newer ones hash their header (see
+        utils.encoding.encode_header_prefix).
+        """
+        if version == BLOCK_VERSION_JSON:
+            ordered_tx = [tx.to_ordered_dict() for tx in transactions]
+            return (str(ordered_tx) + str(previous_hash)).encode()
+        return encode_transactions(transactions) + encode_text(previous_hash)
+
+    @staticmethod
+    def target(difficulty):
+        """
+        Returns the target as 32 big-endian bytes. A raw sha256 digest
+        satisfies the difficulty if it compares lower than the target, which
+        for equal length bytes is the same as the numeric comparison.
+        """
+        return (1 << (256 - difficulty)).to_bytes(32, 'big')
+
+    @classmethod
+    def valid_hash(cls, guessed_digest, difficulty=DEFAULT_DIFFICULTY):
+        """ Function to check if a raw digest satisfies the difficulty """
+        return guessed_digest < cls.target(difficulty)
+
+    @classmethod
+    def valid_proof(cls,
+                    transactions,
+                    previous_hash,
+                    proof,
+                    difficulty=DEFAULT_DIFFICULTY,
+                    version=BLOCK_VERSION_BINARY):
         """
-        Function to check if the proof satisfies the hashing condition
+        Function to check if the proof of a block older than
+        BLOCK_VERSION_MERKLE satisfies the hashing condition
 
         Parameters
         ----------
             transactions (list): List of open transactions
             previous_hash (string): Hash of the previous block
             proof (integer): proof of work
+            difficulty (integer): Leading zero bits the hash must have
+            version (integer): Version of the block the proof belongs to
 
         Returns
         -------
             True: If the proof satisfies the mentioned condition
             False: If the proof doesn't satisfy the mentioned condition
         """
-        ordered_tx = [tx.to_ordered_dict() for tx in transactions]
-        guess = (str(ordered_tx) + str(previous_hash) + str(proof)).encode()
-        guessed_hash = hash_string_sha256(guess)
+        guess = cls.proof_prefix(transactions, previous_hash,
+                                 version) + str(proof).encode()
+        guessed_digest = hashlib.sha256(guess).digest()
+
+        return cls.valid_hash(guessed_digest, difficulty)
+
+    @staticmethod
+    def block_difficulty(block):
+        """ Returns the difficulty a block was mined with """
+        if block.difficulty is None:
+            return DEFAULT_DIFFICULTY
+        return block.difficulty
+
+    @classmethod
+    def next_difficulty(cls, block_chain, height=None):
+        """
+        Function to compute the difficulty of the block at the given height
+        (by default the next block to be mined). Every RETARGET_INTERVAL
+        blocks the difficulty is adjusted by the log2 ratio of the expected
+        to the actual time spent on the last RETARGET_INTERVAL blocks.
+
+        Returns
+        -------
+            difficulty (integer): Leading zero bits required at the height
+        """
+        if height is None:
+            height = len(block_chain)
+        current = cls.block_difficulty(block_chain[height - 1])
+        # The genesis block has no meaningful timestamp
+        if height % RETARGET_INTERVAL != 0 or height <= RETARGET_INTERVAL:
+            return current
+
+        first = block_chain[height - RETARGET_INTERVAL]
+        last = block_chain[height - 1]
+        actual = last.timestamp - first.timestamp
+        expected = TARGET_BLOCK_TIME * (RETARGET_INTERVAL - 1)
+        if actual <= 0:
+            step = MAX_RETARGET_STEP
+        else:
+            step = round(math.log2(expected / actual))
+            step = max(-MAX_RETARGET_STEP, min(MAX_RETARGET_STEP, step))
+        difficulty = max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, current + step))
+        if difficulty != current:
+            logger.info(f'Retargeting difficulty at height {height}: '
+                        f'{current} -> {difficulty} bits')
+        return difficulty
+
+    @classmethod
+    def valid_header_proof(cls, header):
+        """
+        Function to check the proof of work of a BLOCK_VERSION_MERKLE block
+        from its header alone: the header hash must satisfy the difficulty
+        """
+        return cls.valid_hash(bytes.fromhex(header.hash),
+                              cls.block_difficulty(header))
+
+    @classmethod
+    def __valid_header(cls, block_chain, index):
+        # Checks linking, difficulty and (where the header commits to the
+        # transactions) proof of work of one block against the chain
+        header = block_chain[index]
+        computed_previous_hash = block_chain[index - 1].hash
+        if header.previous_hash != computed_previous_hash:
+            logger.warning(
+                'Computed hash %s for [block_index: %d | block : %s] is not equal to the '
+                'previous hash mentioned in the [block_index: %d | block : %s]',
+                computed_previous_hash, index - 1, block_chain[index - 1],
+                index, header)
+            return False
+        # Rules of a block version hold for every block after the first
+        # block of that version
+        previous_version = block_chain[index - 1].version
+        if not previous_version <= header.version <= BLOCK_VERSION:
+            logger.warning(
+                'Version is older than the previous block or unknown in '
+                '[block_index: %d | block : %s]', index, header)
+            return False
+        # BLOCK_VERSION_JSON blocks mined by one process share the timestamp
+        # the original code took once at startup
+        if (header.version >= BLOCK_VERSION_BINARY
+                and header.timestamp <= block_chain[index - 1].timestamp):
+            logger.warning(
+                'Timestamp is not after the previous block in '
+                '[block_index: %d | block : %s]', index, header)
+            return False
+        if header.timestamp > time.time() + MAX_FUTURE_BLOCK_TIME:
+            logger.warning(
+                'Timestamp is too far in the future in '
+                '[block_index: %d | block : %s]', index, header)
+            return False
+        # Only BLOCK_VERSION_JSON blocks predate recorded difficulties
+        if header.difficulty is None and header.version >= BLOCK_VERSION_BINARY:
+            logger.warning(
+                'Difficulty is missing in [block_index: %d | block : %s]',
+                index, header)
+            return False
+        if (header.difficulty is not None and
+                header.difficulty != cls.next_difficulty(block_chain, index)):
+            logger.warning(
+                'Difficulty does not match the retarget rule in [block_index: %d | block : %s]',
+                index, header)
+            return False
+        if (header.version >= BLOCK_VERSION_MERKLE
+                and not cls.valid_header_proof(header)):
+            logger.warning(
+                'Proof of work is invalid in [block_index: %d | block : %s]',
+                index, header)
+            return False
+        return True
+
+    @classmethod
+    def verify_headers(cls, headers, from_height=1):
+        """
+        Function to verify a chain of block headers without the
+        transactions, as a light client would. Headers of blocks older than
+        BLOCK_VERSION_MERKLE don't commit to their transactions, so their
+        proof of work can't be checked from the header and only their
+        linking and difficulty are.
+
+        Parameters
+        ----------
+            headers (list): Headers (or blocks) of the block chain
+            from_height (integer): First header to verify (default = 1)
 
-        return guessed_hash[0:2] == '00'
+        Returns
+        -------
+            True (Boolean): If the headers form a valid chain
+            False (Boolean): If they don't
+        """
+        logger.info(f'Verifying block headers from height {from_height}')
+        for index in range(max(from_height, 1), len(headers)):
+            if not cls.__valid_header(headers, index):
+                return False
+        return True
 
     @classmethod
-    def verify_chain(cls, block_chain):
+    def verify_chain(cls, block_chain, from_height=1):
         """
-        Function to verify if the current blockchain is valid.
+        Function to verify if the current blockchain is valid. Blocks below
+        from_height are trusted as already verified, so appending blocks to a
+        verified chain only costs the verification of the new blocks.
+        Blocks given as headers (pruned blocks) are verified as headers.
+
+        Parameters
+        ----------
+            block_chain (list): Blocks of the block chain
+            from_height (integer): First block to verify (default = 1, the
+                                   whole chain after the genesis block)
+
         Returns
         -------
             True (Boolean): If blockchain is valid
             False (Boolean): If blockchain is invalid
         """
-        logger.info('Verifying validity of block chain')
-        for index, block in enumerate(block_chain):
-            if index == 0:
-                # No need to validate as the 1st block is always the genesis block
-                continue
-            computed_previous_hash = hash_block(block_chain[index - 1])
-            if block.previous_hash != computed_previous_hash:
-                logger.warning(
-                    f'Computed hash {computed_previous_hash} for [block_index: {index-1} | block : {block_chain[index-1].__dict__}] is not equal to the \
-                    previous hash mentioned in the [block_index: {index} | block : {block.__dict__}]'
-                )
+        logger.info(f'Verifying validity of block chain from height {from_height}')
+        # No need to validate as the 1st block is always the genesis block
+        for index in range(max(from_height, 1), len(block_chain)):
+            if not cls.__valid_header(block_chain, index):
                 return False
+            block = block_chain[index]
+            if not hasattr(block, 'transactions'):
+                # Only the header of a pruned block is left, and was checked
+                continue
+            if block.version >= BLOCK_VERSION_MERKLE:
+                # The header was checked, the transactions must match it
+                if block.merkle_root != block.compute_merkle_root():
+                    logger.warning(
+                        'Merkle root does not match the transactions in [block_index: %d | block : %s]',
+                        index, block)
+                    return False
             # Eliminate the reward transaction when checking if the proof is
             # a valid proof that would satisfy the given hash condition
-            if not cls.valid_proof(block.transactions[:-1],
-                                   block.previous_hash, block.proof):
+            elif not cls.valid_proof(block.transactions[:-1],
+                                     block.previous_hash, block.proof,
+                                     cls.block_difficulty(block),
+                                     block.version):
                 logger.warning(
-                    f'Proof of work is invalid in [block_index: {index} | block : {block.__dict__}]'
-                )
+                    'Proof of work is invalid in [block_index: %d | block : %s]',
+                    index, block)
                 return False
 
         return True
@@ -79,14 +281,14 @@ class Verification:
             True (Boolean): If the transaction is valid
             False (Boolean): If the transaction is invalid
         """
-        sender_balance = get_balances()
+        sender_balance = get_balances(transaction.sender)
         if check_funds:
             if transaction.amount > sender_balance:
                 logger.warning(
-                    'Transaction amount higher than available funds || Transaction: {} & Available funds: {}'
-                    .format(transaction, sender_balance))
+                    'Transaction amount higher than available funds || Transaction: %s & Available funds: %s',
+                    transaction, sender_balance)
                 return False
-        if not Wallet.verify_transaction_signature(transaction):
+        if not signature_verifier.verify(transaction):
             logger.warning('Invalid transaction signature.')
             return False
         return True
@@ -94,7 +296,9 @@ class Verification:
     @classmethod
     def verify_transactions(cls, open_transactions, get_balances):
         """ Function to verify if all the open transactions are valid """
-        return all([
-            cls.verify_transaction(tx, get_balances, check_funds=False)
-            for tx in open_transactions
-        ])
+        invalid = signature_verifier.first_invalid(open_transactions)
+        if invalid is not None:
+            logger.warning(
+                f'Invalid transaction signature at position {invalid}.')
+            return False
+        return True
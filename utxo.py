@@ -0,0 +1,304 @@
+import struct
+import logging
+from collections import defaultdict
+
+from utils.encoding import (BLOCK_VERSION_UNIQUE_IDS, Decoder, encode_number,
+                            encode_text)
+
+logger = logging.getLogger(__name__)
+
+# Sender of the reward transactions, which spend nothing
+REWARD_SENDER = 'MINING'
+# Rounding allowed when the float amounts of outputs are summed
+AMOUNT_TOLERANCE = 1e-9
+# Outputs are ordered by where they were created: the block height, the
+# position of the transaction in the block and the output index, packed
+# into one integer
+POSITION_BITS = 32
+# Blocks below the tip whose changes are kept to revert them, a deeper
+# reorganization builds the set again from the chain
+UNDO_BLOCKS = 288
+# Most outputs of a transaction, see transaction_outputs
+MAX_OUTPUTS = 2
+_OUTPOINT = struct.Struct('>32sI')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+
+
+class InvalidSpend(ValueError):
+    """ A transaction spends outputs that are not unspent outputs it owns """
+
+
+def transaction_outputs(transaction, spent):
+    """
+    Returns the (owner, amount) outputs of a transaction which spent the
+    given total: the amount goes to the recipient (output 0) and what is
+    left over back to the sender (output 1)
+    """
+    outputs = [(transaction.recipient, transaction.amount)]
+    change = spent - transaction.amount
+    if change > AMOUNT_TOLERANCE:
+        outputs.append((transaction.sender, change))
+    return outputs
+
+
+class UtxoSet:
+    """
+    Unspent outputs of the mined transactions, by (transaction id, output
+    index) and by owner. Transactions naming their inputs spend exactly
+    those outputs, which must be unspent and owned by the sender.
+    Transactions without inputs spend the oldest outputs of the sender
+    until the amount is covered, so the outputs of an address always add up
+    to its balance and both kinds of transactions can be mixed.
+
+    The ids of all mined transactions are kept, and blocks from
+    BLOCK_VERSION_UNIQUE_IDS on can't repeat one. Older blocks could (every
+    reward of a miner, or a payment signed again before there were
+    nonces): the outputs of the n-th repeat are numbered from
+    n * MAX_OUTPUTS on, so no output is merged into another. The changes
+    made by the last UNDO_BLOCKS blocks are logged to revert them.
+    """
+    def __init__(self):
+        # (owner, amount, created) of every unspent output
+        self.__outputs = {}
+        # Unspent outputs of every owner, oldest first, with their created
+        self.__by_owner = defaultdict(dict)
+        # (outpoint, previous output or None) changed by the last blocks by
+        # height, in the order of the changes
+        self.__changes = {}
+        # Number of mined transactions with the id by the raw id
+        self.__ids = {}
+
+    def __len__(self):
+        return len(self.__outputs)
+
+    def __contains__(self, outpoint):
+        return tuple(outpoint) in self.__outputs
+
+    def has_transaction(self, tx_id):
+        """ Returns whether a transaction with the id was mined """
+        return bytes.fromhex(tx_id) in self.__ids
+
+    def get(self, outpoint):
+        """ Returns (owner, amount) of an unspent output, or None """
+        output = self.__outputs.get(tuple(outpoint))
+        return None if output is None else output[:2]
+
+    def outputs(self, owner):
+        """ Returns the unspent (outpoint, amount) of an owner by age """
+        return [(outpoint, self.__outputs[outpoint][1])
+                for outpoint in self.__by_owner.get(owner, ())]
+
+    def check_inputs(self, transaction, claimed=()):
+        """
+        Checks that the inputs of a transaction are distinct unspent
+        outputs of its sender, none of them in claimed, covering its amount
+
+        Returns
+        -------
+            total (float): Sum of the spent outputs
+
+        Raises
+        ------
+            InvalidSpend: If the inputs can't be spent by the transaction
+        """
+        if len(set(transaction.inputs)) != len(transaction.inputs):
+            raise InvalidSpend('Output spent twice by the transaction')
+        total = 0
+        for outpoint in transaction.inputs:
+            output = self.__outputs.get(outpoint)
+            if output is None or outpoint in claimed:
+                raise InvalidSpend(f'Output {outpoint} is not unspent')
+            if output[0] != transaction.sender:
+                raise InvalidSpend(f'Output {outpoint} is not the sender\'s')
+            total += output[1]
+        if total < transaction.amount - AMOUNT_TOLERANCE:
+            raise InvalidSpend('Inputs do not cover the amount')
+        return total
+
+    def apply_block(self, block):
+        """
+        Spends the inputs and adds the outputs of the transactions of a
+        mined block. A block with an invalid spend is left unapplied.
+
+        Raises
+        ------
+            InvalidSpend: If a transaction spends outputs it can't
+        """
+        changes = []
+        applied = []
+        try:
+            for position, tx in enumerate(block.transactions):
+                raw_id = bytes.fromhex(tx.id)
+                copies = self.__ids.get(raw_id, 0)
+                if copies and block.version >= BLOCK_VERSION_UNIQUE_IDS:
+                    raise InvalidSpend(f'Transaction {tx.id} was already '
+                                       f'mined')
+                if tx.inputs:
+                    total = self.check_inputs(tx)
+                    for outpoint in tx.inputs:
+                        self.__set(outpoint, None, changes)
+                elif tx.sender == REWARD_SENDER:
+                    total = tx.amount
+                else:
+                    total = self.__take_oldest(tx.sender, tx.amount, changes)
+                base = ((block.index << POSITION_BITS) | position) << 1
+                for index, (owner, amount) in enumerate(
+                        transaction_outputs(tx, total)):
+                    self.__set((tx.id, copies * MAX_OUTPUTS + index),
+                               (owner, amount, base | index), changes)
+                self.__ids[raw_id] = copies + 1
+                applied.append(raw_id)
+        except InvalidSpend:
+            self.__undo(changes)
+            self.__forget(applied)
+            raise
+        self.__changes[block.index] = changes
+        self.__changes.pop(block.index - UNDO_BLOCKS, None)
+
+    def can_revert(self, block):
+        """ Returns whether the changes of the block are still logged """
+        return block.index in self.__changes
+
+    def revert_block(self, block):
+        """
+        Undoes apply_block for a block dropped by a reorganization, which
+        must be one the set can_revert
+        """
+        self.__undo(self.__changes.pop(block.index))
+        self.__forget(bytes.fromhex(tx.id) for tx in block.transactions)
+
+    def __forget(self, raw_ids):
+        for raw_id in raw_ids:
+            copies = self.__ids.pop(raw_id) - 1
+            if copies:
+                self.__ids[raw_id] = copies
+
+    def __set(self, outpoint, output, changes):
+        previous = self.__outputs.get(outpoint)
+        if changes is not None:
+            changes.append((outpoint, previous))
+        if previous is not None:
+            del self.__outputs[outpoint]
+            owned = self.__by_owner[previous[0]]
+            del owned[outpoint]
+            if not owned:
+                del self.__by_owner[previous[0]]
+        if output is not None:
+            self.__outputs[outpoint] = output
+            self.__by_owner[output[0]][outpoint] = output[2]
+
+    def __take_oldest(self, owner, amount, changes):
+        # Balance checks already made sure the sender has the funds
+        total = 0
+        taken = []
+        for outpoint in self.__by_owner.get(owner, ()):
+            if total >= amount - AMOUNT_TOLERANCE:
+                break
+            taken.append(outpoint)
+            total += self.__outputs[outpoint][1]
+        for outpoint in taken:
+            self.__set(outpoint, None, changes)
+        return total
+
+    def __undo(self, changes):
+        owners = set()
+        for outpoint, previous in reversed(changes):
+            self.__set(outpoint, previous, None)
+            if previous is not None:
+                owners.add(previous[0])
+        # Restored outputs go back to their place among the oldest
+        for owner in owners & set(self.__by_owner):
+            owned = self.__by_owner[owner]
+            self.__by_owner[owner] = dict(
+                sorted(owned.items(), key=lambda item: item[1]))
+
+    def to_bytes(self):
+        """
+        Encodes the unspent outputs, the changes of every block and the ids
+        of the mined transactions, each output as its outpoint, owner (as
+        text, see utils.encoding), amount (as number) and u64 creation
+        order, each id as its raw bytes and u32 number of transactions
+        """
+        parts = [_U32.pack(len(self.__outputs))]
+        for outpoint, output in self.__outputs.items():
+            parts.append(_encode_output(outpoint, *output))
+        parts.append(_U32.pack(len(self.__changes)))
+        for height, changes in self.__changes.items():
+            parts.append(_U64.pack(height) + _U32.pack(len(changes)))
+            for outpoint, previous in changes:
+                if previous is None:
+                    parts.append(b'\x00' + _encode_outpoint(outpoint))
+                else:
+                    parts.append(b'\x01' + _encode_output(outpoint, *previous))
+        parts.append(_U32.pack(len(self.__ids)))
+        for raw_id, copies in self.__ids.items():
+            parts.append(raw_id + _U32.pack(copies))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """
+        Builds the set from the encoding produced by to_bytes
+
+        Returns
+        -------
+            (utxos, offset): The set and the offset after its encoding
+        """
+        utxos = cls()
+        decoder = Decoder(data, offset)
+        count = _unpack(decoder, _U32)
+        outputs = sorted((_decode_output(decoder) for _ in range(count)),
+                         key=lambda output: output[1][2])
+        for outpoint, output in outputs:
+            utxos.__set(outpoint, output, None)
+        for _ in range(_unpack(decoder, _U32)):
+            height = _unpack(decoder, _U64)
+            utxos.__changes[height] = [
+                _decode_change(decoder)
+                for _ in range(_unpack(decoder, _U32))
+            ]
+        for _ in range(_unpack(decoder, _U32)):
+            raw_id = bytes(decoder.data[decoder.offset:decoder.offset + 32])
+            decoder.offset += 32
+            utxos.__ids[raw_id] = _unpack(decoder, _U32)
+        return utxos, decoder.offset
+
+
+def _unpack(decoder, fmt):
+    value, = fmt.unpack_from(decoder.data, decoder.offset)
+    decoder.offset += fmt.size
+    return value
+
+
+def _encode_outpoint(outpoint):
+    tx_id, index = outpoint
+    return _OUTPOINT.pack(bytes.fromhex(tx_id), index)
+
+
+def _encode_output(outpoint, owner, amount, created):
+    return b''.join((_encode_outpoint(outpoint), encode_text(owner),
+                     encode_number(amount), _U64.pack(created)))
+
+
+def _decode_outpoint(decoder):
+    raw_id, index = _OUTPOINT.unpack_from(decoder.data, decoder.offset)
+    decoder.offset += _OUTPOINT.size
+    return raw_id.hex(), index
+
+
+def _decode_output(decoder):
+    outpoint = _decode_outpoint(decoder)
+    owner = decoder.text()
+    amount = decoder.number()
+    return outpoint, (owner, amount, _unpack(decoder, _U64))
+
+
+def _decode_change(decoder):
+    # A zero byte and the outpoint of an output the block added, or a one
+    # byte and an output the block changed or spent as it was before
+    changed = decoder.data[decoder.offset]
+    decoder.offset += 1
+    if changed:
+        return _decode_output(decoder)
+    return _decode_outpoint(decoder), None
@@ -1,23 +1,182 @@
 import logging
 import binascii
+import functools
 import Crypto.Random
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import DSS, PKCS1_v1_5, eddsa
+
+from utils.encoding import (SCHEME_ECDSA, SCHEME_ED25519, SCHEME_RSA,
+                            is_canonical_hex)
+
+# The cryptography package (OpenSSL) signs and verifies Ed25519 and ECDSA
+# an order of magnitude faster than pycryptodome, which is used without it.
+# Both produce the same keys and signatures.
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+    from cryptography.hazmat.primitives.asymmetric.utils import (
+        decode_dss_signature, encode_dss_signature)
+except ImportError:
+    InvalidSignature = ValueError
+    ec = ed25519 = None
+else:
+    # RFC 6979 signatures, like pycryptodome's, where OpenSSL has them: the
+    # same transaction signed twice keeps its id
+    try:
+        ECDSA_SIGNING = ec.ECDSA(hashes.SHA256(), deterministic_signing=True)
+    except TypeError:
+        ECDSA_SIGNING = ec.ECDSA(hashes.SHA256())
 
 logger = logging.getLogger(__name__)
 
+# Number of parsed sender public keys kept in memory
+PUBLIC_KEY_CACHE_SIZE = 1024
+RSA_KEY_SIZE = 1024
+SCHEMES = (SCHEME_RSA, SCHEME_ED25519, SCHEME_ECDSA)
+# Order of the P-256 group. ECDSA signatures are only valid with s in the
+# lower half, as (r, s) and (r, n - s) would otherwise both be valid and a
+# signature could be altered into a new transaction id.
+P256_ORDER = int(
+    'ffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551', 16)
+
+
+def transaction_message(sender, recipient, amount, inputs=(), nonce=None):
+    """
+    Returns the bytes a transaction's signature covers, the spent outputs
+    and the nonce included. Every output ends with ';' and amounts never
+    do, so no message of a transaction with inputs is one of a transaction
+    without. The nonce comes first and ends with '#', which a sender key
+    never holds, so no message of a transaction with a nonce is one of a
+    transaction without.
+    """
+    prefix = '' if nonce is None else f'{nonce}#'
+    return (prefix + str(sender) + str(recipient) + str(amount) +
+            ''.join(f'{tx_id}:{index};'
+                    for tx_id, index in inputs)).encode('utf8')
+
+
+@functools.lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def import_public_key(public_key, scheme=SCHEME_RSA):
+    """
+    Parses a hex encoded public key, caching recently used keys. RSA keys
+    are DER encoded, Ed25519 keys are their 32 raw bytes and ECDSA (P-256)
+    keys are compressed SEC1 points.
+    """
+    raw = binascii.unhexlify(public_key)
+    if scheme == SCHEME_RSA:
+        return RSA.importKey(raw)
+    if scheme == SCHEME_ED25519:
+        if ed25519 is not None:
+            return ed25519.Ed25519PublicKey.from_public_bytes(raw)
+        return eddsa.import_public_key(raw)
+    if scheme == SCHEME_ECDSA:
+        if ec is not None:
+            return ec.EllipticCurvePublicKey.from_encoded_point(
+                ec.SECP256R1(), raw)
+        return ECC.import_key(raw, curve_name='p256')
+    raise ValueError(f'Unknown signature scheme {scheme}')
+
+
+def new_signer(private_key, scheme=SCHEME_RSA):
+    """
+    Parses a hex encoded private key (DER for RSA, the 32 byte seed for
+    Ed25519, the 32 byte secret scalar for ECDSA)
+
+    Returns
+    -------
+        sign (callable): Returns the signature of the message bytes
+    """
+    raw = binascii.unhexlify(private_key)
+    if scheme == SCHEME_RSA:
+        signer = PKCS1_v1_5.new(RSA.importKey(raw))
+        return lambda message: signer.sign(SHA256.new(message))
+    if scheme == SCHEME_ED25519:
+        if ed25519 is not None:
+            return ed25519.Ed25519PrivateKey.from_private_bytes(raw).sign
+        return eddsa.new(eddsa.import_private_key(raw), 'rfc8032').sign
+    if scheme == SCHEME_ECDSA:
+        secret = int.from_bytes(raw, 'big')
+        if ec is not None:
+            key = ec.derive_private_key(secret, ec.SECP256R1())
+
+            def sign(message):
+                r, s = decode_dss_signature(key.sign(message, ECDSA_SIGNING))
+                return _ecdsa_signature(r, s)
+
+            return sign
+        signer = DSS.new(ECC.construct(curve='p256', d=secret),
+                         'deterministic-rfc6979')
+
+        def sign(message):
+            signature = signer.sign(SHA256.new(message))
+            return _ecdsa_signature(int.from_bytes(signature[:32], 'big'),
+                                    int.from_bytes(signature[32:], 'big'))
+
+        return sign
+    raise ValueError(f'Unknown signature scheme {scheme}')
+
+
+def _ecdsa_signature(r, s):
+    # Fixed size r || s with s in the lower half of the group
+    s = min(s, P256_ORDER - s)
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
+def verify_signature(public_key, scheme, message, signature):
+    """
+    Verifies the signature of the message bytes with the hex encoded public
+    key. Malformed keys raise ValueError.
+
+    Returns
+    -------
+        True (Boolean): If the signature is valid
+    """
+    key = import_public_key(public_key, scheme)
+    if scheme == SCHEME_RSA:
+        return PKCS1_v1_5.new(key).verify(SHA256.new(message), signature)
+    try:
+        if scheme == SCHEME_ED25519:
+            if ed25519 is not None:
+                key.verify(signature, message)
+            else:
+                eddsa.new(key, 'rfc8032').verify(message, signature)
+            return True
+        if len(signature) != 64:
+            return False
+        r = int.from_bytes(signature[:32], 'big')
+        s = int.from_bytes(signature[32:], 'big')
+        if not 0 < s <= P256_ORDER // 2:
+            return False
+        if ec is not None:
+            key.verify(encode_dss_signature(r, s), message,
+                       ec.ECDSA(hashes.SHA256()))
+        else:
+            DSS.new(key, 'fips-186-3').verify(SHA256.new(message), signature)
+        return True
+    except (InvalidSignature, ValueError):
+        return False
+
 
 class Wallet:
-    def __init__(self):
+    def __init__(self, node_id=None, scheme=SCHEME_RSA):
         self.private_key = None
         self.public_key = None
+        # Signature scheme of the keys created by create_keys, loaded keys
+        # bring their own
+        self.scheme = scheme
+        # Nodes sharing a directory keep their keys in separate files
+        self.path = 'wallet.txt' if node_id is None else f'wallet-{node_id}.txt'
+        # Signer parsed from the private key, rebuilt when the keys change
+        self.__signer = None
+        self.__signer_key = None
 
-    def create_keys(self):
+    def create_keys(self, randfunc=None):
         """
         Function to create private and public keys to validate transactions
         """
-        private_key, public_key = self.generate_keys()
+        private_key, public_key = self.generate_keys(randfunc)
         self.private_key = private_key
         self.public_key = public_key
 
@@ -27,10 +186,12 @@ class Wallet:
         """
         if not (self.public_key is None and self.private_key is None):
             try:
-                with open('wallet.txt', 'w') as f:
+                with open(self.path, 'w') as f:
                     f.write(self.public_key)
                     f.write("\n")
                     f.write(self.private_key)
+                    f.write("\n")
+                    f.write(self.scheme)
                 return True
             except (IOError,
                     IndexError):  # IndexError - File exists but is empty
@@ -40,48 +201,81 @@ class Wallet:
 
     def load_keys(self):
         """
-        Function to load keys from the disk
+        Function to load keys from the disk. Wallets saved before there were
+        other schemes hold RSA keys.
         """
         try:
-            with open('wallet.txt', 'r') as f:
-                keys = f.readlines()
-                # All characters except the line break
-                self.public_key = keys[0][:-1]
+            with open(self.path, 'r') as f:
+                keys = f.read().splitlines()
+                self.public_key = keys[0]
                 self.private_key = keys[1]
+                self.scheme = keys[2] if len(keys) > 2 else SCHEME_RSA
             return True
         except (IOError, IndexError):
             logger.error('Loading wallet failed')
             print('Loading wallet failed')
             return False
 
-    def generate_keys(self):
+    def generate_keys(self, randfunc=None):
         """
-        Function to generate private and public keys
+        Function to generate private and public keys of the wallet's scheme.
+        randfunc (returning n random bytes) replaces the system randomness,
+        e.g. to derive reproducible keys from a seeded generator.
         """
-        private_key = RSA.generate(1024, Crypto.Random.new().read)
-        public_key = private_key.publickey()
-        # Returning string representation of the key
-        return (binascii.hexlify(
-            private_key.exportKey(format='DER')).decode('ascii'),
-                binascii.hexlify(
-                    public_key.exportKey(format='DER')).decode('ascii'))
-
-    def sign_transaction(self, sender, recipient, amount):
-        signer = PKCS1_v1_5.new(
-            RSA.importKey(binascii.unhexlify(self.private_key)))
-        hhash = SHA256.new(
-            (str(sender) + str(recipient) + str(amount)).encode('utf8'))
-
-        signature = signer.sign(hhash)
+        if randfunc is None:
+            randfunc = Crypto.Random.new().read
+        if self.scheme == SCHEME_RSA:
+            private_key = RSA.generate(RSA_KEY_SIZE, randfunc)
+            public_key = private_key.publickey()
+            # Returning string representation of the key
+            return (binascii.hexlify(
+                private_key.exportKey(format='DER')).decode('ascii'),
+                    binascii.hexlify(
+                        public_key.exportKey(format='DER')).decode('ascii'))
+        if self.scheme == SCHEME_ED25519:
+            private_key = ECC.generate(curve='ed25519', randfunc=randfunc)
+            private_raw = private_key.seed
+            public_raw = private_key.public_key().export_key(format='raw')
+        elif self.scheme == SCHEME_ECDSA:
+            private_key = ECC.generate(curve='p256', randfunc=randfunc)
+            private_raw = int(private_key.d).to_bytes(32, 'big')
+            public_raw = private_key.public_key().export_key(format='SEC1',
+                                                             compress=True)
+        else:
+            raise ValueError(f'Unknown signature scheme {self.scheme}')
+        return (binascii.hexlify(private_raw).decode('ascii'),
+                binascii.hexlify(public_raw).decode('ascii'))
+
+    def __get_signer(self):
+        key = (self.private_key, self.scheme)
+        if self.__signer_key != key:
+            self.__signer = new_signer(self.private_key, self.scheme)
+            self.__signer_key = key
+        return self.__signer
+
+    def sign_transaction(self, sender, recipient, amount, inputs=(),
+                         nonce=None):
+        signature = self.__get_signer()(
+            transaction_message(sender, recipient, amount, inputs, nonce))
         return binascii.hexlify(signature).decode('ascii')
 
     @staticmethod
     def verify_transaction_signature(transaction):
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        hhash = SHA256.new(
-            (str(transaction.sender) + str(transaction.recipient) +
-             str(transaction.amount)).encode('utf8'))
-
-        return verifier.verify(hhash, binascii.unhexlify(
-            transaction.signature))  # Returns Boolean value
+        # Upper case hex verifies as well but would give a mined transaction
+        # another id, so it could be mined again
+        if not (is_canonical_hex(transaction.sender)
+                and is_canonical_hex(transaction.signature)):
+            logger.warning('Sender key or signature is not lower case hex')
+            return False
+        try:
+            return verify_signature(
+                transaction.sender, transaction.scheme,
+                transaction_message(transaction.sender,
+                                    transaction.recipient,
+                                    transaction.amount, transaction.inputs,
+                                    transaction.nonce),
+                binascii.unhexlify(transaction.signature))
+        except (ValueError, TypeError, IndexError):
+            # Senders and signatures sent by clients may not be keys at all
+            logger.warning('Malformed sender key or signature')
+            return False